@@ -0,0 +1,425 @@
+# src/ai/async_gemini_client.py
+from __future__ import annotations
+
+import asyncio
+import queue
+import threading
+import time
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional
+
+from src.ai.gemini_client import CallResult, GeminiClient, GeminiConfig, StreamStatus, parse_check
+from src.ai.hedging import is_valid_text
+from src.ai.llm_backends import LENGTH_FINISH_REASONS, LLMBackend, take_finish_reason, take_usage
+from src.ai.rate_limit import TokenBucket, estimate_tokens
+from src.ai.resilience import LLMCallError
+from src.ai.response_cache import ResponseCache
+from src.ai.response_parser import parse_structured
+from src.ai.single_flight import AsyncSingleFlight
+from src.ai.telemetry import LLMTelemetry
+
+
+class AsyncGeminiClient:
+    """
+    Versione asyncio di GeminiClient: stesso contratto di generate_content (testo, "{}" in caso di errore),
+    ma awaitable.
+
+    - Un solo backend/connessione condiviso da tutti i chiamanti.
+    - Semaforo sulle chiamate contemporanee (config.max_concurrency).
+    - Token bucket lato client per richieste/minuto e token/minuto (0 = nessun limite),
+      così prefetch, pre-generazione esame e GUI non sforano la quota.
+    """
+
+    def __init__(self, config: GeminiConfig, backend: Optional[LLMBackend] = None):
+        self.config = config
+        # Riusa configurazione, backend, cache, retry e breaker del client sincrono
+        self._client = GeminiClient(config, backend)
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.requests_bucket = TokenBucket(config.requests_per_minute)
+        self.tokens_bucket = TokenBucket(config.tokens_per_minute)
+        self.single_flight = AsyncSingleFlight()
+
+    @property
+    def cache(self) -> Optional[ResponseCache]:
+        return self._client.cache
+
+    def cache_stats(self) -> Dict[str, Any]:
+        return self._client.cache_stats()
+
+    def coalesce_stats(self) -> Dict[str, Any]:
+        return self.single_flight.stats()
+
+    @property
+    def circuit_open(self) -> bool:
+        # Breaker condiviso con il client sincrono interno
+        return self._client.circuit_open
+
+    def router_stats(self) -> Dict[str, Any]:
+        return self._client.router_stats()
+
+    def hedge_stats(self) -> Dict[str, Any]:
+        # Budget degli hedge condiviso con il client sincrono interno
+        return self._client.hedge_stats()
+
+    @property
+    def telemetry(self) -> LLMTelemetry:
+        # Telemetria condivisa con il client sincrono interno (stesso eventuale dump su disco)
+        return self._client.telemetry
+
+    def telemetry_stats(self) -> Dict[str, Any]:
+        return self._client.telemetry_stats()
+
+    async def generate_content(self, prompt: str, use_cache: bool = True, call_type: str = "default",
+                               profile: str = "default", interactive: bool = False,
+                               call_site: Optional[str] = None) -> str:
+        # Stesse regole di GeminiClient.generate_content (coalescenza solo con use_cache=True, router per call_type,
+        # parametri dal profilo di generazione, hedging solo se interactive, telemetria per call_site)
+        site = call_site or call_type
+        params = self._client._generation_params(profile)
+        if not use_cache:
+            return await self._fetch_and_store(None, prompt, params, call_type, interactive, site)
+
+        key = self._client._cache_key(call_type, params, prompt)
+        primary = self._client.router.primary(call_type)
+        if self.cache:
+            started = time.monotonic()
+            cached = await asyncio.to_thread(self.cache.get, key)
+            if cached is not None:
+                self._client._record_call(site, primary, "cache_hit", started, prompt, cached)
+                return cached
+
+        if not self.config.coalesce_requests:
+            return await self._fetch_and_store(key, prompt, params, call_type, interactive, site)
+        started = time.monotonic()
+        text, shared = await self.single_flight.do(
+            key, lambda: self._fetch_and_store(key, prompt, params, call_type, interactive, site))
+        if shared:
+            self._client._record_call(site, primary, "coalesced", started, prompt, text)
+        return text
+
+    async def _fetch_and_store(self, key: Optional[str], prompt: str, params: Dict[str, Any],
+                               call_type: str = "default", interactive: bool = False,
+                               call_site: Optional[str] = None) -> str:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(max(1, self.config.max_concurrency))
+
+        text = (await self._call(prompt, params, call_type, interactive, call_site=call_site)).text
+
+        if text != "{}":
+            self.tokens_bucket.charge(estimate_tokens(text))
+            if key is not None and self.cache:
+                try:
+                    await asyncio.to_thread(self.cache.put, key, text)
+                except Exception as e:
+                    print(f"[GEMINI-ASYNC] Errore scrittura cache: {e}")
+        return text
+
+    async def generate_json(self, prompt: str, schema: Optional[Dict[str, Any]] = None,
+                            use_cache: bool = False, call_type: str = "default",
+                            profile: str = "question_json", interactive: bool = False,
+                            call_site: Optional[str] = None) -> Any:
+        """Versione asincrona di GeminiClient.generate_json (stessi errori tipizzati)."""
+        site = call_site or call_type
+        params = self._client._json_params(schema, profile)
+        key = None
+        if self.cache and use_cache:
+            key = self._client._cache_key(call_type, params, prompt)
+            started = time.monotonic()
+            cached = await asyncio.to_thread(self.cache.get, key)
+            if cached is not None:
+                self._client._record_call(site, self._client.router.primary(call_type), "cache_hit",
+                                          started, prompt, cached)
+                return parse_structured(cached, schema)
+
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(max(1, self.config.max_concurrency))
+
+        result = await self._call(prompt, params, call_type, interactive, parse_check(schema), site)
+        self.tokens_bucket.charge(estimate_tokens(result.received or result.text))
+        data = self._client._parse_recorded(result, schema, site)
+        if key is not None:
+            try:
+                await asyncio.to_thread(self.cache.put, key, result.text)
+            except Exception as e:
+                print(f"[GEMINI-ASYNC] Errore scrittura cache: {e}")
+        return data
+
+    async def stream_content(self, prompt: str, use_cache: bool = True, call_type: str = "default",
+                             profile: str = "default", status: Optional[StreamStatus] = None,
+                             call_site: Optional[str] = None) -> AsyncIterator[str]:
+        """Versione asincrona di GeminiClient.stream_content (stesse regole di fallback e cache, stesso status)."""
+        site = call_site or call_type
+        status = status if status is not None else StreamStatus()
+        params = self._client._generation_params(profile)
+        key = None
+        if self.cache and use_cache:
+            key = self._client._cache_key(call_type, params, prompt)
+            started = time.monotonic()
+            cached = await asyncio.to_thread(self.cache.get, key)
+            if cached is not None:
+                self._client._record_call(site, self._client.router.primary(call_type), "cache_hit",
+                                          started, prompt, cached)
+                status.outcome = "cache_hit"
+                yield cached
+                return
+
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(max(1, self.config.max_concurrency))
+
+        router = self._client.router
+        model = router.choose(call_type)
+        try:
+            backend = self._client._backend_for(model)
+        except LLMCallError:
+            backend = None
+        if not backend or self.circuit_open:
+            result = await self._call_with_retry(prompt, params, call_type, call_site=site)
+            status.outcome = result.outcome
+            yield result.text
+            return
+
+        parts: List[str] = []
+        complete = False
+        truncated = False
+        fallback: Optional[CallResult] = None  # la chiamata di ripiego registra da sé la propria telemetria
+        await self.requests_bucket.acquire(1)
+        await self.tokens_bucket.acquire(estimate_tokens(prompt))
+        started = time.monotonic()
+        try:
+            async with self._semaphore:
+                started = time.monotonic()
+                take_finish_reason()  # scarta un valore rimasto da una chiamata precedente
+                async for piece in backend.astream(prompt, params):
+                    parts.append(piece)
+                    yield piece
+            self._client.breaker.record_success()
+            router.record(model, time.monotonic() - started, True)
+            complete = True
+            truncated = take_finish_reason() in LENGTH_FINISH_REASONS
+        except LLMCallError as e:
+            print(f"[GEMINI-ASYNC] Errore streaming (Modello: {model}): {e}")
+            router.record(model, time.monotonic() - started, False)
+            if not parts:
+                self._client.breaker.record_failure()
+                fallback = await self._call_with_retry(prompt, params, call_type, call_site=site)
+                status.outcome = fallback.outcome
+                parts.append(fallback.text)
+                complete = True
+                yield fallback.text
+
+        if not parts:
+            self._client._record_call(site, model, "empty", started, prompt, stream=True)
+            status.outcome = "empty"
+            yield "{}"
+            return
+
+        text = "".join(parts)
+        if fallback is None:
+            status.outcome = "truncated" if truncated else ("ok" if complete else "partial")
+            self._client._record_call(site, model, status.outcome, started, prompt, text, stream=True)
+        self.tokens_bucket.charge(estimate_tokens(text))
+        if key is not None and status.clean and text != "{}":
+            try:
+                await asyncio.to_thread(self.cache.put, key, text)
+            except Exception as e:
+                print(f"[GEMINI-ASYNC] Errore scrittura cache: {e}")
+
+    async def _call(self, prompt: str, params: Dict[str, Any], call_type: str = "default", interactive: bool = False,
+                    is_valid: Optional[Callable[[str], bool]] = None, call_site: Optional[str] = None) -> CallResult:
+        """
+        Come GeminiClient._call: per le chiamate interattive, se la risposta tarda oltre hedge_delay parte
+        un duplicato (budget condiviso). I tentativi non registrano nulla: si registra una sola chiamata logica,
+        quella del vincitore (il primo con is_valid(testo)); il perdente viene cancellato.
+        """
+        site = call_site or call_type
+        if not (interactive and self.config.hedge_interactive):
+            return await self._call_with_retry(prompt, params, call_type, call_site=site)
+        client = self._client
+        check = is_valid or is_valid_text
+        budget = client.hedge_budget
+        budget.on_request()
+        delay = client.hedge_delay(call_type)
+        started = time.monotonic()
+        primary = asyncio.ensure_future(self._call_with_retry(prompt, params, call_type, deferred=True))
+        hedge: Optional[asyncio.Future] = None
+        result: Optional[CallResult] = None
+        fallback: Optional[CallResult] = None
+        try:
+            if delay is not None:
+                done, _ = await asyncio.wait({primary}, timeout=delay)
+                if not done and budget.try_acquire():
+                    hedge = asyncio.ensure_future(self._call_with_retry(prompt, params, call_type, deferred=True))
+            pending = {primary} if hedge is None else {primary, hedge}
+            while pending and result is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        print(f"[HEDGE] Errore chiamata: {task.exception()}")
+                        continue
+                    candidate = task.result()
+                    if check(candidate.text):
+                        if task is hedge:
+                            budget.record_win()
+                        result = candidate
+                        break
+                    if fallback is None:
+                        fallback = candidate
+        except asyncio.CancelledError:
+            # Chiamante cancellato: una sola chiamata logica "cancelled"
+            client._settle(CallResult("{}", "cancelled", model=client.router.primary(call_type), started=started),
+                           site, prompt)
+            raise
+        finally:
+            # Il perdente (o tutto, se il chiamante viene cancellato) si ferma subito
+            for task in (primary, hedge):
+                if task is not None and not task.done():
+                    task.cancel()
+        result = result or fallback or CallResult("{}", "error", model=client.router.primary(call_type),
+                                                  started=started)
+        if result.outcome == "ok":
+            client.hedge_latencies.record(call_type, result.latency_sec)
+        return client._settle(result, site, prompt)
+
+    async def _call_with_retry(self, prompt: str, params: Dict[str, Any], call_type: str = "default",
+                               deferred: bool = False, call_site: Optional[str] = None) -> CallResult:
+        # Stessa politica del client sincrono (retry con backoff + circuit breaker, modello scelto dal router
+        # a ogni tentativo, "truncated" senza retry, esito finale registrato da _settle salvo deferred),
+        # ma con sleep asincrone
+        breaker = self._client.breaker
+        router = self._client.router
+        policy = self._client.retry_policy
+        call_started = time.monotonic()
+        model, attempts, outcome, text, received = router.primary(call_type), 0, "error", "{}", ""
+        latency, usage = 0.0, None
+        try:
+            for attempt in range(policy.max_attempts):
+                if not breaker.allow():
+                    outcome = "circuit_open"
+                    break
+                await self.requests_bucket.acquire(1)
+                await self.tokens_bucket.acquire(estimate_tokens(prompt))
+                model = router.choose(call_type)
+                attempts += 1
+                started = time.monotonic()
+                try:
+                    async with self._semaphore:
+                        # La latenza registrata esclude l'attesa del semaforo
+                        started = time.monotonic()
+                        take_finish_reason()  # scarta un valore rimasto da una chiamata precedente
+                        text = await self._call_model(prompt, params, model)
+                    latency, usage = time.monotonic() - started, take_usage()
+                    outcome = "ok" if text.strip() != "{}" else "empty"
+                    if take_finish_reason() in LENGTH_FINISH_REASONS:
+                        print(f"[GEMINI-ASYNC] Risposta troncata dal tetto di token (Modello: {model}, "
+                              f"max_output_tokens={params.get('max_output_tokens')})")
+                        outcome, received, text = "truncated", text, "{}"
+                    break
+                except LLMCallError as e:
+                    router.record(model, time.monotonic() - started, False)
+                    breaker.record_failure()
+                    print(f"[GEMINI-ASYNC] Errore generazione (Modello: {model}, "
+                          f"tentativo {attempt + 1}/{policy.max_attempts}): {e}")
+                    if not e.retryable or attempt + 1 >= policy.max_attempts or breaker.is_open:
+                        break
+                    await asyncio.sleep(policy.delay(attempt))
+        except asyncio.CancelledError:
+            # Hedge perdente (non registrato) o chiamante cancellato
+            outcome = "cancelled"
+            raise
+        finally:
+            result = CallResult(text, outcome, received, model, call_started, max(1, attempts), latency, usage)
+            if not deferred:
+                self._client._settle(result, call_site or call_type, prompt)
+        return result
+
+    async def _call_model(self, prompt: str, params: Dict[str, Any], model: Optional[str] = None) -> str:
+        backend = self._client._backend_for(model or self.config.model_name)
+        if not backend:
+            raise LLMCallError("Modello non inizializzato (manca API Key?)", retryable=False)
+        return await backend.agenerate(prompt, params)
+
+
+class BlockingGeminiAdapter:
+    """
+    Espone un AsyncGeminiClient con l'interfaccia sincrona di GeminiClient,
+    così SessionEngine/ExamEngine (che girano nei thread della GUI) condividono
+    lo stesso event loop, semaforo e rate limiter.
+    """
+
+    def __init__(self, async_client: AsyncGeminiClient):
+        self.async_client = async_client
+        self.config = async_client.config
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="gemini-async-loop", daemon=True)
+        self._thread.start()
+
+    @property
+    def cache(self) -> Optional[ResponseCache]:
+        return self.async_client.cache
+
+    def cache_stats(self) -> Dict[str, Any]:
+        return self.async_client.cache_stats()
+
+    def coalesce_stats(self) -> Dict[str, Any]:
+        return self.async_client.coalesce_stats()
+
+    @property
+    def circuit_open(self) -> bool:
+        return self.async_client.circuit_open
+
+    def router_stats(self) -> Dict[str, Any]:
+        return self.async_client.router_stats()
+
+    def hedge_stats(self) -> Dict[str, Any]:
+        return self.async_client.hedge_stats()
+
+    @property
+    def telemetry(self) -> LLMTelemetry:
+        return self.async_client.telemetry
+
+    def telemetry_stats(self) -> Dict[str, Any]:
+        return self.async_client.telemetry_stats()
+
+    def generate_content(self, prompt: str, use_cache: bool = True, call_type: str = "default",
+                         profile: str = "default", interactive: bool = False,
+                         call_site: Optional[str] = None) -> str:
+        fut = asyncio.run_coroutine_threadsafe(
+            self.async_client.generate_content(prompt, use_cache, call_type, profile, interactive, call_site),
+            self._loop)
+        return fut.result()
+
+    def generate_json(self, prompt: str, schema: Optional[Dict[str, Any]] = None, use_cache: bool = False,
+                      call_type: str = "default", profile: str = "question_json", interactive: bool = False,
+                      call_site: Optional[str] = None) -> Any:
+        fut = asyncio.run_coroutine_threadsafe(
+            self.async_client.generate_json(prompt, schema, use_cache, call_type, profile, interactive, call_site),
+            self._loop)
+        return fut.result()
+
+    def stream_content(self, prompt: str, use_cache: bool = True, call_type: str = "default",
+                       profile: str = "default", status: Optional[StreamStatus] = None,
+                       call_site: Optional[str] = None) -> Iterator[str]:
+        # I chunk prodotti nell'event loop arrivano al thread chiamante tramite una coda; status è compilato
+        # prima del segnale di fine, quindi è già valido quando il chiamante esce dal ciclo
+        chunks: "queue.Queue[Optional[str]]" = queue.Queue()
+        status = status if status is not None else StreamStatus()
+
+        async def pump() -> None:
+            try:
+                async for piece in self.async_client.stream_content(prompt, use_cache, call_type, profile, status,
+                                                                    call_site):
+                    chunks.put(piece)
+            except Exception as e:
+                print(f"[GEMINI-ASYNC] Errore streaming: {e}")
+                status.outcome = "error"
+            finally:
+                chunks.put(None)
+
+        asyncio.run_coroutine_threadsafe(pump(), self._loop)
+        while True:
+            piece = chunks.get()
+            if piece is None:
+                return
+            yield piece
+
+    def close(self) -> None:
+        self._loop.call_soon_threadsafe(self._loop.stop)
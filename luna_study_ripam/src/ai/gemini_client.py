@@ -1,7 +1,22 @@
 # src/ai/gemini_client.py
 import google.generativeai as genai
-from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
 import os
+import threading
+import time
+
+from src.ai.generation_profiles import GenerationProfile, merge_profiles
+from src.ai.hedging import HedgeBudget, HedgeLatencies, is_valid_text, run_hedged
+from src.ai.llm_backends import LENGTH_FINISH_REASONS, GenaiBackend, LLMBackend, take_finish_reason, take_usage
+from src.ai.model_router import ModelRouter
+from src.ai.resilience import CircuitBreaker, LLMCallError, RetryPolicy
+from src.ai.response_cache import ResponseCache, ResponseCacheConfig
+from src.ai.rate_limit import estimate_tokens
+from src.ai.response_parser import StructuredOutputError, parse_structured
+from src.ai.single_flight import SingleFlight
+from src.ai.telemetry import LLMCallRecord, LLMTelemetry
 
 
 @dataclass
@@ -10,48 +25,505 @@ class GeminiConfig:
     # USIAMO LA VERSIONE 3 (Preview) - La più recente assoluta
     model_name: str = "gemini-3-flash-preview"
 
+    # Parametri di generazione di base; i profili per tipo di chiamata (generation_profiles.DEFAULT_PROFILES,
+    # sovrascrivibili con generation_profiles) ereditano questi valori per i campi che non impostano
+    temperature: float = 0.7
+    max_output_tokens: Optional[int] = None
+    generation_profiles: Dict[str, GenerationProfile] = field(default_factory=dict)
+
+    # Cache risposte su disco (opt-in): None = disattivata
+    cache_path: Optional[str] = None
+    cache_ttl_sec: int = 7 * 24 * 3600
+    cache_max_entries: int = 5000
+    cache_max_bytes: int = 50 * 1024 * 1024
+
+    # Limiti lato client (usati da AsyncGeminiClient): 0 = nessun limite
+    max_concurrency: int = 4
+    requests_per_minute: int = 0
+    tokens_per_minute: int = 0
+
+    # Resilienza: timeout per chiamata, retry con backoff e circuit breaker
+    request_timeout_sec: float = 60.0
+    retry_attempts: int = 3
+    retry_base_delay_sec: float = 0.5
+    retry_max_delay_sec: float = 8.0
+    breaker_failure_threshold: int = 5
+    breaker_reset_sec: float = 30.0
+
+    # Prompt identici (stessa chiave di cache) in volo contemporaneamente: una sola chiamata condivisa
+    coalesce_requests: bool = True
+
+    # Router multi-modello: tipo di chiamata ("lesson", "question", "reaction", "report", "chat", "default")
+    # -> modelli candidati in ordine di preferenza. Vuoto = model_name per tutto.
+    model_routes: Dict[str, List[str]] = field(default_factory=dict)
+    # SLO per tipo di chiamata: p95 massimo (ms) perché un modello venga preferito per velocità
+    route_slo_ms: Dict[str, float] = field(default_factory=dict)
+    router_window: int = 50
+    router_max_error_rate: float = 0.5
+
+    # Hedging: solo per le chiamate marcate interactive=True dal chiamante (l'utente sta aspettando la risposta).
+    # Se la risposta tarda oltre il quantile osservato per quel tipo di chiamata (hedge_quantile, almeno
+    # hedge_min_delay_ms) parte un duplicato; vince la prima risposta valida (per generate_json: parsabile).
+    # hedge_budget_ratio limita le richieste extra a quella frazione del traffico (+ hedge_budget_burst).
+    hedge_interactive: bool = True
+    hedge_quantile: float = 0.9
+    hedge_min_delay_ms: float = 250.0
+    hedge_budget_ratio: float = 0.1
+    hedge_budget_burst: float = 3.0
+
+    # Telemetria: le statistiche sono sempre in memoria (telemetry_stats()); con telemetry_path vengono
+    # anche scritte su disco ogni telemetry_interval_sec (JSON, o testo Prometheus con estensione .prom/.txt)
+    telemetry_path: Optional[str] = None
+    telemetry_interval_sec: float = 60.0
+
+
+@dataclass
+class CallResult:
+    """Esito di una chiamata logica (retry inclusi)."""
+    text: str  # "{}" se non c'è una risposta utilizzabile
+    outcome: str  # esito registrato nella telemetria (telemetry.OUTCOMES)
+    received: str = ""  # testo arrivato dal servizio anche se scartato (es. risposta "truncated")
+    model: str = ""
+    started: float = 0.0  # time.monotonic() all'inizio della chiamata logica
+    attempts: int = 1
+    latency_sec: float = 0.0  # latenza del tentativo che ha risposto
+    usage: Optional[Tuple[int, int]] = None  # token (prompt, risposta) riportati dal servizio
+
+    @property
+    def answered(self) -> bool:
+        # Il servizio ha risposto (anche vuoto o troncato): per router e breaker è un successo
+        return self.outcome in ("ok", "empty", "truncated")
+
+
+@dataclass
+class StreamStatus:
+    """Come è finito uno stream_content: il client lo compila prima di chiudere lo stream."""
+    outcome: str = ""  # esito della telemetria: "ok", "cache_hit", "partial", "truncated", "empty", "error", ...
+
+    @property
+    def clean(self) -> bool:
+        """True solo se il testo è completo: né interrotto, né fermato dal tetto di token, né un errore."""
+        return self.outcome in ("ok", "cache_hit")
+
 
 class GeminiClient:
-    def __init__(self, config: GeminiConfig):
+    def __init__(self, config: GeminiConfig, backend: Optional[LLMBackend] = None,
+                 model_backends: Optional[Dict[str, LLMBackend]] = None):
+        """
+        backend: trasporto alternativo (es. RecordingBackend/ReplayBackend per benchmark offline).
+        Se None si usa il modello Gemini reale (se c'è una API key).
+        model_backends: trasporti specifici per i modelli delle rotte (default: stesso trasporto di backend,
+        oppure un GenerativeModel per modello con l'API reale).
+        """
         self.config = config
+        self.router = ModelRouter(config.model_name, config.model_routes, config.route_slo_ms,
+                                  window=config.router_window, max_error_rate=config.router_max_error_rate)
+        self._backends: Dict[str, LLMBackend] = dict(model_backends or {})
+        self.profiles = merge_profiles(config.generation_profiles)
+        self.hedge_budget = HedgeBudget(config.hedge_budget_ratio, config.hedge_budget_burst)
+        self.hedge_latencies = HedgeLatencies(window=config.router_window)
+        # Creato qui (i thread partono solo al primo uso): le chiamate interattive arrivano da più thread
+        self._hedge_executor: Optional[ThreadPoolExecutor] = None
+        if config.hedge_interactive:
+            self._hedge_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="gemini-hedge")
+        self.retry_policy = RetryPolicy(
+            max_attempts=max(1, config.retry_attempts),
+            base_delay_sec=config.retry_base_delay_sec,
+            max_delay_sec=config.retry_max_delay_sec,
+        )
+        self.breaker = CircuitBreaker(config.breaker_failure_threshold, config.breaker_reset_sec)
+        self.single_flight = SingleFlight()
+        self.telemetry = LLMTelemetry()
+        if config.telemetry_path:
+            self.telemetry.start_dump(config.telemetry_path, config.telemetry_interval_sec)
+        self.cache: Optional[ResponseCache] = None
+        if config.cache_path:
+            try:
+                self.cache = ResponseCache(ResponseCacheConfig(
+                    path=config.cache_path,
+                    ttl_sec=config.cache_ttl_sec,
+                    max_entries=config.cache_max_entries,
+                    max_bytes=config.cache_max_bytes,
+                ))
+            except Exception as e:
+                print(f"[GEMINI] Cache non disponibile ({config.cache_path}): {e}")
+
+        self.model = None
+        self.backend: Optional[LLMBackend] = backend
+        if backend is not None:
+            return
+
         if not config.api_key or config.api_key == "dummy":
             print("[GEMINI] Warning: API Key mancante o dummy.")
-            self.model = None
         else:
             try:
                 genai.configure(api_key=config.api_key)
                 self.model = genai.GenerativeModel(config.model_name)
+                self.backend = GenaiBackend(self.model, config.model_name, config.request_timeout_sec)
             except Exception as e:
                 print(f"[GEMINI] Errore configurazione: {e}")
                 self.model = None
 
-    def generate_content(self, prompt: str) -> str:
+    def generation_profile(self, name: str) -> GenerationProfile:
+        """Profilo di generazione per nome; i nomi sconosciuti usano "default"."""
+        return self.profiles.get(name) or self.profiles.get("default") or GenerationProfile()
+
+    def _generation_params(self, profile: str = "default") -> Dict[str, Any]:
+        return self.generation_profile(profile).params(self.config.temperature, self.config.max_output_tokens)
+
+    def generate_content(self, prompt: str, use_cache: bool = True, call_type: str = "default",
+                         profile: str = "default", interactive: bool = False,
+                         call_site: Optional[str] = None) -> str:
         """
         Invia il prompt a Gemini e restituisce il testo della risposta.
+        use_cache=False: salta la cache (es. domande, che devono variare a ogni chiamata).
+
+        Con use_cache=True le chiamate contemporanee con lo stesso prompt vengono coalizzate
+        (config.coalesce_requests): una sola richiesta, stesso testo per tutti i chiamanti.
+        Con use_cache=False no, perché il chiamante vuole una risposta nuova.
+        call_type: sceglie la rotta del router multi-modello (config.model_routes).
+        profile: profilo di generazione (temperatura, tetto di token, stop sequence), es. "reaction", "chat".
+        interactive: l'utente sta aspettando la risposta (domanda del quiz, chat...): abilita l'hedging.
+        call_site: punto del motore che fa la chiamata (es. "quiz_single", "pool_refill"), chiave della
+        telemetria; default = call_type. Più punti possono condividere lo stesso call_type (rotta e latenze).
+        """
+        site = call_site or call_type
+        params = self._generation_params(profile)
+        if not use_cache:
+            return self._call(prompt, params, call_type, interactive, call_site=site).text
+
+        key = self._cache_key(call_type, params, prompt)
+        if self.cache:
+            started = time.monotonic()
+            cached = self.cache.get(key)
+            if cached is not None:
+                self._record_call(site, self.router.primary(call_type), "cache_hit", started, prompt, cached)
+                return cached
+
+        if not self.config.coalesce_requests:
+            return self._fetch_and_store(key, prompt, params, call_type, interactive, site)
+        started = time.monotonic()
+        text, shared = self.single_flight.do(
+            key, lambda: self._fetch_and_store(key, prompt, params, call_type, interactive, site))
+        if shared:
+            self._record_call(site, self.router.primary(call_type), "coalesced", started, prompt, text)
+        return text
+
+    def _cache_key(self, call_type: str, params: Dict[str, Any], prompt: str) -> str:
+        # Chiave sul modello preferito della rotta: stabile anche quando il router sceglie un altro candidato
+        return ResponseCache.make_key(self.router.primary(call_type), params, prompt)
+
+    def _fetch_and_store(self, key: str, prompt: str, params: Dict[str, Any], call_type: str = "default",
+                         interactive: bool = False, call_site: Optional[str] = None) -> str:
+        text = self._call(prompt, params, call_type, interactive, call_site=call_site).text
+
+        # Le risposte di errore ("{}") non vanno mai in cache
+        if self.cache and text != "{}":
+            try:
+                self.cache.put(key, text)
+            except Exception as e:
+                print(f"[GEMINI] Errore scrittura cache: {e}")
+        return text
+
+    def _json_params(self, schema: Optional[Dict[str, Any]], profile: str = "question_json") -> Dict[str, Any]:
+        # Output JSON vincolato: MIME type + (opzionale) schema di risposta
+        params = self._generation_params(profile)
+        params["response_mime_type"] = "application/json"
+        if schema is not None:
+            params["response_schema"] = schema
+        return params
+
+    def generate_json(self, prompt: str, schema: Optional[Dict[str, Any]] = None, use_cache: bool = False,
+                      call_type: str = "default", profile: str = "question_json", interactive: bool = False,
+                      call_site: Optional[str] = None) -> Any:
+        """
+        Chiamata con output JSON vincolato allo schema (es. src.ai.json_schema.question_json_schema()).
+        Ritorna il JSON già decodificato e validato; solleva StructuredOutputError
+        (reason: "unavailable", "invalid_json", "truncated", "schema"). "truncated" anche quando il servizio
+        segnala di essersi fermato al tetto di token, pure se il testo ricevuto fosse JSON valido.
+        interactive: come in generate_content; con l'hedging vince la prima risposta che supera il parsing.
+        call_site: come in generate_content (anche gli errori di parsing sono contati per call_site).
+        """
+        site = call_site or call_type
+        params = self._json_params(schema, profile)
+        key = None
+        if self.cache and use_cache:
+            key = self._cache_key(call_type, params, prompt)
+            started = time.monotonic()
+            cached = self.cache.get(key)
+            if cached is not None:
+                self._record_call(site, self.router.primary(call_type), "cache_hit", started, prompt, cached)
+                return parse_structured(cached, schema)
+
+        result = self._call(prompt, params, call_type, interactive, parse_check(schema), site)
+        data = self._parse_recorded(result, schema, site)
+
+        if key is not None:
+            try:
+                self.cache.put(key, result.text)
+            except Exception as e:
+                print(f"[GEMINI] Errore scrittura cache: {e}")
+        return data
+
+    def stream_content(self, prompt: str, use_cache: bool = True, call_type: str = "default",
+                       profile: str = "default", status: Optional[StreamStatus] = None,
+                       call_site: Optional[str] = None) -> Iterator[str]:
+        """
+        Come generate_content, ma restituisce il testo a pezzi man mano che arriva (stream=True).
+        Se lo stream fallisce prima del primo chunk si ripiega sulla chiamata normale (con retry).
+        Uno stream fermato dal tetto di token ("truncated"), come uno interrotto ("partial"), non va in cache.
+        status: compilato a fine stream con l'esito; chi conserva il testo deve controllare status.clean.
+        """
+        site = call_site or call_type
+        status = status if status is not None else StreamStatus()
+        params = self._generation_params(profile)
+        key = None
+        if self.cache and use_cache:
+            key = self._cache_key(call_type, params, prompt)
+            started = time.monotonic()
+            cached = self.cache.get(key)
+            if cached is not None:
+                self._record_call(site, self.router.primary(call_type), "cache_hit", started, prompt, cached)
+                status.outcome = "cache_hit"
+                yield cached
+                return
+
+        # Senza backend o con il servizio giù: stessa gestione di generate_content
+        model = self.router.choose(call_type)
+        try:
+            backend = self._backend_for(model)
+        except LLMCallError:
+            backend = None
+        if not backend or self.breaker.is_open:
+            result = self._call_with_retry(prompt, params, call_type, call_site=site)
+            status.outcome = result.outcome
+            yield result.text
+            return
+
+        parts: List[str] = []
+        complete = False
+        truncated = False
+        fallback: Optional[CallResult] = None  # la chiamata di ripiego registra da sé la propria telemetria
+        started = time.monotonic()
+        take_finish_reason()  # scarta un valore rimasto da una chiamata precedente
+        try:
+            for piece in backend.stream(prompt, params):
+                parts.append(piece)
+                yield piece
+            self.breaker.record_success()
+            self.router.record(model, time.monotonic() - started, True)
+            complete = True
+            truncated = take_finish_reason() in LENGTH_FINISH_REASONS
+        except LLMCallError as e:
+            print(f"[GEMINI] Errore streaming (Modello: {model}): {e}")
+            self.router.record(model, time.monotonic() - started, False)
+            if not parts:
+                self.breaker.record_failure()
+                fallback = self._call_with_retry(prompt, params, call_type, call_site=site)
+                status.outcome = fallback.outcome
+                parts.append(fallback.text)
+                complete = True
+                yield fallback.text
+            # Se era già arrivato del testo teniamo la parte ricevuta (non va in cache)
+
+        if not parts:
+            # Stream vuoto (blocco safety): stesso valore di ritorno di generate_content
+            self._record_call(site, model, "empty", started, prompt, stream=True)
+            status.outcome = "empty"
+            yield "{}"
+            return
+
+        text = "".join(parts)
+        if fallback is None:
+            status.outcome = "truncated" if truncated else ("ok" if complete else "partial")
+            self._record_call(site, model, status.outcome, started, prompt, text, stream=True)
+        if key is not None and status.clean and text != "{}":
+            try:
+                self.cache.put(key, text)
+            except Exception as e:
+                print(f"[GEMINI] Errore scrittura cache: {e}")
+
+    def cache_stats(self) -> Dict[str, Any]:
+        return self.cache.stats() if self.cache else {}
+
+    def telemetry_stats(self) -> Dict[str, Any]:
+        """Per tipo di chiamata e modello: esiti, retry, token, istogrammi di latenza; errori di parsing."""
+        return self.telemetry.stats()
+
+    def hedge_stats(self) -> Dict[str, Any]:
+        """Richieste idonee, hedge lanciati/vinti/negati dal budget."""
+        return self.hedge_budget.stats()
+
+    def router_stats(self) -> Dict[str, Any]:
+        """Per modello: campioni, p50/p95 (ms), error rate; per tipo di chiamata: quante volte a ogni modello."""
+        return self.router.stats()
+
+    def coalesce_stats(self) -> Dict[str, Any]:
+        """Contatori della coalescenza: requests, executed, coalesced (chiamate risparmiate), in_flight..."""
+        return self.single_flight.stats()
+
+    @property
+    def circuit_open(self) -> bool:
+        """True se il servizio è considerato giù: i chiamanti dovrebbero usare un fallback locale."""
+        return self.breaker.is_open
+
+    def hedge_delay(self, call_type: str) -> Optional[float]:
+        """Attesa (s) prima di lanciare un duplicato; None = niente hedge (latenze del tipo ancora ignote)."""
+        quantile = self.hedge_latencies.quantile(call_type, self.config.hedge_quantile)
+        if quantile is None:
+            return None
+        return max(quantile, self.config.hedge_min_delay_ms / 1000.0)
+
+    def _call(self, prompt: str, params: Dict[str, Any], call_type: str = "default", interactive: bool = False,
+              is_valid: Optional[Callable[[str], bool]] = None, call_site: Optional[str] = None) -> CallResult:
+        """
+        _call_with_retry; le chiamate interattive usano l'hedging (config.hedge_interactive).
+        Con l'hedge i due tentativi non registrano nulla: l'esito del vincitore (il primo con is_valid(testo),
+        default: una risposta non vuota) diventa una sola chiamata logica per telemetria, router e breaker.
         """
-        if not self.model:
-            print("[GEMINI] Errore: Modello non inizializzato (manca API Key?).")
-            return "{}"
+        if not interactive or self._hedge_executor is None:
+            return self._call_with_retry(prompt, params, call_type, call_site=call_site)
+        check = is_valid or is_valid_text
+        started = time.monotonic()
+        result, _hedge_won = run_hedged(
+            self._hedge_executor,
+            lambda cancel: self._call_with_retry(prompt, params, call_type, cancel, deferred=True),
+            self.hedge_delay(call_type),
+            self.hedge_budget,
+            is_valid=lambda r: check(r.text),
+        )
+        if result is None:
+            result = CallResult("{}", "error", model=self.router.primary(call_type), started=started)
+        if result.outcome == "ok":
+            self.hedge_latencies.record(call_type, result.latency_sec)
+        return self._settle(result, call_site or call_type, prompt)
+
+    def _call_with_retry(self, prompt: str, params: Dict[str, Any], call_type: str = "default",
+                         cancel: Optional[threading.Event] = None, deferred: bool = False,
+                         call_site: Optional[str] = None) -> CallResult:
+        """
+        Chiamata con retry (backoff esponenziale + jitter) e circuit breaker.
+        Con il breaker aperto ritorna subito "{}" senza toccare la rete.
+        Il modello viene scelto dal router a ogni tentativo (un retry può andare su un altro candidato).
+        Una risposta fermata dal tetto di token è "truncated": testo "{}" (non è un output valido), niente retry
+        (lo stesso prompt con lo stesso tetto verrebbe tagliato di nuovo).
+        cancel: se settato (hedge perdente) non si fanno altri tentativi.
+        deferred: l'esito finale non viene registrato (lo registra _call con _settle, solo per il vincitore
+        dell'hedge); i tentativi falliti sì, perché sono richieste reali andate in errore.
+        """
+        policy = self.retry_policy
+        call_started = time.monotonic()
+        model, attempts, outcome, text, received = self.router.primary(call_type), 0, "error", "{}", ""
+        latency, usage = 0.0, None
+        for attempt in range(policy.max_attempts):
+            if cancel is not None and cancel.is_set():
+                outcome = "cancelled"
+                break
+            if not self.breaker.allow():
+                outcome = "circuit_open"
+                break
+            model = self.router.choose(call_type)
+            attempts += 1
+            started = time.monotonic()
+            take_finish_reason()  # scarta un valore rimasto da una chiamata precedente
+            try:
+                text = self._call_model(prompt, params, model)
+                latency, usage = time.monotonic() - started, take_usage()
+                outcome = "ok" if text.strip() != "{}" else "empty"
+                if take_finish_reason() in LENGTH_FINISH_REASONS:
+                    print(f"[GEMINI] Risposta troncata dal tetto di token (Modello: {model}, "
+                          f"max_output_tokens={params.get('max_output_tokens')})")
+                    outcome, received, text = "truncated", text, "{}"
+                break
+            except LLMCallError as e:
+                self.router.record(model, time.monotonic() - started, False)
+                self.breaker.record_failure()
+                print(f"[GEMINI] Errore generazione (Modello: {model}, "
+                      f"tentativo {attempt + 1}/{policy.max_attempts}): {e}")
+                if not e.retryable or attempt + 1 >= policy.max_attempts or self.breaker.is_open:
+                    break
+                if cancel is not None:
+                    cancel.wait(policy.delay(attempt))
+                else:
+                    time.sleep(policy.delay(attempt))
+        result = CallResult(text, outcome, received, model, call_started, max(1, attempts), latency, usage)
+        return result if deferred else self._settle(result, call_site or call_type, prompt)
+
+    def _settle(self, result: CallResult, call_site: str, prompt: str) -> CallResult:
+        """Registra l'esito finale di una chiamata logica: campione del router, breaker e telemetria."""
+        if result.answered:
+            self.router.record(result.model, result.latency_sec, True)
+            self.breaker.record_success()
+        self._record_call(call_site, result.model, result.outcome, result.started, prompt,
+                          result.received or result.text, attempts=result.attempts, usage=result.usage)
+        return result
 
+    def _record_call(self, call_site: str, model: str, outcome: str, started: float, prompt: str,
+                     text: str = "", attempts: int = 1, stream: bool = False,
+                     usage: Optional[Tuple[int, int]] = None) -> None:
+        """
+        Telemetria di una chiamata logica; token dall'usage del servizio se disponibile, altrimenti stimati.
+        Cache e coalescenza non consumano token: ne registrano solo le dimensioni.
+        usage: già letto dal chiamante (es. nel thread dell'hedge); altrimenti si legge qui.
+        """
+        if usage is None and outcome in ("ok", "empty", "partial", "truncated"):
+            usage = take_usage()
+        response = text if outcome not in ("error", "circuit_open", "cancelled") else ""
+        billed = outcome not in ("cache_hit", "coalesced", "circuit_open", "cancelled")
+        self.telemetry.record(LLMCallRecord(
+            call_site=call_site,
+            model=model,
+            outcome=outcome,
+            latency_sec=time.monotonic() - started,
+            prompt_chars=len(prompt),
+            response_chars=len(response),
+            prompt_tokens=usage[0] if usage else (estimate_tokens(prompt) if billed else 0),
+            response_tokens=usage[1] if usage else (estimate_tokens(response) if billed and response else 0),
+            tokens_estimated=usage is None,
+            attempts=attempts,
+            stream=stream,
+        ))
+
+    def _parse_recorded(self, result: CallResult, schema: Optional[Dict[str, Any]], call_site: str) -> Any:
+        # parse_structured, contando nella telemetria le risposte arrivate ma inutilizzabili
+        if result.outcome == "truncated":
+            self.telemetry.record_parse_failure(call_site, "truncated")
+            raise StructuredOutputError("Risposta troncata dal tetto di token", "truncated", result.received)
         try:
-            # Configurazione per rendere la risposta creativa ma coerente
-            generation_config = genai.types.GenerationConfig(
-                temperature=0.7
-            )
-
-            response = self.model.generate_content(
-                prompt,
-                generation_config=generation_config
-            )
-
-            if not response.parts:
-                try:
-                    print(f"[GEMINI] Blocco Safety: {response.prompt_feedback}")
-                except:
-                    pass
-                return "{}"
-
-            return response.text
+            return parse_structured(result.text, schema)
+        except StructuredOutputError as e:
+            if e.reason != "unavailable":
+                self.telemetry.record_parse_failure(call_site, e.reason)
+            raise
+
+    def _call_model(self, prompt: str, params: Dict[str, Any], model: Optional[str] = None) -> str:
+        """Singola chiamata al backend. Solleva LLMCallError per errori di servizio/rete."""
+        backend = self._backend_for(model or self.config.model_name)
+        if not backend:
+            raise LLMCallError("Modello non inizializzato (manca API Key?)", retryable=False)
+        return backend.generate(prompt, params)
+
+    def _backend_for(self, model: str) -> Optional[LLMBackend]:
+        backend = self._backends.get(model)
+        if backend is not None:
+            return backend
+        if model == self.config.model_name or self.model is None:
+            # Modello principale, o trasporto personalizzato/assente: lo stesso per tutte le rotte
+            return self.backend
+        try:
+            backend = GenaiBackend(genai.GenerativeModel(model), model, self.config.request_timeout_sec)
         except Exception as e:
-            print(f"[GEMINI] Errore generazione (Modello: {self.config.model_name}): {e}")
-            return "{}"
\ No newline at end of file
+            raise LLMCallError(f"Modello {model} non disponibile: {e}", retryable=False)
+        self._backends[model] = backend
+        return backend
+
+
+def parse_check(schema: Optional[Dict[str, Any]]) -> Callable[[str], bool]:
+    """Criterio di vittoria dell'hedge per le chiamate JSON: la risposta deve superare parse_structured."""
+    def check(text: str) -> bool:
+        try:
+            parse_structured(text, schema)
+        except StructuredOutputError:
+            return False
+        return True
+    return check
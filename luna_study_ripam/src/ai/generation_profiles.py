@@ -0,0 +1,63 @@
+# src/ai/generation_profiles.py
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Any, Dict, Mapping, Optional, Tuple
+
+
+@dataclass(frozen=True)
+class GenerationProfile:
+    """
+    Parametri di generazione di un tipo di chiamata.
+
+    - temperature: None = quella di GeminiConfig.temperature.
+    - max_output_tokens: tetto della risposta; None = quello di GeminiConfig.max_output_tokens (se c'è).
+    - stop_sequences: il modello si ferma appena ne produce una (non inclusa nel testo).
+    """
+    temperature: Optional[float] = None
+    max_output_tokens: Optional[int] = None
+    stop_sequences: Tuple[str, ...] = ()
+
+    def params(self, temperature: float, max_output_tokens: Optional[int] = None) -> Dict[str, Any]:
+        """Parametri per GenerationConfig, con i default del client per i campi non impostati."""
+        params: Dict[str, Any] = {"temperature": self.temperature if self.temperature is not None else temperature}
+        limit = self.max_output_tokens if self.max_output_tokens is not None else max_output_tokens
+        if limit:
+            params["max_output_tokens"] = int(limit)
+        if self.stop_sequences:
+            params["stop_sequences"] = list(self.stop_sequences)
+        return params
+
+
+# Profili usati dai motori.
+# I tetti di token sono una rete di sicurezza, non il modo di ottenere risposte brevi: la brevità la danno
+# i prompt e le stop sequence. Sui modelli "thinking" i token di ragionamento contano nel tetto, quindi un
+# tetto tarato sulla sola risposta visibile la taglia (o la svuota). Una risposta fermata dal tetto
+# (finish reason MAX_TOKENS) viene scartata come esito "truncated", mai usata come testo valido.
+# Valori: almeno il doppio della lunghezza attesa della parte visibile, più il margine per il ragionamento.
+# Vanno ritarati sull'istogramma llm_response_tokens della telemetria: un tetto è troppo basso se compaiono
+# esiti "truncated" o se il p95 gli si avvicina.
+# - lesson: lezioni discorsive di ~800-1500 parole (~1200-2300 token).
+# - question_json: domanda, 4 opzioni, spiegazione e le due reazioni del tutor (~500-900 token).
+# - question_batch: fino a ~10 domande complete per chiamata.
+# - reaction/chat: due-tre frasi / una risposta in chat; le stop sequence le fermano prima del tetto.
+# Le chiamate JSON non hanno stop (troncherebbero il JSON).
+DEFAULT_PROFILES: Dict[str, GenerationProfile] = {
+    "default": GenerationProfile(),
+    "lesson": GenerationProfile(max_output_tokens=8192),
+    "question_json": GenerationProfile(max_output_tokens=4096),
+    "question_batch": GenerationProfile(max_output_tokens=16384),
+    "reaction": GenerationProfile(temperature=0.9, max_output_tokens=1024, stop_sequences=("\n\n",)),
+    "report": GenerationProfile(max_output_tokens=2048),
+    # La memoria della chat etichetta i turni "Utente:"/"Tutor:": il modello non deve scrivere anche la parte dell'utente
+    "chat": GenerationProfile(max_output_tokens=2048, stop_sequences=("\nUtente:", "\nUser:")),
+    "summary": GenerationProfile(temperature=0.3, max_output_tokens=2048),
+}
+
+
+def merge_profiles(overrides: Optional[Mapping[str, GenerationProfile]] = None) -> Dict[str, GenerationProfile]:
+    """DEFAULT_PROFILES con i profili di overrides (che sostituiscono o aggiungono per nome)."""
+    profiles = dict(DEFAULT_PROFILES)
+    profiles.update(overrides or {})
+    return profiles
+
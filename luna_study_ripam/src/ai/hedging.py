@@ -0,0 +1,149 @@
+# src/ai/hedging.py
+from __future__ import annotations
+
+import threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Executor, TimeoutError as FutureTimeout, wait
+from typing import Any, Callable, Deque, Dict, Optional, Tuple, TypeVar
+
+from src.ai.model_router import percentile
+
+T = TypeVar("T")
+
+# attempt(cancel) -> risultato: una chiamata completa (con i suoi retry) che smette di ritentare se cancel è settato
+Attempt = Callable[[threading.Event], T]
+
+
+def is_valid_text(text: Optional[str]) -> bool:
+    # Stesso criterio di errore dei client: "{}" = nessuna risposta utilizzabile
+    return bool(text) and text.strip() != "{}"
+
+
+class HedgeLatencies:
+    """
+    Latenze recenti delle chiamate interattive riuscite, per tipo di chiamata: base del ritardo degli hedge.
+
+    Separate dalle finestre per modello del router, che mescolano chiamate brevi e lunghe dello stesso modello
+    (es. una domanda singola e un batch da dieci): il ritardo deve riflettere solo le chiamate che si duplicano.
+    Per una chiamata con hedge si registra solo la latenza del vincitore.
+    """
+
+    def __init__(self, window: int = 50, min_samples: int = 5):
+        self.window = max(1, window)
+        self.min_samples = max(1, min_samples)
+        self._lock = threading.Lock()
+        self._by_type: Dict[str, Deque[float]] = {}
+
+    def record(self, call_type: str, latency_sec: float) -> None:
+        with self._lock:
+            samples = self._by_type.get(call_type)
+            if samples is None:
+                samples = self._by_type[call_type] = deque(maxlen=self.window)
+            samples.append(latency_sec)
+
+    def quantile(self, call_type: str, q: float) -> Optional[float]:
+        """Quantile q (secondi) del tipo di chiamata; None finché i campioni sono meno di min_samples."""
+        with self._lock:
+            samples = self._by_type.get(call_type)
+            if samples is None or len(samples) < self.min_samples:
+                return None
+            return percentile(samples, q)
+
+
+class HedgeBudget:
+    """
+    Budget globale delle richieste duplicate (hedge).
+
+    Ogni richiesta idonea accumula `ratio` crediti (fino a `burst`), ogni hedge ne consuma uno:
+    le richieste extra restano al massimo ~ratio del traffico (es. 0.1 = +10%), anche quando
+    il servizio rallenta per tutti.
+    """
+
+    def __init__(self, ratio: float = 0.1, burst: float = 3.0):
+        self.ratio = max(0.0, ratio)
+        self.burst = max(1.0, burst)
+        self._lock = threading.Lock()
+        self._credits = self.burst
+        self.requests = 0
+        self.launched = 0
+        self.won = 0
+        self.denied = 0
+
+    def on_request(self) -> None:
+        with self._lock:
+            self.requests += 1
+            self._credits = min(self.burst, self._credits + self.ratio)
+
+    def try_acquire(self) -> bool:
+        with self._lock:
+            if self._credits >= 1.0:
+                self._credits -= 1.0
+                self.launched += 1
+                return True
+            self.denied += 1
+            return False
+
+    def record_win(self) -> None:
+        with self._lock:
+            self.won += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "hedges": self.launched,
+                "hedge_rate": (self.launched / self.requests) if self.requests else 0.0,
+                "hedge_wins": self.won,
+                "denied": self.denied,
+                "credits": round(self._credits, 2),
+            }
+
+
+def run_hedged(
+        executor: Executor,
+        attempt: Attempt,
+        delay_sec: Optional[float],
+        budget: HedgeBudget,
+        is_valid: Callable[[Any], bool] = is_valid_text,
+) -> Tuple[Optional[T], bool]:
+    """
+    Esegue attempt(); se dopo delay_sec non ha risposto (e il budget lo consente) lancia un duplicato.
+    Vince il primo risultato valido; all'altro viene chiesto di fermarsi (cancel) e il suo risultato è scartato.
+    Ritorna (risultato, vinto_dall_hedge): se nessuno è valido il primo arrivato, None se entrambi hanno
+    sollevato eccezioni. delay_sec=None: nessun hedge (latenze non ancora note).
+    """
+    budget.on_request()
+    cancel_primary = threading.Event()
+    primary = executor.submit(attempt, cancel_primary)
+    if delay_sec is None:
+        return primary.result(), False
+    try:
+        return primary.result(timeout=delay_sec), False
+    except FutureTimeout:
+        pass
+    if not budget.try_acquire():
+        return primary.result(), False
+
+    cancel_hedge = threading.Event()
+    hedge = executor.submit(attempt, cancel_hedge)
+    pending = {primary: cancel_primary, hedge: cancel_hedge}
+    fallback: Optional[T] = None
+    while pending:
+        done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+        for future in done:
+            pending.pop(future)
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"[HEDGE] Errore chiamata: {e}")
+                continue
+            if is_valid(result):
+                for other, cancel in pending.items():
+                    cancel.set()
+                    other.cancel()
+                if future is hedge:
+                    budget.record_win()
+                return result, future is hedge
+            if fallback is None:
+                fallback = result
+    return fallback, False
@@ -0,0 +1,53 @@
+# src/ai/json_schema.py
+from __future__ import annotations
+
+from dataclasses import fields
+from typing import Any, Dict, get_args, get_origin, get_type_hints
+
+from src.domain.models import Question
+
+ANSWER_LETTERS = ["A", "B", "C", "D"]
+
+# Campi impostati dal motore (non dall'LLM) e campi obbligatori nella risposta
+_ENGINE_FIELDS = {"tutor", "materia", "tipo"}
+_REQUIRED_FIELDS = ["domanda", "opzioni", "corretta", "spiegazione"]
+
+
+def _type_schema(tp: Any) -> Dict[str, Any]:
+    origin = get_origin(tp)
+    if origin in (list, tuple):
+        args = get_args(tp)
+        return {"type": "array", "items": _type_schema(args[0] if args else str)}
+    if origin is dict:
+        # opzioni: esattamente le quattro lettere
+        return {
+            "type": "object",
+            "properties": {k: {"type": "string"} for k in ANSWER_LETTERS},
+            "required": list(ANSWER_LETTERS),
+        }
+    if tp is int:
+        return {"type": "integer"}
+    if tp is bool:
+        return {"type": "boolean"}
+    return {"type": "string"}
+
+
+def question_json_schema() -> Dict[str, Any]:
+    """
+    Schema della singola domanda derivato dal dataclass Question.
+    Usa solo il sottoinsieme supportato da response_schema di Gemini (type/properties/required/items/enum),
+    che è anche JSON Schema valido per la validazione locale.
+    """
+    hints = get_type_hints(Question)
+    properties: Dict[str, Any] = {}
+    for f in fields(Question):
+        if f.name in _ENGINE_FIELDS:
+            continue
+        properties[f.name] = _type_schema(hints[f.name])
+    properties["corretta"] = {"type": "string", "enum": list(ANSWER_LETTERS)}
+    return {"type": "object", "properties": properties, "required": list(_REQUIRED_FIELDS)}
+
+
+def question_batch_json_schema() -> Dict[str, Any]:
+    """Array di domande (prompt batch)."""
+    return {"type": "array", "items": question_json_schema()}
@@ -0,0 +1,431 @@
+# src/ai/llm_backends.py
+from __future__ import annotations
+
+import asyncio
+import bisect
+import contextvars
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional, Tuple
+
+import google.generativeai as genai
+
+from src.ai.resilience import LLMCallError
+
+# Token effettivi (prompt, risposta) dell'ultima risposta ricevuta nel thread/task corrente, se il servizio
+# li riporta: letti (e azzerati) dalla telemetria del client con take_usage()
+_last_usage: ContextVar[Optional[Tuple[int, int]]] = ContextVar("llm_last_usage", default=None)
+
+
+def take_usage() -> Optional[Tuple[int, int]]:
+    usage = _last_usage.get()
+    if usage is not None:
+        _last_usage.set(None)
+    return usage
+
+
+def _note_usage(response: Any) -> None:
+    meta = getattr(response, "usage_metadata", None)
+    if meta is None:
+        return
+    try:
+        _last_usage.set((int(meta.prompt_token_count or 0), int(meta.candidates_token_count or 0)))
+    except Exception:
+        pass
+
+
+# Motivo di fine dell'ultima risposta ("STOP", "MAX_TOKENS", "SAFETY", ...), come l'usage: letto (e azzerato)
+# dal client con take_finish_reason() per distinguere una risposta completa da una tagliata dal tetto di token
+_last_finish: ContextVar[Optional[str]] = ContextVar("llm_last_finish", default=None)
+
+# Motivi di fine di una risposta interrotta dal limite max_output_tokens
+LENGTH_FINISH_REASONS = ("MAX_TOKENS",)
+
+
+def take_finish_reason() -> Optional[str]:
+    reason = _last_finish.get()
+    if reason is not None:
+        _last_finish.set(None)
+    return reason
+
+
+def _note_finish(response: Any) -> None:
+    # Nei chunk intermedi dello stream il motivo è FINISH_REASON_UNSPECIFIED: conta solo quello finale
+    try:
+        reason = response.candidates[0].finish_reason
+    except Exception:
+        return
+    name = getattr(reason, "name", None) or str(reason)
+    if name and name not in ("FINISH_REASON_UNSPECIFIED", "0"):
+        _last_finish.set(name)
+
+
+class LLMBackend:
+    """
+    Trasporto usato da GeminiClient: riceve prompt + parametri di generazione, ritorna il testo.
+    Solleva LLMCallError per errori di servizio/rete (gestiti da retry e circuit breaker).
+    """
+
+    name = "base"
+
+    def generate(self, prompt: str, params: Dict[str, Any]) -> str:
+        raise NotImplementedError
+
+    def stream(self, prompt: str, params: Dict[str, Any]) -> Iterator[str]:
+        yield self.generate(prompt, params)
+
+    async def agenerate(self, prompt: str, params: Dict[str, Any]) -> str:
+        # generate() gira in un thread con una copia del contesto: usage e motivo di fine vanno riportati qui
+        ctx = contextvars.copy_context()
+        text = await asyncio.get_running_loop().run_in_executor(None, ctx.run, self.generate, prompt, params)
+        _last_usage.set(ctx.get(_last_usage))
+        _last_finish.set(ctx.get(_last_finish))
+        return text
+
+    async def astream(self, prompt: str, params: Dict[str, Any]) -> AsyncIterator[str]:
+        yield await self.agenerate(prompt, params)
+
+
+class GenaiBackend(LLMBackend):
+    """Backend reale: google.generativeai."""
+
+    name = "genai"
+
+    def __init__(self, model: Any, model_name: str, timeout_sec: float):
+        self.model = model
+        self.model_name = model_name
+        self.timeout_sec = timeout_sec
+
+    def _response_text(self, response: Any) -> str:
+        _note_usage(response)
+        _note_finish(response)
+        if not response.parts:
+            try:
+                print(f"[GEMINI] Blocco Safety: {response.prompt_feedback}")
+            except:
+                pass
+            return "{}"
+        return response.text
+
+    def generate(self, prompt: str, params: Dict[str, Any]) -> str:
+        try:
+            response = self.model.generate_content(
+                prompt,
+                generation_config=genai.types.GenerationConfig(**params),
+                request_options={"timeout": self.timeout_sec},
+            )
+        except Exception as e:
+            raise LLMCallError(str(e))
+        return self._response_text(response)
+
+    def stream(self, prompt: str, params: Dict[str, Any]) -> Iterator[str]:
+        try:
+            response = self.model.generate_content(
+                prompt,
+                generation_config=genai.types.GenerationConfig(**params),
+                request_options={"timeout": self.timeout_sec},
+                stream=True,
+            )
+            for chunk in response:
+                _note_usage(chunk)  # usage e motivo di fine arrivano con l'ultimo chunk
+                _note_finish(chunk)
+                try:
+                    piece = chunk.text
+                except Exception:
+                    piece = ""  # chunk senza testo (es. solo metadati/safety)
+                if piece:
+                    yield piece
+        except Exception as e:
+            raise LLMCallError(str(e))
+
+    async def agenerate(self, prompt: str, params: Dict[str, Any]) -> str:
+        try:
+            response = await self.model.generate_content_async(
+                prompt,
+                generation_config=genai.types.GenerationConfig(**params),
+                request_options={"timeout": self.timeout_sec},
+            )
+        except Exception as e:
+            raise LLMCallError(str(e))
+        return self._response_text(response)
+
+    async def astream(self, prompt: str, params: Dict[str, Any]) -> AsyncIterator[str]:
+        try:
+            response = await self.model.generate_content_async(
+                prompt,
+                generation_config=genai.types.GenerationConfig(**params),
+                request_options={"timeout": self.timeout_sec},
+                stream=True,
+            )
+            async for chunk in response:
+                _note_usage(chunk)
+                _note_finish(chunk)
+                try:
+                    piece = chunk.text
+                except Exception:
+                    piece = ""
+                if piece:
+                    yield piece
+        except Exception as e:
+            raise LLMCallError(str(e))
+
+
+# -------------------------
+# Fake (offline)
+# -------------------------
+
+def sample_from_schema(schema: Dict[str, Any], n: int = 0, name: str = "valore") -> Any:
+    """Istanza minima valida di uno schema (sottoinsieme usato da response_schema); n rende i testi univoci."""
+    if "enum" in schema:
+        return schema["enum"][n % len(schema["enum"])]
+    kind = schema.get("type", "string")
+    if kind == "object":
+        return {k: sample_from_schema(v, n, k) for k, v in schema.get("properties", {}).items()}
+    if kind == "array":
+        return [sample_from_schema(schema.get("items", {}), n, name)]
+    if kind == "integer":
+        return n
+    if kind == "number":
+        return float(n)
+    if kind == "boolean":
+        return False
+    return f"{name} di prova n. {n + 1}"
+
+
+class FakeBackend(LLMBackend):
+    """
+    Backend locale per test/benchmark senza rete.
+    - responder(prompt, params) -> testo: risposta personalizzata.
+    - Senza responder: in modalità JSON (response_mime_type/response_schema) genera un'istanza valida
+      dello schema, altrimenti un testo fisso.
+    - finish_reason: motivo di fine riportato per ogni risposta (es. "MAX_TOKENS" per simulare il troncamento).
+    """
+
+    name = "fake"
+
+    def __init__(self, responder: Optional[Callable[[str, Dict[str, Any]], str]] = None, latency_sec: float = 0.0,
+                 finish_reason: Optional[str] = None):
+        self.responder = responder
+        self.latency_sec = latency_sec
+        self.finish_reason = finish_reason
+        self.calls: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def generate(self, prompt: str, params: Dict[str, Any]) -> str:
+        with self._lock:
+            n = len(self.calls)
+            self.calls.append({"prompt": prompt, "params": params})
+        if self.latency_sec > 0:
+            time.sleep(self.latency_sec)
+        if self.finish_reason is not None:
+            _last_finish.set(self.finish_reason)
+        if self.responder is not None:
+            return self.responder(prompt, params)
+        schema = params.get("response_schema")
+        if schema is not None:
+            return json.dumps(sample_from_schema(schema, n), ensure_ascii=False)
+        if params.get("response_mime_type") == "application/json":
+            return "{\"testo\": \"Risposta di prova.\"}"
+        return "Risposta di prova."
+
+
+# -------------------------
+# Record / Replay
+# -------------------------
+
+def cassette_key(prompt: str, params: Dict[str, Any]) -> str:
+    raw = json.dumps([params, prompt], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def response_shape(params: Dict[str, Any]) -> str:
+    """Forma della risposta attesa (MIME type + schema): in replay non si servono mai risposte di forma diversa."""
+    return json.dumps([params.get("response_mime_type"), params.get("response_schema")],
+                      sort_keys=True, ensure_ascii=False)
+
+
+class RecordingBackend(LLMBackend):
+    """
+    Inoltra le chiamate a un backend reale e registra prompt, risposta, latenza ed eventuali errori
+    in un file "cassetta" JSONL (una riga per chiamata, in append).
+    """
+
+    name = "record"
+
+    def __init__(self, inner: LLMBackend, cassette_path: str):
+        self.inner = inner
+        self.cassette_path = cassette_path
+        self._lock = threading.Lock()
+        folder = os.path.dirname(os.path.abspath(cassette_path))
+        os.makedirs(folder, exist_ok=True)
+
+    def _write(self, prompt: str, params: Dict[str, Any], response: Optional[str],
+               latency: float, error: Optional[str]) -> None:
+        row = {
+            "key": cassette_key(prompt, params),
+            "params": params,
+            "prompt": prompt,
+            "response": response,
+            "latency_sec": round(latency, 4),
+            "error": error,
+            "finish_reason": _last_finish.get(),  # letto senza azzerarlo: resta per il client
+        }
+        with self._lock:
+            with open(self.cassette_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(row, ensure_ascii=False) + "\n")
+
+    def generate(self, prompt: str, params: Dict[str, Any]) -> str:
+        t0 = time.perf_counter()
+        try:
+            text = self.inner.generate(prompt, params)
+        except LLMCallError as e:
+            self._write(prompt, params, None, time.perf_counter() - t0, str(e))
+            raise
+        self._write(prompt, params, text, time.perf_counter() - t0, None)
+        return text
+
+    def stream(self, prompt: str, params: Dict[str, Any]) -> Iterator[str]:
+        # Si registra la risposta completa: in replay lo stream restituisce un solo chunk
+        t0 = time.perf_counter()
+        parts: List[str] = []
+        try:
+            for piece in self.inner.stream(prompt, params):
+                parts.append(piece)
+                yield piece
+        except LLMCallError as e:
+            self._write(prompt, params, "".join(parts) or None, time.perf_counter() - t0, str(e))
+            raise
+        self._write(prompt, params, "".join(parts), time.perf_counter() - t0, None)
+
+
+class ReplayBackend(LLMBackend):
+    """
+    Serve le risposte di una cassetta registrata, senza rete e in modo deterministico.
+
+    - match="exact": solo prompt identici (altrimenti LLMCallError non ritentabile).
+    - match="nearest": se non c'è un prompt identico usa quello registrato con il prefisso comune più lungo
+      tra le registrazioni con la stessa forma di risposta (response_shape: una chiamata JSON non riceve
+      mai la prosa di una lezione e viceversa). I prompt delle domande contengono few-shot casuali,
+      quindi raramente coincidono.
+    - Più registrazioni dello stesso prompt vengono servite a rotazione.
+    - Latenza: latency_sec fisso, altrimenti quella registrata * latency_scale.
+    - failure_rate: frazione di chiamate che falliscono (errore ritentabile), con rng a seed fisso.
+    """
+
+    name = "replay"
+
+    def __init__(
+            self,
+            cassette_path: str,
+            match: str = "nearest",
+            latency_sec: Optional[float] = None,
+            latency_scale: float = 1.0,
+            failure_rate: float = 0.0,
+            seed: int = 0,
+    ):
+        self.cassette_path = cassette_path
+        self.match = match
+        self.latency_sec = latency_sec
+        self.latency_scale = latency_scale
+        self.failure_rate = failure_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._rows: List[Dict[str, Any]] = []
+        self._by_key: Dict[str, List[int]] = {}
+        # forma -> (prompt ordinati, indice riga): il vicino per prefisso comune sta accanto al punto d'inserimento
+        self._by_shape: Dict[str, Tuple[List[str], List[int]]] = {}
+        self._served: Dict[str, int] = {}
+        self._load()
+
+    def _load(self) -> None:
+        if not os.path.exists(self.cassette_path):
+            print(f"[REPLAY] Cassetta non trovata: {self.cassette_path}")
+            return
+        with open(self.cassette_path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except:
+                    continue
+                # Le chiamate fallite in registrazione non si riservono: i guasti si iniettano con failure_rate
+                if row.get("response") is None:
+                    continue
+                self._by_key.setdefault(row["key"], []).append(len(self._rows))
+                self._rows.append(row)
+
+        # Indice immutabile dopo il caricamento: le ricerche non richiedono il lock
+        grouped: Dict[str, List[Tuple[str, int]]] = {}
+        for i, row in enumerate(self._rows):
+            grouped.setdefault(response_shape(row.get("params") or {}), []).append((row.get("prompt", ""), i))
+        for shape, items in grouped.items():
+            items.sort()
+            self._by_shape[shape] = ([p for p, _ in items], [i for _, i in items])
+
+    def _nearest(self, prompt: str, params: Dict[str, Any]) -> Optional[int]:
+        """Riga con il prefisso comune più lungo tra quelle con la stessa forma di risposta (None se non ce ne sono)."""
+        entry = self._by_shape.get(response_shape(params))
+        if entry is None:
+            return None
+        prompts, rows = entry
+        pos = bisect.bisect_left(prompts, prompt)
+        best, best_len = None, -1
+        for j in (pos - 1, pos):
+            if 0 <= j < len(prompts):
+                n = _common_prefix(prompt, prompts[j])
+                if n > best_len:
+                    best, best_len = rows[j], n
+        return best
+
+    def _pick(self, prompt: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        key = cassette_key(prompt, params)
+        indexes = self._by_key.get(key)
+        nearest = self._nearest(prompt, params) if not indexes and self.match == "nearest" else None
+        with self._lock:
+            fail = self.failure_rate > 0 and self._rng.random() < self.failure_rate
+            if indexes:
+                n = self._served.get(key, 0)
+                self._served[key] = n + 1
+                row = self._rows[indexes[n % len(indexes)]]
+            elif nearest is not None:
+                row = self._rows[nearest]
+            else:
+                raise LLMCallError("Prompt non presente nella cassetta", retryable=False)
+        if fail:
+            raise LLMCallError("Errore simulato (replay)")
+        return row
+
+    def _delay(self, row: Dict[str, Any]) -> float:
+        if self.latency_sec is not None:
+            return self.latency_sec
+        return float(row.get("latency_sec", 0.0)) * self.latency_scale
+
+    def generate(self, prompt: str, params: Dict[str, Any]) -> str:
+        row = self._pick(prompt, params)
+        delay = self._delay(row)
+        if delay > 0:
+            time.sleep(delay)
+        _last_finish.set(row.get("finish_reason"))
+        return row["response"]
+
+    async def agenerate(self, prompt: str, params: Dict[str, Any]) -> str:
+        row = self._pick(prompt, params)
+        delay = self._delay(row)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        _last_finish.set(row.get("finish_reason"))
+        return row["response"]
+
+
+def _common_prefix(a: str, b: str) -> int:
+    n = min(len(a), len(b))
+    i = 0
+    while i < n and a[i] == b[i]:
+        i += 1
+    return i
@@ -0,0 +1,142 @@
+# src/ai/model_router.py
+from __future__ import annotations
+
+import math
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Sequence, Tuple
+
+# Tipi di chiamata usati dai motori (qualsiasi altro nome usa la rotta "default")
+CALL_TYPES = ("default", "lesson", "question", "reaction", "report", "chat")
+
+
+def percentile(values: Sequence[float], q: float) -> float:
+    """Percentile "nearest rank" (q in 0..1) di una sequenza non vuota."""
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))
+    return ordered[idx]
+
+
+class _ModelWindow:
+    """Ultime `size` chiamate di un modello: latenze (solo riuscite) ed esiti."""
+
+    def __init__(self, size: int):
+        self.latencies: Deque[float] = deque(maxlen=size)
+        self.outcomes: Deque[bool] = deque(maxlen=size)
+        self.last_at = 0.0
+
+    def record(self, latency_sec: float, ok: bool) -> None:
+        self.last_at = time.monotonic()
+        self.outcomes.append(ok)
+        if ok:
+            self.latencies.append(latency_sec)
+
+    def error_rate(self) -> float:
+        return (self.outcomes.count(False) / len(self.outcomes)) if self.outcomes else 0.0
+
+    def p(self, q: float) -> Optional[float]:
+        return percentile(self.latencies, q) if self.latencies else None
+
+
+class ModelRouter:
+    """
+    Sceglie il modello per ogni tipo di chiamata in base alle latenze osservate.
+
+    - routes: tipo di chiamata -> modelli candidati in ordine di preferenza
+      (es. {"reaction": ["gemini-flash-lite", "gemini-flash"], "question": ["gemini-pro"]}).
+      Tipi senza rotta usano routes["default"], o altrimenti default_model.
+    - Per modello una finestra mobile (window) di latenze ed esiti: p50/p95 ed error rate.
+    - Un modello è "sano" se l'error rate nella finestra è <= max_error_rate.
+    - choose(): tra i candidati sani che rispettano lo SLO del tipo (p95 <= slo_ms) il più veloce (p50);
+      i modelli con meno di min_samples campioni, o senza chiamate da probe_interval_sec (es. esclusi perché
+      lenti o in errore), vengono provati per primi, nell'ordine della rotta: così le statistiche restano fresche.
+      Se nessuno rispetta lo SLO: il sano con p95 minore; se nessuno è sano: quello con meno errori.
+    """
+
+    def __init__(
+            self,
+            default_model: str,
+            routes: Optional[Dict[str, List[str]]] = None,
+            slo_ms: Optional[Dict[str, float]] = None,
+            window: int = 50,
+            min_samples: int = 5,
+            max_error_rate: float = 0.5,
+            probe_interval_sec: float = 60.0,
+    ):
+        self.default_model = default_model
+        self.routes = {k: list(v) for k, v in (routes or {}).items() if v}
+        self.slo_ms = dict(slo_ms or {})
+        self.window = max(1, window)
+        self.min_samples = max(1, min_samples)
+        self.max_error_rate = max_error_rate
+        self.probe_interval_sec = probe_interval_sec
+        self._lock = threading.Lock()
+        self._models: Dict[str, _ModelWindow] = {}
+        self._routed: Dict[Tuple[str, str], int] = {}
+
+    def candidates(self, call_type: str) -> List[str]:
+        return self.routes.get(call_type) or self.routes.get("default") or [self.default_model]
+
+    def primary(self, call_type: str) -> str:
+        """Modello preferito del tipo (usato come chiave di cache, stabile indipendentemente dal routing)."""
+        return self.candidates(call_type)[0]
+
+    def choose(self, call_type: str = "default") -> str:
+        candidates = self.candidates(call_type)
+        if len(candidates) == 1:
+            model = candidates[0]
+        else:
+            with self._lock:
+                model = self._choose_locked(call_type, candidates)
+        with self._lock:
+            self._routed[(call_type, model)] = self._routed.get((call_type, model), 0) + 1
+        return model
+
+    def _choose_locked(self, call_type: str, candidates: List[str]) -> str:
+        slo_sec = self.slo_ms.get(call_type, 0) / 1000.0
+        now = time.monotonic()
+        healthy: List[Tuple[str, _ModelWindow]] = []
+        for model in candidates:
+            w = self._models.get(model)
+            if w is None or len(w.outcomes) < self.min_samples or now - w.last_at > self.probe_interval_sec:
+                return model  # esplorazione: servono dati (freschi) prima di confrontarlo
+            if w.error_rate() <= self.max_error_rate:
+                healthy.append((model, w))
+
+        if not healthy:
+            return min(candidates, key=lambda m: self._models[m].error_rate())
+
+        def p50(item):
+            return item[1].p(0.5) if item[1].latencies else float("inf")
+
+        def p95(item):
+            return item[1].p(0.95) if item[1].latencies else float("inf")
+
+        within_slo = [it for it in healthy if not slo_sec or p95(it) <= slo_sec]
+        if within_slo:
+            return min(within_slo, key=p50)[0]
+        return min(healthy, key=p95)[0]
+
+    def record(self, model: str, latency_sec: float, ok: bool) -> None:
+        with self._lock:
+            w = self._models.get(model)
+            if w is None:
+                w = self._models[model] = _ModelWindow(self.window)
+            w.record(latency_sec, ok)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            models = {}
+            for model, w in self._models.items():
+                p50, p95 = w.p(0.5), w.p(0.95)
+                models[model] = {
+                    "samples": len(w.outcomes),
+                    "p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+                    "p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+                    "error_rate": w.error_rate(),
+                }
+            routed: Dict[str, Dict[str, int]] = {}
+            for (call_type, model), n in self._routed.items():
+                routed.setdefault(call_type, {})[model] = n
+            return {"models": models, "routed": routed}
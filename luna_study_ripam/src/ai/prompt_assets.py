@@ -0,0 +1,123 @@
+# src/ai/prompt_assets.py
+from __future__ import annotations
+
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+_TEXT_EXTENSIONS = (".txt", ".json", ".jsonl", ".md")
+
+
+@dataclass
+class _Asset:
+    text: Optional[str]  # None = file mancante
+    mtime_ns: int
+    size: int
+    checked_at: float
+
+
+class PromptAssetRegistry:
+    """
+    Cache di processo per i file di prompt (prompts/, profili tutor).
+
+    - Ogni file viene letto e decodificato una volta sola; le letture successive sono lookup in memoria.
+    - Hot reload: al massimo ogni `check_interval_sec` si controllano mtime e dimensione del file
+      (un solo stat), così le modifiche fatte durante la scrittura dei prompt vengono riprese senza riavviare.
+    - Le banche JSONL (few-shot) non passano di qui: le serve QuestionBankStore, indicizzata.
+    """
+
+    def __init__(self, check_interval_sec: float = 1.0):
+        self.check_interval_sec = check_interval_sec
+        self._lock = threading.Lock()
+        self._assets: Dict[str, _Asset] = {}
+        self.loads = 0
+        self.hits = 0
+
+    # -------------------------
+    # API
+    # -------------------------
+
+    def read(self, path: str, strip_bom: bool = False) -> Optional[str]:
+        """Contenuto del file (strip), None se non esiste. strip_bom: rimuove anche il BOM UTF-8 iniziale."""
+        text = self._get(path).text
+        if text is not None and strip_bom and text.startswith("\ufeff"):
+            return text[1:].strip()
+        return text
+
+    def text(self, path: str, strip_bom: bool = False) -> str:
+        return self.read(path, strip_bom) or ""
+
+    def exists(self, path: str) -> bool:
+        return self._get(path).text is not None
+
+    def preload(self, root_dir: str) -> int:
+        """Carica in memoria tutti i file di testo sotto root_dir (es. <progetto>/prompts). Ritorna quanti."""
+        count = 0
+        for folder, _, files in os.walk(root_dir):
+            for name in files:
+                if name.endswith(_TEXT_EXTENSIONS):
+                    self._get(os.path.join(folder, name))
+                    count += 1
+        return count
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"files": len(self._assets), "loads": self.loads, "hits": self.hits}
+
+    def clear(self) -> None:
+        with self._lock:
+            self._assets.clear()
+
+    # -------------------------
+    # Interni
+    # -------------------------
+
+    def _get(self, path: str) -> _Asset:
+        # Chiave = percorso così come passato (i chiamanti lo costruiscono sempre da project_root):
+        # niente abspath, che da solo costerebbe più del lookup
+        key = path
+        now = time.monotonic()
+        with self._lock:
+            asset = self._assets.get(key)
+            if asset is not None and now - asset.checked_at < self.check_interval_sec:
+                self.hits += 1
+                return asset
+
+        mtime_ns, size = _stat(key)
+        with self._lock:
+            asset = self._assets.get(key)
+            if asset is not None and (asset.mtime_ns, asset.size) == (mtime_ns, size):
+                asset.checked_at = now
+                self.hits += 1
+                return asset
+
+        asset = _Asset(text=_read_file(key), mtime_ns=mtime_ns, size=size, checked_at=now)
+        with self._lock:
+            self._assets[key] = asset
+            self.loads += 1
+        return asset
+
+
+def _stat(path: str) -> Tuple[int, int]:
+    try:
+        st = os.stat(path)
+        return st.st_mtime_ns, st.st_size
+    except OSError:
+        return -1, -1
+
+
+def _read_file(path: str) -> Optional[str]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f"[PROMPT] Errore lettura {path}: {e}")
+        return None
+
+
+# Registro condiviso da tutto il processo
+ASSETS = PromptAssetRegistry()
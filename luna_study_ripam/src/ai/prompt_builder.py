@@ -1,11 +1,16 @@
 # src/ai/prompt_builder.py
 from __future__ import annotations
 
-import json
 import os
 import random
 from dataclasses import dataclass
-from typing import Dict, List, Optional
+from typing import Optional
+
+from src.ai.prompt_assets import ASSETS
+from src.storage.question_bank_store import open_bank
+
+# rng di default condiviso: crearne uno nuovo a ogni prompt costa più dell'assemblaggio stesso
+_RNG = random.Random()
 
 
 @dataclass(frozen=True)
@@ -15,26 +20,8 @@ class PromptBuildConfig:
 
 
 def _read_text(path: str) -> str:
-    if not os.path.exists(path): return ""
-    with open(path, "r", encoding="utf-8") as f: return f.read().strip()
-
-
-def _load_jsonl(path: str) -> List[Dict]:
-    rows = []
-    if not os.path.exists(path): return rows
-    with open(path, "r", encoding="utf-8") as f:
-        for line in f:
-            if line.strip():
-                try:
-                    rows.append(json.loads(line.strip()))
-                except:
-                    continue
-    return rows
-
-
-def _sample(rows: List[Dict], k: int, rng: random.Random) -> List[Dict]:
-    if not rows: return []
-    return rng.sample(rows, min(len(rows), k))
+    # Servito dal registro in memoria (ricaricato solo se il file cambia)
+    return ASSETS.text(path)
 
 
 def subject_to_instruction_filename(subject: str) -> str:
@@ -74,7 +61,55 @@ def build_question_prompt(
         specific_topic: str = "",
         rng: Optional[random.Random] = None,
 ) -> str:
-    rng = rng or random.Random()
+    topic_display = specific_topic if specific_topic else subject
+    goal = f"""--- GOAL 1: THE QUESTION ---
+Generate a multiple-choice question on the specific topic: "{topic_display}".
+Use your historical knowledge of Italian public contests (2019-2024) to replicate the style and difficulty.
+Create tricky distractors."""
+
+    return _compose_prompt(project_root, subject, tutor, stage, cfg, rng, goal, "OUTPUT RICHIESTO (SOLO JSON):")
+
+
+def build_question_batch_prompt(
+        project_root: str,
+        subject: str,
+        tutor: str,
+        stage: int,
+        outcome_hint: str,
+        cfg: PromptBuildConfig,
+        count: int,
+        specific_topic: str = "",
+        rng: Optional[random.Random] = None,
+) -> str:
+    """
+    Variante batch: un solo prompt (regole, istruzioni e few-shot inviati una volta)
+    che chiede un ARRAY JSON di `count` domande sulla stessa materia.
+    """
+    topic_display = specific_topic if specific_topic else subject
+    goal = f"""--- GOAL 1: THE QUESTIONS ({count}) ---
+Generate {count} DISTINCT multiple-choice questions on the specific topic: "{topic_display}".
+Each question must test a DIFFERENT aspect of the topic (no overlapping concepts).
+Use your historical knowledge of Italian public contests (2019-2024) to replicate the style and difficulty.
+Create tricky distractors."""
+
+    output_header = (
+        f"OUTPUT RICHIESTO (SOLO JSON): un ARRAY di {count} oggetti, "
+        f"ognuno conforme a questo schema (campo 'visual' diverso per ogni domanda):"
+    )
+    return _compose_prompt(project_root, subject, tutor, stage, cfg, rng, goal, output_header)
+
+
+def _compose_prompt(
+        project_root: str,
+        subject: str,
+        tutor: str,
+        stage: int,
+        cfg: PromptBuildConfig,
+        rng: Optional[random.Random],
+        goal_block: str,
+        output_header: str,
+) -> str:
+    rng = rng or _RNG
 
     # Usa il prompt "Solo Quiz" perché la lezione è già stata fatta a parte
     system_rules = _read_text(os.path.join(project_root, "prompts", "ripam_quiz_only.txt"))
@@ -84,15 +119,12 @@ def build_question_prompt(
     schema_text = _read_text(os.path.join(project_root, "prompts", "output_schema.json"))
 
     seed_path = os.path.join(project_root, "data", "question_banks", subject_to_seed_filename(subject))
-    seed_rows = _load_jsonl(seed_path)
-    fewshot = _sample(seed_rows, cfg.seed_per_prompt, rng)
+    # Banca indicizzata: si leggono dal file (mmap) solo le righe estratte, già serializzate
+    fewshot = open_bank(seed_path).sample_raw(cfg.seed_per_prompt, rng)
 
     fewshot_block = ""
     if fewshot:
-        fewshot_block = "EXAMPLES (STYLE REFERENCE ONLY):\n" + "\n".join(
-            json.dumps(x, ensure_ascii=False) for x in fewshot)
-
-    topic_display = specific_topic if specific_topic else subject
+        fewshot_block = "EXAMPLES (STYLE REFERENCE ONLY):\n" + "\n".join(fewshot)
 
     # Selettore di intensità pose in base allo stage (TRADOTTO E PULITO)
     if stage >= 4:
@@ -107,10 +139,7 @@ def build_question_prompt(
 
 YOU ARE AN EXPERT EXAM CREATOR (RIPAM/Formez PA) AND AN AI VISUAL DIRECTOR.
 
---- GOAL 1: THE QUESTION ---
-Generate a multiple-choice question on the specific topic: "{topic_display}".
-Use your historical knowledge of Italian public contests (2019-2024) to replicate the style and difficulty.
-Create tricky distractors.
+{goal_block}
 
 --- GOAL 2: THE VISUAL DIRECTOR (FIELD 'VISUAL') ---
 You must describe the Tutor's pose for the AI image generator.
@@ -129,6 +158,10 @@ THEREFORE, YOU ARE STRICTLY FORBIDDEN FROM DESCRIBING THE FACE.
 Example of VALID tags: "sitting on desk, low angle, legs crossed, hands on lap".
 Example of INVALID tags: "sitting on desk, seductive smile, looking at viewer".
 
+--- GOAL 3: TUTOR REACTIONS (FIELDS 'reazione_corretta' / 'reazione_errata') ---
+Write, in Italian and in character as {tutor} (stage {stage}), a short emotional reaction (1-2 sentences)
+for a CORRECT answer and one for a WRONG answer. Do NOT reveal or repeat the correct option.
+
 CONTESTO GIOCO:
 - Tutor: {tutor} | Stage: {stage}
 
@@ -139,7 +172,7 @@ ISTRUZIONI MATERIA ({subject}):
 
 {fewshot_block}
 
-OUTPUT RICHIESTO (SOLO JSON):
+{output_header}
 {schema_text}
 """.strip()
 
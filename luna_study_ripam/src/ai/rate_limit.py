@@ -0,0 +1,59 @@
+# src/ai/rate_limit.py
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import Optional
+
+
+class TokenBucket:
+    """
+    Token bucket asincrono (limite "per minuto").
+    - capacity: quanti token al massimo nel secchio (= limite per minuto).
+    - Il secchio si ricarica in modo continuo a capacity/60 token al secondo.
+    - acquire(n) attende finché ci sono n token; charge(n) addebita a posteriori (può andare in negativo).
+    capacity <= 0 significa "nessun limite".
+    """
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock: Optional[asyncio.Lock] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.capacity > 0
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, amount: float = 1.0) -> None:
+        if not self.enabled:
+            return
+        # Una richiesta più grande del secchio intero passerebbe mai: la limitiamo alla capacità
+        amount = min(amount, self.capacity)
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return
+                await asyncio.sleep((amount - self._tokens) / self.rate)
+
+    def charge(self, amount: float) -> None:
+        """Addebito a posteriori (es. token di output noti solo a risposta ricevuta)."""
+        if not self.enabled or amount <= 0:
+            return
+        self._refill()
+        self._tokens -= amount
+
+
+def estimate_tokens(text: str) -> int:
+    """Stima grezza: ~4 caratteri per token (sufficiente per il rate limiting lato client)."""
+    return max(1, len(text) // 4)
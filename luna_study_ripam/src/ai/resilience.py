@@ -0,0 +1,97 @@
+# src/ai/resilience.py
+from __future__ import annotations
+
+import random
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+
+class LLMCallError(Exception):
+    """Errore di trasporto/servizio in una chiamata LLM (distinto da una risposta valida ma inutilizzabile)."""
+
+    def __init__(self, message: str, retryable: bool = True):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """
+    Backoff esponenziale con "full jitter":
+    attesa = random(0, min(max_delay, base_delay * 2^tentativo)).
+    """
+    max_attempts: int = 3
+    base_delay_sec: float = 0.5
+    max_delay_sec: float = 8.0
+
+    def delay(self, attempt: int, rng: Optional[random.Random] = None) -> float:
+        rng = rng or random
+        cap = min(self.max_delay_sec, self.base_delay_sec * (2 ** attempt))
+        return rng.uniform(0, cap)
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker classico:
+    - closed: le chiamate passano; dopo `failure_threshold` errori consecutivi si apre.
+    - open: le chiamate vengono rifiutate subito (latenza limitata) per `reset_timeout_sec`.
+    - half_open: passa una sola chiamata di prova; se riesce si richiude, altrimenti si riapre.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout_sec: float = 30.0):
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout_sec = reset_timeout_sec
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self.times_opened = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            self._maybe_half_open()
+            return self._state
+
+    @property
+    def is_open(self) -> bool:
+        return self.state == self.OPEN
+
+    def _maybe_half_open(self) -> None:
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout_sec:
+            self._state = self.HALF_OPEN
+            self._probe_in_flight = False
+
+    def allow(self) -> bool:
+        with self._lock:
+            self._maybe_half_open()
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    self.times_opened += 1
+                    print(f"[LLM] Circuit breaker APERTO dopo {self._failures} errori consecutivi.")
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._probe_in_flight = False
@@ -0,0 +1,121 @@
+# src/ai/response_cache.py
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+
+@dataclass(frozen=True)
+class ResponseCacheConfig:
+    path: str
+    ttl_sec: int = 7 * 24 * 3600  # una settimana
+    max_entries: int = 5000
+    max_bytes: int = 50 * 1024 * 1024  # 50 MB di testo risposte
+
+
+class ResponseCache:
+    """
+    Cache su disco (SQLite) delle risposte LLM, indirizzata per contenuto.
+    Chiave = sha256(model_name, generation config, prompt).
+    Scadenza per TTL, eviction LRU quando si superano max_entries o max_bytes.
+    """
+
+    def __init__(self, cfg: ResponseCacheConfig):
+        self.cfg = cfg
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        folder = os.path.dirname(os.path.abspath(cfg.path))
+        os.makedirs(folder, exist_ok=True)
+        self._db = sqlite3.connect(cfg.path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY,"
+            " value TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_responses_access ON responses(last_access)")
+        self._db.commit()
+
+    @staticmethod
+    def make_key(model_name: str, params: Dict[str, Any], prompt: str) -> str:
+        raw = json.dumps([model_name, params, prompt], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT value, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            value, created_at = row
+            if now - created_at > self.cfg.ttl_sec:
+                self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._db.commit()
+                self.misses += 1
+                return None
+            self._db.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            self._db.commit()
+            self.hits += 1
+            return value
+
+    def put(self, key: str, value: str) -> None:
+        now = time.time()
+        size = len(value.encode("utf-8"))
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, created_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, value, size, now, now),
+            )
+            self._evict()
+            self._db.commit()
+
+    def _evict(self) -> None:
+        # Da chiamare con il lock acquisito: prima i record scaduti, poi i meno usati
+        cutoff = time.time() - self.cfg.ttl_sec
+        cur = self._db.execute("DELETE FROM responses WHERE created_at < ?", (cutoff,))
+        self.evictions += max(0, cur.rowcount)
+
+        count, total = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        if count <= self.cfg.max_entries and total <= self.cfg.max_bytes:
+            return
+
+        rows = self._db.execute("SELECT key, size FROM responses ORDER BY last_access ASC").fetchall()
+        to_delete = []
+        for key, size in rows:
+            if count <= self.cfg.max_entries and total <= self.cfg.max_bytes:
+                break
+            to_delete.append((key,))
+            count -= 1
+            total -= size
+        self._db.executemany("DELETE FROM responses WHERE key = ?", to_delete)
+        self.evictions += len(to_delete)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM responses")
+            self._db.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            count, total = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / lookups) if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": count,
+                "bytes": total,
+            }
@@ -1,11 +1,33 @@
 # src/ai/response_parser.py
 from __future__ import annotations
-from typing import Any, Dict
+import json
+import random
+import re
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import jsonschema
+
 from src.domain.models import Question
 
 
 class ResponseParseError(Exception):
-    pass
+    """`reason`: causa sintetica (per i contatori), es. "no_json", "invalid_json", "missing_fields"."""
+
+    def __init__(self, message: str, reason: str = "invalid_payload"):
+        super().__init__(message)
+        self.reason = reason
+
+
+class StructuredOutputError(ResponseParseError):
+    """
+    Errore della chiamata con output JSON vincolato (GeminiClient.generate_json).
+    reason: "unavailable" (servizio giù/nessuna risposta), "invalid_json", "truncated" (JSON interrotto,
+    es. limite di token) o "schema"; raw: testo ricevuto.
+    """
+
+    def __init__(self, message: str, reason: str, raw: str = ""):
+        super().__init__(message, reason)
+        self.raw = raw
 
 
 def parse_question_from_llm_json(data: Dict[str, Any]) -> Question:
@@ -13,9 +35,6 @@ def parse_question_from_llm_json(data: Dict[str, Any]) -> Question:
     tutor = _require_enum(data, "tutor", {"Luna", "Stella", "Maria"})
     materia = _require_str(data, "materia")
 
-    # NUOVO: Estrazione della lezione
-    lezione = _require_str(data, "lezione")
-
     # Estrazione Quiz
     domanda = _require_str(data, "domanda")
     opzioni = _require_options(data)
@@ -27,7 +46,6 @@ def parse_question_from_llm_json(data: Dict[str, Any]) -> Question:
     visual = data.get("visual", "")
 
     return Question(
-        lezione=lezione,
         domanda=domanda,
         opzioni=opzioni,
         corretta=corretta,
@@ -36,10 +54,299 @@ def parse_question_from_llm_json(data: Dict[str, Any]) -> Question:
         materia=materia,
         tags=tags,
         visual=visual,
-        spiegazione_breve=spiegazione
+        spiegazione_breve=spiegazione,
+        reazione_corretta=_optional_str(data, "reazione_corretta"),
+        reazione_errata=_optional_str(data, "reazione_errata"),
+    )
+
+
+def shuffle_options(
+        opzioni: Dict[str, Any],
+        corretta: Any,
+        rng: Optional[random.Random] = None,
+) -> Tuple[Dict[str, str], str]:
+    """
+    Mescola le risposte e ritrova la nuova lettera corretta.
+    Scarta le opzioni vuote o segnaposto ("."). Solleva ResponseParseError se ne restano meno di 2.
+    """
+    rng = rng or random
+    valid_opts_values = [v for k, v in opzioni.items() if v and str(v).strip() != "."]
+    if len(valid_opts_values) < 2: raise ResponseParseError("Opzioni mancanti", "bad_options")
+
+    # 1. Recupera il testo della risposta corretta originale
+    raw_letter = str(corretta or "A").strip().upper()
+    if len(raw_letter) > 1: raw_letter = raw_letter[0]
+    correct_text = opzioni.get(raw_letter, "")
+
+    # 2. Mescola la lista delle risposte (testi)
+    rng.shuffle(valid_opts_values)
+
+    # 3. Ricostruisci il dizionario con chiavi A, B, C, D
+    keys = ["A", "B", "C", "D"][:len(valid_opts_values)]
+    shuffled = dict(zip(keys, valid_opts_values))
+
+    # 4. Ritrova la nuova lettera corretta
+    new_corretta = "A"  # Fallback
+    for k, v in shuffled.items():
+        if v == correct_text:
+            new_corretta = k
+            break
+    return shuffled, new_corretta
+
+
+def question_from_payload(
+        data: Dict[str, Any],
+        tutor: str,
+        materia: str,
+        tipo: str = "standard",
+        rng: Optional[random.Random] = None,
+) -> Question:
+    """Costruisce una Question (con opzioni mescolate) da un singolo oggetto JSON dell'LLM."""
+    if not isinstance(data, dict): raise ResponseParseError("Elemento non è un oggetto", "not_object")
+    if not data.get("domanda") or not data.get("opzioni"): raise ResponseParseError("Dati vuoti", "missing_fields")
+
+    raw_opts = data["opzioni"]
+    if isinstance(raw_opts, list):
+        # ["testo A", "testo B", ...] -> {"A": ..., "B": ...}
+        raw_opts = dict(zip(["A", "B", "C", "D"], raw_opts))
+    if not isinstance(raw_opts, dict): raise ResponseParseError("Opzioni non valide", "bad_options")
+    raw_opts = {str(k).strip().upper()[:1]: v for k, v in raw_opts.items()}
+
+    corretta = _resolve_answer_letter(raw_opts, data.get("corretta", "A"))
+    opzioni, corretta = shuffle_options(raw_opts, corretta, rng)
+    spieg = data.get("spiegazione_breve") or data.get("spiegazione", "...")
+
+    return Question(
+        domanda=data.get("domanda", ""),
+        opzioni=opzioni,
+        corretta=corretta,
+        spiegazione=spieg,
+        tutor=tutor,
+        materia=materia,
+        tipo=tipo,
+        tags=_require_str_list(data, "tags"),
+        visual=data.get("visual", "") or "",
+        spiegazione_breve=spieg,
+        reazione_corretta=_optional_str(data, "reazione_corretta"),
+        reazione_errata=_optional_str(data, "reazione_errata"),
     )
 
 
+def questions_from_payloads(
+        items: List[Any],
+        tutor: str,
+        materia: str,
+        tipo: str = "standard",
+        rng: Optional[random.Random] = None,
+        on_error: Optional[Callable[[str], None]] = None,
+) -> List[Question]:
+    """
+    question_from_payload su una lista di oggetti: gli elementi malformati vengono scartati.
+    on_error(reason) viene chiamata per ogni elemento scartato (es. per la telemetria).
+    """
+    out: List[Question] = []
+    for i, item in enumerate(items):
+        try:
+            out.append(question_from_payload(item, tutor, materia, tipo, rng))
+        except ResponseParseError as e:
+            if on_error is not None:
+                on_error(e.reason)
+            print(f"[PARSER] Elemento batch {i + 1} scartato: {e}")
+    return out
+
+
+def parse_structured(text: str, schema: Optional[Dict[str, Any]] = None) -> Any:
+    """
+    Decodifica la risposta di una chiamata JSON vincolata e la valida contro `schema`.
+    Solleva StructuredOutputError (mai eccezioni generiche). Nessun effetto collaterale: l'esito lo registra
+    chi costruisce gli oggetti di dominio (il client per JSON/schema, i motori per le Question).
+    """
+    if not text or text.strip() == "{}":
+        raise StructuredOutputError("Nessuna risposta dal modello", "unavailable", text or "")
+    expect = {"object": dict, "array": list}.get((schema or {}).get("type"))
+    try:
+        data, _ = extract_json(text, expect)
+    except ResponseParseError as e:
+        reason = "truncated" if e.reason == "truncated" else "invalid_json"
+        raise StructuredOutputError(str(e), reason, text)
+    if schema is not None:
+        try:
+            jsonschema.validate(data, schema)
+        except jsonschema.ValidationError as e:
+            raise StructuredOutputError(f"Risposta non conforme allo schema: {e.message}", "schema", text)
+    return data
+
+
+# --- Estrazione / riparazione JSON ---
+
+_FENCE_RE = re.compile(r"```(?:json|JSON)?")
+_LITERALS = {"True": "true", "False": "false", "None": "null"}
+_LITERAL_RE = re.compile(r"(?:true|false|null|True|False|None)\b")
+
+
+def extract_json(text: str, expect: Optional[type] = None) -> Tuple[Any, List[str]]:
+    """
+    Trova il primo valore JSON bilanciato del tipo atteso (expect: dict, list o None = qualsiasi)
+    ignorando preamboli, fence ``` e testo dopo, e lo decodifica. Se non è JSON valido prova a ripararlo.
+    Ritorna (dati, riparazioni_applicate); riparazioni vuote = JSON già valido.
+    Un JSON troncato (es. limite di token) è un errore ("truncated"), non una riparazione.
+    """
+    if not text or not text.strip():
+        raise ResponseParseError("Risposta vuota", "empty")
+    clean = _FENCE_RE.sub("", text)
+    openers = "{" if expect is dict else "[" if expect is list else "{["
+    decoder = json.JSONDecoder()
+    error: Optional[ResponseParseError] = None
+    pos = 0
+
+    while True:
+        # "Nota [1]: ecco il JSON {...}" con expect=dict: le parentesi del tipo sbagliato non sono candidati
+        start = min((i for i in (clean.find(c, pos) for c in openers) if i >= 0), default=-1)
+        if start < 0:
+            break
+        try:
+            data, _ = decoder.raw_decode(clean, start)
+            return data, []
+        except ValueError:
+            pass
+
+        repaired, fixes, end = _repair_json(clean[start:])
+        if end < 0:
+            raise ResponseParseError("JSON troncato", "truncated")
+        try:
+            data, _ = decoder.raw_decode(repaired)
+            return data, fixes
+        except ValueError as e:
+            # Valore bilanciato ma non JSON (es. "[vedi nota]"): si cerca il prossimo candidato dopo di esso
+            error = ResponseParseError(f"JSON non valido: {e}", "invalid_json")
+            pos = start + end
+
+    raise error or ResponseParseError("Nessun JSON nella risposta", "no_json")
+
+
+def _next_significant(text: str, i: int) -> str:
+    while i < len(text) and text[i].isspace():
+        i += 1
+    return text[i] if i < len(text) else ""
+
+
+def _closes_string(text: str, i: int, container: str) -> bool:
+    """
+    La virgoletta in posizione i chiude la stringa? Sì se seguita da } ] : o fine testo;
+    se seguita da una virgola, solo se dopo la virgola inizia davvero l'elemento successivo
+    (una chiave in un oggetto, un valore in un array): altrimenti è una virgoletta nel testo,
+    es. "cita "L. 241/90", art. 3".
+    """
+    j = i + 1
+    while j < len(text) and text[j].isspace():
+        j += 1
+    if j >= len(text) or text[j] in "}]:":
+        return True
+    if text[j] != ",":
+        return False
+    j += 1
+    while j < len(text) and text[j].isspace():
+        j += 1
+    if j >= len(text):
+        return True
+    c = text[j]
+    if c in "\"'“”}]":  # elemento successivo, o virgola finale
+        return True
+    if container == "}":
+        return False
+    if c in "{[-" or c.isdigit():
+        return True
+    return bool(_LITERAL_RE.match(text, j))
+
+
+def _repair_json(text: str) -> Tuple[str, List[str], int]:
+    """
+    Riparazione in un solo passaggio del primo valore JSON di `text`:
+    virgolette tipografiche o singole come delimitatori, virgolette non escapate dentro le stringhe,
+    a capo/tab letterali, virgole finali, True/False/None.
+    Ritorna (testo_riparato, riparazioni, fine); fine = indice in `text` subito dopo il valore,
+    -1 se il valore è troncato (stringhe o parentesi ancora aperte a fine testo).
+    """
+    out: List[str] = []
+    fixes: List[str] = []
+    stack: List[str] = []
+    quote = ""  # delimitatore che chiude la stringa corrente ("" = fuori da una stringa)
+    i, n = 0, len(text)
+
+    def fix(kind: str) -> None:
+        if kind not in fixes:
+            fixes.append(kind)
+
+    while i < n:
+        c = text[i]
+        if quote:
+            if c == "\\" and i + 1 < n:
+                out.append(text[i:i + 2])
+                i += 2
+                continue
+            is_delim = c == quote or (quote == "”" and c == "“")
+            if is_delim or (c == '"' and quote != '"'):
+                if is_delim and _closes_string(text, i, stack[-1] if stack else ""):
+                    out.append('"')
+                    quote = ""
+                else:
+                    out.append('\\"' if c == '"' else c)
+                    if c == '"':
+                        fix("unescaped_quotes")
+            elif c == "\n":
+                out.append("\\n")
+                fix("control_chars")
+            elif c == "\r":
+                out.append("\\r")
+                fix("control_chars")
+            elif c == "\t":
+                out.append("\\t")
+                fix("control_chars")
+            else:
+                out.append(c)
+            i += 1
+            continue
+
+        if c == '"':
+            quote = '"'
+            out.append(c)
+        elif c in "“”":
+            quote = "”"
+            out.append('"')
+            fix("smart_quotes")
+        elif c == "'":
+            quote = "'"
+            out.append('"')
+            fix("single_quotes")
+        elif c in "{[":
+            stack.append("}" if c == "{" else "]")
+            out.append(c)
+        elif c in "}]":
+            if stack:
+                stack.pop()
+            out.append(c)
+            if not stack:
+                return "".join(out), fixes, i + 1  # fine del primo valore: il resto è testo di contorno
+        elif c == "," and _next_significant(text, i + 1) in ("}", "]"):
+            fix("trailing_comma")
+        elif c.isalpha():
+            j = i
+            while j < n and text[j].isalpha():
+                j += 1
+            word = text[i:j]
+            if word in _LITERALS:
+                word = _LITERALS[word]
+                fix("python_literals")
+            out.append(word)
+            i = j
+            continue
+        else:
+            out.append(c)
+        i += 1
+
+    return "".join(out), fixes, -1
+
+
 # --- Helpers (lascia pure quelli che c'erano o usa questi semplificati) ---
 def _require_str(data, key):
     v = data.get(key)
@@ -47,6 +354,12 @@ def _require_str(data, key):
     return v.strip()
 
 
+def _optional_str(data, key):
+    # Campo facoltativo: "" se assente o non stringa (il chiamante userà il proprio fallback)
+    v = data.get(key)
+    return v.strip() if isinstance(v, str) else ""
+
+
 def _require_enum(data, key, allowed):
     v = _require_str(data, key)
     if v not in allowed: raise ResponseParseError(f"{v} non valido per {key}")
@@ -59,6 +372,17 @@ def _require_options(data):
     return {k: str(v).strip() for k, v in opts.items()}
 
 
+def _resolve_answer_letter(opzioni: Dict[str, Any], corretta: Any) -> str:
+    # Accetta "B", "b)", "B. testo" oppure direttamente il testo della risposta corretta
+    raw = str(corretta or "").strip()
+    for k, v in opzioni.items():
+        if raw and str(v).strip() == raw:
+            return k
+    letter = raw[:1].upper()
+    if letter not in opzioni: raise ResponseParseError(f"Risposta corretta non valida: {raw!r}", "bad_answer")
+    return letter
+
+
 def _require_choice_letter(data, key):
     v = _require_str(data, key).upper()
     if v not in ["A", "B", "C", "D"]: raise ResponseParseError("Lettera non valida")
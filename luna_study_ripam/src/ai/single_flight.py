@@ -0,0 +1,118 @@
+# src/ai/single_flight.py
+from __future__ import annotations
+
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+
+class _Call:
+    __slots__ = ("done", "value", "error", "waiters")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value: Any = None
+        self.error: Optional[BaseException] = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Coalescenza delle richieste identiche contemporanee (stile "singleflight" di Go).
+
+    do(key, fn): se per key c'è già una chiamata in volo si aspetta quella e se ne condivide
+    il risultato (o l'eccezione); altrimenti si esegue fn(). Nessuna cache: a chiamata conclusa
+    la chiave viene dimenticata.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+        self.executed = 0
+        self.coalesced = 0
+        self.max_waiters = 0
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """Ritorna (risultato, condiviso): condiviso=True se il risultato viene da una chiamata altrui."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+                self.executed += 1
+            else:
+                call.waiters += 1
+                self.coalesced += 1
+                self.max_waiters = max(self.max_waiters, call.waiters)
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value, True
+
+        try:
+            call.value = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+        return call.value, False
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return _stats(self.executed, self.coalesced, len(self._calls), self.max_waiters)
+
+
+class AsyncSingleFlight:
+    """Come SingleFlight, per coroutine sullo stesso event loop."""
+
+    def __init__(self):
+        self._calls: Dict[str, asyncio.Future] = {}
+        self._waiters: Dict[str, int] = {}
+        self.executed = 0
+        self.coalesced = 0
+        self.max_waiters = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        fut = self._calls.get(key)
+        if fut is not None:
+            self.coalesced += 1
+            self._waiters[key] = self._waiters.get(key, 0) + 1
+            self.max_waiters = max(self.max_waiters, self._waiters[key])
+            # shield: se il chiamante che aspetta viene cancellato, la chiamata condivisa continua
+            return await asyncio.shield(fut), True
+
+        fut = asyncio.get_running_loop().create_future()
+        self._calls[key] = fut
+        self.executed += 1
+        try:
+            value = await fn()
+        except BaseException as e:
+            fut.set_exception(e)
+            fut.exception()  # segnata come letta: niente warning se nessuno stava aspettando
+            raise
+        else:
+            fut.set_result(value)
+            return value, False
+        finally:
+            self._calls.pop(key, None)
+            self._waiters.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        return _stats(self.executed, self.coalesced, len(self._calls), self.max_waiters)
+
+
+def _stats(executed: int, coalesced: int, in_flight: int, max_waiters: int) -> Dict[str, Any]:
+    total = executed + coalesced
+    return {
+        "requests": total,
+        "executed": executed,
+        "coalesced": coalesced,
+        "coalesced_rate": (coalesced / total) if total else 0.0,
+        "in_flight": in_flight,
+        "max_waiters": max_waiters,
+    }
@@ -0,0 +1,279 @@
+# src/ai/telemetry.py
+from __future__ import annotations
+
+import bisect
+import json
+import os
+import threading
+import time
+from collections import deque
+from dataclasses import asdict, dataclass
+from typing import Any, Deque, Dict, List, Optional, Sequence, Tuple
+
+# Limiti superiori dei bucket (stile Prometheus: cumulativi, più +Inf implicito)
+LATENCY_BUCKETS_SEC = (0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0)
+TOKEN_BUCKETS = (16, 64, 256, 1024, 4096, 16384)
+
+# Esiti di una chiamata logica (dopo i retry)
+# ("truncated": risposta fermata dal tetto max_output_tokens, scartata come output non valido)
+OUTCOMES = ("ok", "empty", "error", "circuit_open", "cancelled", "cache_hit", "coalesced", "partial", "truncated")
+
+
+@dataclass
+class LLMCallRecord:
+    """Una chiamata LLM logica: retry inclusi (attempts), latenza dal primo tentativo all'esito."""
+    call_site: str  # punto del motore che chiama (es. "quiz_single", "pool_refill", "lesson_variant"); default call_type
+    model: str
+    outcome: str
+    latency_sec: float
+    prompt_chars: int = 0
+    response_chars: int = 0
+    prompt_tokens: int = 0
+    response_tokens: int = 0
+    tokens_estimated: bool = True  # False se i token vengono dall'usage del servizio
+    attempts: int = 1
+    stream: bool = False
+    at: float = 0.0
+
+
+class Histogram:
+    """Istogramma a bucket fissi; quantile() stima per interpolazione lineare dentro il bucket."""
+
+    def __init__(self, bounds: Sequence[float]):
+        self.bounds = tuple(sorted(bounds))
+        self.counts = [0] * (len(self.bounds) + 1)  # ultimo = +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self) -> List[Tuple[str, int]]:
+        out, running = [], 0
+        for bound, n in zip(self.bounds + (float("inf"),), self.counts):
+            running += n
+            out.append(("+Inf" if bound == float("inf") else _fmt(bound), running))
+        return out
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not self.count:
+            return None
+        rank = q * self.count
+        running = 0
+        for i, n in enumerate(self.counts):
+            if n and running + n >= rank:
+                low = self.bounds[i - 1] if i > 0 else 0.0
+                if i >= len(self.bounds):
+                    return low  # oltre l'ultimo bucket: il limite noto più alto
+                return low + (self.bounds[i] - low) * ((rank - running) / n)
+            running += n
+        return self.bounds[-1]
+
+    def snapshot(self) -> Dict[str, Any]:
+        p50, p95 = self.quantile(0.5), self.quantile(0.95)
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 4),
+            "p50": round(p50, 4) if p50 is not None else None,
+            "p95": round(p95, 4) if p95 is not None else None,
+            "buckets": dict(self.cumulative()),
+        }
+
+
+class _Aggregate:
+    def __init__(self):
+        self.calls = 0
+        self.outcomes: Dict[str, int] = {}
+        self.retries = 0
+        self.prompt_tokens = 0
+        self.response_tokens = 0
+        self.prompt_chars = 0
+        self.response_chars = 0
+        self.estimated = 0
+        self.latency = Histogram(LATENCY_BUCKETS_SEC)
+        self.response_tokens_hist = Histogram(TOKEN_BUCKETS)
+
+    def add(self, rec: LLMCallRecord) -> None:
+        self.calls += 1
+        self.outcomes[rec.outcome] = self.outcomes.get(rec.outcome, 0) + 1
+        self.retries += max(0, rec.attempts - 1)
+        self.prompt_tokens += rec.prompt_tokens
+        self.response_tokens += rec.response_tokens
+        self.prompt_chars += rec.prompt_chars
+        self.response_chars += rec.response_chars
+        self.estimated += int(rec.tokens_estimated)
+        # Cache e coalescenza non toccano il servizio: contano come chiamate ma non sporcano le latenze
+        if rec.outcome not in ("cache_hit", "coalesced"):
+            self.latency.observe(rec.latency_sec)
+            # Le risposte troncate stanno nel bucket del tetto: sono il segnale per alzarlo
+            if rec.outcome in ("ok", "partial", "truncated"):
+                self.response_tokens_hist.observe(rec.response_tokens)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "outcomes": dict(self.outcomes),
+            "retries": self.retries,
+            "prompt_tokens": self.prompt_tokens,
+            "response_tokens": self.response_tokens,
+            "prompt_chars": self.prompt_chars,
+            "response_chars": self.response_chars,
+            "tokens_estimated": self.estimated,
+            "latency_sec": self.latency.snapshot(),
+            "response_tokens_hist": self.response_tokens_hist.snapshot(),
+        }
+
+
+class LLMTelemetry:
+    """
+    Strumentazione delle chiamate LLM, aggregata per (call_site, modello).
+
+    - record(): una LLMCallRecord per chiamata logica (il client la produce dopo retry/cache/stream).
+    - record_parse_failure(): risposte arrivate ma inutilizzabili (JSON non valido, schema, ...).
+    - stats(): snapshot in-process (istogrammi di latenza e token, esiti, retry, ultime chiamate).
+    - dump()/start_dump(): scrittura su disco in JSON o, con estensione .prom/.txt, testo Prometheus.
+    """
+
+    def __init__(self, recent: int = 50):
+        self._lock = threading.Lock()
+        self._by_key: Dict[Tuple[str, str], _Aggregate] = {}
+        self._parse_failures: Dict[Tuple[str, str], int] = {}
+        self._recent: Deque[LLMCallRecord] = deque(maxlen=max(1, recent))
+        self.started_at = time.time()
+        self._dump_stop: Optional[threading.Event] = None
+        self._dump_path: Optional[str] = None
+
+    def record(self, rec: LLMCallRecord) -> None:
+        if not rec.at:
+            rec.at = time.time()
+        with self._lock:
+            agg = self._by_key.get((rec.call_site, rec.model))
+            if agg is None:
+                agg = self._by_key[(rec.call_site, rec.model)] = _Aggregate()
+            agg.add(rec)
+            self._recent.append(rec)
+
+    def record_parse_failure(self, call_site: str, reason: str) -> None:
+        with self._lock:
+            key = (call_site, reason)
+            self._parse_failures[key] = self._parse_failures.get(key, 0) + 1
+
+    # -------------------------
+    # Lettura
+    # -------------------------
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            by_call: Dict[str, Dict[str, Any]] = {}
+            for (call_site, model), agg in sorted(self._by_key.items()):
+                by_call.setdefault(call_site, {})[model] = agg.snapshot()
+            parse_failures: Dict[str, Dict[str, int]] = {}
+            for (call_site, reason), n in sorted(self._parse_failures.items()):
+                parse_failures.setdefault(call_site, {})[reason] = n
+            return {
+                "since": self.started_at,
+                "at": time.time(),
+                "totals": {
+                    "calls": sum(a.calls for a in self._by_key.values()),
+                    "retries": sum(a.retries for a in self._by_key.values()),
+                    "prompt_tokens": sum(a.prompt_tokens for a in self._by_key.values()),
+                    "response_tokens": sum(a.response_tokens for a in self._by_key.values()),
+                    "parse_failures": sum(self._parse_failures.values()),
+                },
+                "by_call": by_call,
+                "parse_failures": parse_failures,
+                "recent": [asdict(r) for r in self._recent],
+            }
+
+    def to_prometheus(self) -> str:
+        """Testo nel formato di esposizione Prometheus (per node_exporter textfile o simili)."""
+        lines: List[str] = []
+        with self._lock:
+            items = sorted(self._by_key.items())
+            parse_failures = sorted(self._parse_failures.items())
+
+            lines += ["# HELP llm_calls_total Chiamate LLM logiche per esito.", "# TYPE llm_calls_total counter"]
+            for (site, model), agg in items:
+                for outcome, n in sorted(agg.outcomes.items()):
+                    lines.append(f"llm_calls_total{_labels(call_site=site, model=model, outcome=outcome)} {n}")
+
+            lines += ["# HELP llm_retries_total Tentativi oltre il primo.", "# TYPE llm_retries_total counter"]
+            for (site, model), agg in items:
+                lines.append(f"llm_retries_total{_labels(call_site=site, model=model)} {agg.retries}")
+
+            for metric, attr in (("llm_prompt_tokens_total", "prompt_tokens"),
+                                 ("llm_response_tokens_total", "response_tokens")):
+                lines.append(f"# TYPE {metric} counter")
+                for (site, model), agg in items:
+                    lines.append(f"{metric}{_labels(call_site=site, model=model)} {getattr(agg, attr)}")
+
+            for metric, attr in (("llm_latency_seconds", "latency"),
+                                 ("llm_response_tokens", "response_tokens_hist")):
+                lines.append(f"# TYPE {metric} histogram")
+                for (site, model), agg in items:
+                    hist: Histogram = getattr(agg, attr)
+                    for le, n in hist.cumulative():
+                        lines.append(f"{metric}_bucket{_labels(call_site=site, model=model, le=le)} {n}")
+                    lines.append(f"{metric}_sum{_labels(call_site=site, model=model)} {_fmt(hist.sum)}")
+                    lines.append(f"{metric}_count{_labels(call_site=site, model=model)} {hist.count}")
+
+            lines += ["# HELP llm_parse_failures_total Risposte non utilizzabili.",
+                      "# TYPE llm_parse_failures_total counter"]
+            for (site, reason), n in parse_failures:
+                lines.append(f"llm_parse_failures_total{_labels(call_site=site, reason=reason)} {n}")
+        return "\n".join(lines) + "\n"
+
+    # -------------------------
+    # Dump su disco
+    # -------------------------
+
+    def dump(self, path: str) -> None:
+        """Scrittura atomica (file temporaneo + rename). .prom/.txt: testo Prometheus, altrimenti JSON."""
+        folder = os.path.dirname(os.path.abspath(path))
+        os.makedirs(folder, exist_ok=True)
+        if path.endswith((".prom", ".txt")):
+            payload = self.to_prometheus()
+        else:
+            payload = json.dumps(self.stats(), ensure_ascii=False, indent=2)
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(payload)
+        os.replace(tmp, path)
+
+    def start_dump(self, path: str, interval_sec: float = 60.0) -> None:
+        """Dump periodico in background (thread daemon); stop_dump() lo ferma con un ultimo dump."""
+        self.stop_dump()
+        stop = self._dump_stop = threading.Event()
+        self._dump_path = path
+
+        def worker() -> None:
+            while not stop.wait(max(1.0, interval_sec)):
+                self._safe_dump(path)
+
+        threading.Thread(target=worker, name="llm-telemetry-dump", daemon=True).start()
+
+    def stop_dump(self) -> None:
+        """Ferma il dump periodico e scrive subito lo stato finale (da chiamare alla chiusura dell'app)."""
+        if self._dump_stop is None:
+            return
+        self._dump_stop.set()
+        self._dump_stop = None
+        self._safe_dump(self._dump_path)
+
+    def _safe_dump(self, path: str) -> None:
+        try:
+            self.dump(path)
+        except Exception as e:
+            print(f"[TELEMETRY] Errore scrittura {path}: {e}")
+
+
+def _fmt(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+def _labels(**labels: str) -> str:
+    def esc(v: str) -> str:
+        return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in labels.items()) + "}"
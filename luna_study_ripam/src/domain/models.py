@@ -32,10 +32,16 @@ class Question:
     tags: List[str] = field(default_factory=list)
     visual: str = ""
     spiegazione_breve: str = ""
+    # Reazioni del tutor generate insieme alla domanda: feedback immediato senza un'altra chiamata LLM
+    reazione_corretta: str = ""
+    reazione_errata: str = ""
 
 
 @dataclass
 class SessionState:
+    # Identifica l'utente per le domande già servite dal pool
+    learner_id: str = "default"
+
     progress: Dict[TutorName, int] = field(default_factory=dict)
     stage: Dict[TutorName, int] = field(default_factory=dict)
     history: List[HistoryItem] = field(default_factory=list)
@@ -0,0 +1,218 @@
+# src/engine/chat_memory.py
+from __future__ import annotations
+
+import threading
+from collections import deque
+from dataclasses import dataclass
+from typing import Callable, Deque, List, Optional, Tuple
+
+from src.ai.rate_limit import estimate_tokens
+
+# summarize(testo, max_tokens) -> riassunto ("" se non disponibile: si usa il riassunto locale)
+Summarizer = Callable[[str, int], str]
+
+_CHARS_PER_TOKEN = 4  # stessa stima di estimate_tokens
+
+
+@dataclass(frozen=True)
+class ChatMemoryConfig:
+    token_budget: int = 1500  # tetto per il contesto di ogni prompt di chat (lezione + riassunto + turni)
+    lesson_tokens: int = 400  # quota per la lezione (riassunta)
+    summary_tokens: int = 300  # quota per il riassunto dei turni vecchi
+    recent_turns: int = 6  # turni tenuti alla lettera; i più vecchi finiscono nel riassunto
+    message_tokens: int = 300  # tetto per il singolo messaggio dell'utente
+    turn_snippet_tokens: int = 40  # riassunto locale: quanto tenere di ogni turno compresso
+
+
+def clip_tokens(text: str, max_tokens: int, keep_tail: bool = False) -> str:
+    """Taglia il testo a ~max_tokens, su un confine di parola. keep_tail: tiene la parte finale."""
+    max_chars = max(0, max_tokens) * _CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return text
+    if keep_tail:
+        cut = text[len(text) - max_chars:]
+        space = cut.find(" ")
+        return "…" + (cut[space + 1:] if 0 <= space < 40 else cut)
+    cut = text[:max_chars]
+    space = cut.rfind(" ")
+    return (cut[:space] if space > max_chars - 40 else cut) + "…"
+
+
+class ChatMemory:
+    """
+    Memoria della chat col tutor per la lezione corrente, a dimensione costante.
+
+    - Lezione: tenuta come riassunto entro lesson_tokens (estratto locale subito, riassunto LLM se disponibile).
+    - Turni recenti (al massimo recent_turns) alla lettera.
+    - Turni più vecchi compressi in un riassunto progressivo entro summary_tokens (compact()).
+    - render() rispetta sempre token_budget: se la compattazione non è ancora avvenuta
+      i turni più vecchi che non ci stanno vengono semplicemente omessi dal prompt.
+    """
+
+    def __init__(self, cfg: Optional[ChatMemoryConfig] = None, summarize: Optional[Summarizer] = None):
+        self.cfg = cfg or ChatMemoryConfig()
+        self.summarize = summarize
+        self._lock = threading.Lock()
+        self._compact_lock = threading.Lock()
+        self._topic = ""
+        self._lesson = ""
+        self._lesson_digest = ""
+        self._summary = ""
+        self._turns: Deque[Tuple[str, str]] = deque()
+        self._generation = 0  # incrementato a ogni reset: i riassunti in corso per la lezione vecchia si scartano
+
+    # -------------------------
+    # Aggiornamento
+    # -------------------------
+
+    def reset(self, topic: str = "") -> None:
+        with self._lock:
+            self._generation += 1
+            self._topic = topic
+            self._lesson = ""
+            self._lesson_digest = ""
+            self._summary = ""
+            self._turns.clear()
+
+    def set_lesson(self, text: str) -> None:
+        """Testo della lezione: subito un estratto locale; summarize_lesson() lo sostituisce con un riassunto."""
+        text = (text or "").strip()
+        with self._lock:
+            self._lesson = text
+            self._lesson_digest = clip_tokens(text, self.cfg.lesson_tokens)
+
+    def add_turn(self, role: str, text: str) -> None:
+        """role: "user" oppure "tutor"."""
+        with self._lock:
+            self._turns.append((role, (text or "").strip()))
+
+    def needs_compaction(self) -> bool:
+        with self._lock:
+            return len(self._turns) > self.cfg.recent_turns
+
+    def lesson_needs_summary(self) -> bool:
+        with self._lock:
+            return estimate_tokens(self._lesson) > self.cfg.lesson_tokens
+
+    # -------------------------
+    # Compressione
+    # -------------------------
+
+    def compact(self) -> int:
+        """Sposta i turni in eccesso nel riassunto. Ritorna quanti turni sono stati compressi."""
+        with self._compact_lock:
+            with self._lock:
+                generation = self._generation
+                excess = len(self._turns) - self.cfg.recent_turns
+                if excess <= 0:
+                    return 0
+                old = [self._turns[i] for i in range(excess)]
+                previous = self._summary
+
+            summary = self._summarize_turns(previous, old)
+
+            with self._lock:
+                if generation != self._generation:
+                    return 0
+                for _ in range(excess):
+                    self._turns.popleft()
+                self._summary = summary
+            return excess
+
+    def summarize_lesson(self) -> bool:
+        with self._lock:
+            generation = self._generation
+            lesson = self._lesson
+        if not self.summarize or estimate_tokens(lesson) <= self.cfg.lesson_tokens:
+            return False
+        digest = self._call_summarize(
+            f"Lezione su \"{self._topic}\":\n{lesson}", self.cfg.lesson_tokens)
+        if not digest:
+            return False
+        with self._lock:
+            if generation != self._generation or lesson != self._lesson:
+                return False
+            self._lesson_digest = clip_tokens(digest, self.cfg.lesson_tokens)
+        return True
+
+    def _summarize_turns(self, previous: str, turns: List[Tuple[str, str]]) -> str:
+        transcript = "\n".join(f"{_label(role)}: {text}" for role, text in turns)
+        if self.summarize:
+            material = (f"Riassunto precedente:\n{previous}\n\n" if previous else "") + f"Nuovi scambi:\n{transcript}"
+            summary = self._call_summarize(material, self.cfg.summary_tokens)
+            if summary:
+                return clip_tokens(summary, self.cfg.summary_tokens)
+        # Riassunto locale: un estratto per turno, tenendo i più recenti se si sfora la quota
+        snippets = [f"{_label(role)}: {clip_tokens(text, self.cfg.turn_snippet_tokens)}"
+                    for role, text in turns]
+        merged = "\n".join(([previous] if previous else []) + snippets)
+        return clip_tokens(merged, self.cfg.summary_tokens, keep_tail=True)
+
+    def _call_summarize(self, material: str, max_tokens: int) -> str:
+        try:
+            return (self.summarize(material, max_tokens) or "").strip()
+        except Exception as e:
+            print(f"[CHAT] Errore riassunto: {e}")
+            return ""
+
+    # -------------------------
+    # Prompt
+    # -------------------------
+
+    def render(self, budget: Optional[int] = None) -> str:
+        """Contesto per il prompt di chat entro budget token (default: cfg.token_budget)."""
+        budget = self.cfg.token_budget if budget is None else budget
+        with self._lock:
+            topic, lesson, summary, turns = self._topic, self._lesson_digest, self._summary, list(self._turns)
+
+        # Conteggio in caratteri (come estimate_tokens), intestazioni e separatori compresi
+        limit = budget * _CHARS_PER_TOKEN
+        blocks: List[str] = []
+        used = 0
+
+        def add(block: str) -> bool:
+            nonlocal used
+            cost = len(block) + (2 if blocks else 0)
+            if used + cost > limit:
+                return False
+            blocks.append(block)
+            used += cost
+            return True
+
+        if topic:
+            add(f"ARGOMENTO DELLA LEZIONE: {topic}")
+        if lesson:
+            add("SINTESI DELLA LEZIONE:\n" + clip_tokens(lesson, min(self.cfg.lesson_tokens, budget // 3)))
+        if summary:
+            add("CONVERSAZIONE PRECEDENTE (riassunto):\n" +
+                clip_tokens(summary, min(self.cfg.summary_tokens, budget // 4), keep_tail=True))
+
+        header = "ULTIMI SCAMBI:"
+        room = limit - used - len(header) - (2 if blocks else 0)
+        # Turni recenti dal più nuovo al più vecchio finché c'è spazio
+        recent: List[str] = []
+        for role, text in reversed(turns):
+            line = f"{_label(role)}: {text}"
+            cost = len(line) + 1
+            if cost > room:
+                if not recent and room > 1 + _CHARS_PER_TOKEN:
+                    # "…" iniziale compreso
+                    recent.append(clip_tokens(line, (room - 2) // _CHARS_PER_TOKEN, keep_tail=True))
+                break
+            recent.append(line)
+            room -= cost
+        if recent:
+            blocks.append(header + "\n" + "\n".join(reversed(recent)))
+        return "\n\n".join(blocks)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "turns": len(self._turns),
+                "summary_tokens": estimate_tokens(self._summary) if self._summary else 0,
+                "lesson_tokens": estimate_tokens(self._lesson_digest) if self._lesson_digest else 0,
+            }
+
+
+def _label(role: str) -> str:
+    return "Utente" if role == "user" else "Tutor"
@@ -0,0 +1,158 @@
+# src/engine/dedup_index.py
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import re
+import threading
+import unicodedata
+from typing import Dict, List, Optional, Set, Tuple
+
+from src.domain.models import Question
+
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+_MERSENNE = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+
+def _normalize(text: str) -> List[str]:
+    # minuscolo, senza accenti, solo parole
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return _WORD_RE.findall(text)
+
+
+def shingles(q: Question, size: int = 3) -> Set[str]:
+    """Shingle di parole su testo della domanda + opzioni (in ordine stabile, indipendente dal mescolamento)."""
+    words = _normalize(q.domanda)
+    for opt in sorted(q.opzioni.values()):
+        words += _normalize(opt)
+    if len(words) < size:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def _stable_hash(text: str) -> int:
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=4).digest(), "little")
+
+
+class NearDuplicateIndex:
+    """
+    Indice MinHash/LSH delle domande già viste da un learner.
+
+    - Firma MinHash (num_perm valori) sugli shingle di parole di domanda + opzioni.
+    - LSH a bande: solo le domande che condividono almeno una banda vengono confrontate,
+      quindi la ricerca resta veloce anche con decine di migliaia di domande.
+    - Duplicato = similarità di Jaccard stimata >= threshold.
+
+    Con path le firme vengono salvate in JSONL (una riga per domanda, in append).
+    """
+
+    def __init__(self, path: Optional[str] = None, num_perm: int = 64, bands: int = 16,
+                 threshold: float = 0.6):
+        if num_perm % bands:
+            raise ValueError("num_perm deve essere multiplo di bands")
+        self.path = path
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        # Permutazioni (a*x + b) mod p deterministiche: le firme salvate restano valide tra i riavvii
+        self._perms: List[Tuple[int, int]] = []
+        for i in range(num_perm):
+            h = hashlib.sha1(f"minhash-{i}".encode("ascii")).digest()
+            a = int.from_bytes(h[:8], "little") % (_MERSENNE - 1) + 1
+            b = int.from_bytes(h[8:16], "little") % _MERSENNE
+            self._perms.append((a, b))
+        self._signatures: List[Tuple[int, ...]] = []
+        self._buckets: List[Dict[Tuple[int, ...], List[int]]] = [{} for _ in range(bands)]
+        self._load()
+
+    def __len__(self) -> int:
+        return len(self._signatures)
+
+    def signature(self, q: Question) -> Tuple[int, ...]:
+        hashes = [_stable_hash(s) for s in shingles(q)]
+        if not hashes:
+            return tuple([_MAX_HASH] * self.num_perm)
+        return tuple(min(((a * h + b) % _MERSENNE) & _MAX_HASH for h in hashes) for a, b in self._perms)
+
+    def _bands_of(self, sig: Tuple[int, ...]) -> List[Tuple[int, ...]]:
+        return [sig[i * self.rows:(i + 1) * self.rows] for i in range(self.bands)]
+
+    def _similarity(self, s1: Tuple[int, ...], s2: Tuple[int, ...]) -> float:
+        return sum(1 for x, y in zip(s1, s2) if x == y) / self.num_perm
+
+    def best_match(self, q: Question) -> float:
+        """Similarità stimata con la domanda vista più simile (0.0 se nessun candidato)."""
+        sig = self.signature(q)
+        with self._lock:
+            candidates: Set[int] = set()
+            for band, key in enumerate(self._bands_of(sig)):
+                candidates.update(self._buckets[band].get(key, ()))
+            return max((self._similarity(sig, self._signatures[i]) for i in candidates), default=0.0)
+
+    def is_duplicate(self, q: Question) -> bool:
+        return self.best_match(q) >= self.threshold
+
+    def add(self, q: Question) -> None:
+        sig = self.signature(q)
+        with self._lock:
+            self._insert(sig)
+            if self.path:
+                try:
+                    with open(self.path, "a", encoding="utf-8") as f:
+                        f.write(json.dumps(list(sig)) + "\n")
+                except Exception as e:
+                    print(f"[DEDUP] Errore scrittura indice: {e}")
+
+    def _insert(self, sig: Tuple[int, ...]) -> None:
+        idx = len(self._signatures)
+        self._signatures.append(sig)
+        for band, key in enumerate(self._bands_of(sig)):
+            self._buckets[band].setdefault(key, []).append(idx)
+
+    def _load(self) -> None:
+        if not self.path or not os.path.exists(self.path):
+            return
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    sig = tuple(json.loads(line))
+                except:
+                    continue
+                if len(sig) == self.num_perm:
+                    self._insert(sig)
+
+
+class SeenQuestions:
+    """Un NearDuplicateIndex per learner, persistito in <root>/<learner>.jsonl (root=None: solo in memoria)."""
+
+    def __init__(self, root_dir: Optional[str] = None, threshold: float = 0.6):
+        self.root_dir = root_dir
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self._indexes: Dict[str, NearDuplicateIndex] = {}
+        if root_dir:
+            os.makedirs(root_dir, exist_ok=True)
+
+    def for_learner(self, learner_id: str) -> NearDuplicateIndex:
+        with self._lock:
+            index = self._indexes.get(learner_id)
+            if index is None:
+                path = None
+                if self.root_dir:
+                    safe = re.sub(r"[^A-Za-z0-9_-]+", "_", learner_id) or "default"
+                    path = os.path.join(self.root_dir, f"{safe}.jsonl")
+                index = NearDuplicateIndex(path, threshold=self.threshold)
+                self._indexes[learner_id] = index
+            return index
+
+    def is_duplicate(self, learner_id: str, q: Question) -> bool:
+        return self.for_learner(learner_id).is_duplicate(q)
+
+    def mark_seen(self, learner_id: str, q: Question) -> None:
+        self.for_learner(learner_id).add(q)
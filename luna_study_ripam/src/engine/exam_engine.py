@@ -1,17 +1,26 @@
 # src/engine/exam_engine.py
 import random
+import threading
 import time
-import json
+from concurrent.futures import Future, ThreadPoolExecutor
 from dataclasses import dataclass, field
-from typing import List, Dict, Optional, Tuple
+from functools import partial
+from typing import Callable, List, Dict, Optional, Set, Tuple
 
 from src.domain.models import Question
 from src.ai.gemini_client import GeminiClient
-from src.ai.prompt_builder import build_question_prompt, PromptBuildConfig
+from src.ai.prompt_builder import build_question_prompt, build_question_batch_prompt, PromptBuildConfig
+from src.ai.json_schema import question_batch_json_schema, question_json_schema
+from src.ai.response_parser import (
+    ResponseParseError, StructuredOutputError, question_from_payload, questions_from_payloads,
+)
 from src.engine.scoring import ScoreConfig
 from src.domain.syllabus import get_random_topic
 from src.engine.tutor_router import tutor_for_subject
 from src.engine.subject_picker import SUB_TOPICS
+from src.engine.local_bank import LocalQuestionBank
+from src.engine.question_pool import QuestionPool, split_topic
+from src.engine.dedup_index import NearDuplicateIndex, SeenQuestions
 
 
 @dataclass
@@ -22,14 +31,45 @@ class ExamSession:
     start_time: float = 0.0
     duration_seconds: int = 3600
     subject_roadmap: List[str] = field(default_factory=list)
+    learner_id: str = "default"
+
+    # Pre-generazione: domande pronte fuori ordine e job ancora in corso (indice roadmap -> ...)
+    ready: Dict[int, Question] = field(default_factory=dict)
+    pending: Dict[int, Future] = field(default_factory=dict)
+    # Domande preparate per questa prova (anche non ancora mostrate): niente quasi-duplicati tra slot.
+    # Nello storico del learner (SeenQuestions) entrano solo quando vengono servite (served: indici roadmap)
+    generated: NearDuplicateIndex = field(default_factory=NearDuplicateIndex)
+    served: Set[int] = field(default_factory=set)
+
+
+# on_progress(pronte, totale, indice_appena_completato) - chiamata dai thread worker
+ProgressCallback = Callable[[int, int, int], None]
 
 
 class ExamEngine:
-    def __init__(self, project_root: str, gemini: GeminiClient):
+    # Difficoltà media per l'esame standard (anche per i bucket del pool condiviso)
+    EXAM_STAGE = 3
+
+    def __init__(self, project_root: str, gemini: GeminiClient, question_pool: Optional[QuestionPool] = None,
+                 seen: Optional[SeenQuestions] = None):
         self.project_root = project_root
         self.gemini = gemini
-
-    def start_exam(self) -> ExamSession:
+        self.local_bank = LocalQuestionBank(project_root)
+        # Pool condiviso (di solito quello di SessionEngine): estrazioni istantanee quando c'è scorta
+        self.question_pool = question_pool
+        # Indice delle domande già viste (di solito condiviso con SessionEngine)
+        self.seen = seen or SeenQuestions()
+        self._lock = threading.Lock()
+
+    def start_exam(self, pregenerate: bool = False, max_workers: int = 4,
+                   on_progress: Optional[ProgressCallback] = None, batch_size: int = 1,
+                   learner_id: str = "default") -> ExamSession:
+        """
+        Crea la roadmap delle 40 domande.
+        pregenerate=True: genera tutte le domande in parallelo (max_workers chiamate contemporanee)
+        invece di crearle una alla volta durante la prova.
+        batch_size > 1: le domande della stessa materia vengono chieste a blocchi con una sola chiamata.
+        """
         roadmap = []
 
         # --- BLOCCO 1: 10 QUESITI COMUNI (Art. 6 Bando) ---
@@ -79,91 +119,260 @@ class ExamEngine:
 
         final_roadmap = technical_part + roadmap[32:]  # Situazionali in coda (domande 33-40)
 
-        return ExamSession(start_time=time.time(), subject_roadmap=final_roadmap)
+        session = ExamSession(start_time=time.time(), subject_roadmap=final_roadmap, learner_id=learner_id,
+                              generated=NearDuplicateIndex(threshold=self.seen.threshold))
+        if pregenerate:
+            self._pregenerate(session, max_workers, batch_size, on_progress)
+        return session
+
+    def _pregenerate(self, session: ExamSession, max_workers: int, batch_size: int,
+                     on_progress: Optional[ProgressCallback]) -> None:
+        total = len(session.subject_roadmap)
+        executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="exam-pregen")
+
+        def store(index: int, q: Question) -> None:
+            session.generated.add(q)
+            with self._lock:
+                self._store_question(session, index, q)
+                done = len(session.ready) + len(session.questions)
+            if on_progress:
+                try:
+                    on_progress(done, total, index)
+                except Exception as e:
+                    print(f"[EXAM] Errore callback progresso: {e}")
+
+        def job(subject: str, indexes: List[int]) -> None:
+            # Prima il pool (istantaneo), poi un batch LLM solo per gli slot rimasti scoperti
+            missing: List[int] = []
+            for index in indexes:
+                q = self._draw_from_pool(subject, session.learner_id, exclude=session.generated)
+                if q is not None:
+                    store(index, q)
+                else:
+                    missing.append(index)
+            questions = self._generate_batch(subject, len(missing), session.learner_id, session.generated) \
+                if len(missing) > 1 else []
+            for i, index in enumerate(missing):
+                # Slot non coperti dal batch (elementi scartati): generazione singola
+                q = questions[i] if i < len(questions) \
+                    else self._generate_question(subject, session.learner_id, session.generated,
+                                                 call_site="exam_pregeneration")
+                store(index, q)
+
+        # Raggruppa gli slot per materia (blocchi da batch_size) mantenendo l'ordine di roadmap:
+        # i blocchi che contengono le prime domande partono per primi
+        groups: List[Tuple[str, List[int]]] = []
+        open_group: Dict[str, List[int]] = {}
+        for index, subject in enumerate(session.subject_roadmap):
+            group = open_group.get(subject)
+            if group is None or len(group) >= max(1, batch_size):
+                group = []
+                open_group[subject] = group
+                groups.append((subject, group))
+            group.append(index)
+
+        for subject, indexes in groups:
+            fut = executor.submit(job, subject, indexes)
+            for index in indexes:
+                session.pending[index] = fut
+
+        # I job già sottomessi continuano; il pool si chiude quando ha finito
+        executor.shutdown(wait=False)
+
+    def cancel_pregeneration(self, session: ExamSession) -> None:
+        """Annulla i job non ancora partiti (es. esame abbandonato)."""
+        for fut in list(session.pending.values()):
+            fut.cancel()
+
+    def _store_question(self, session: ExamSession, index: int, q: Question) -> None:
+        # Da chiamare con self._lock acquisito.
+        # Le domande entrano in session.questions solo in ordine di roadmap;
+        # quelle pronte "in avanti" restano in session.ready finché i buchi non si chiudono.
+        session.pending.pop(index, None)
+        if index < len(session.questions):
+            return
+        session.ready[index] = q
+        while len(session.questions) in session.ready:
+            session.questions.append(session.ready.pop(len(session.questions)))
 
     def get_next_question(self, session: ExamSession) -> Optional[Question]:
-        if session.current_index >= len(session.subject_roadmap):
+        index = session.current_index
+        if index >= len(session.subject_roadmap):
             return None
 
-        if session.current_index < len(session.questions):
-            return session.questions[session.current_index]
+        with self._lock:
+            q = self._prepared(session, index)
+            fut = session.pending.get(index)
+
+        # Pre-generazione in corso per questo slot: aspettiamo solo lui (o il suo blocco)
+        if q is None and fut is not None and not fut.cancelled():
+            try:
+                fut.result()
+            except Exception as e:
+                print(f"[EXAM] Pre-generazione fallita per domanda {index + 1}: {e}")
+            with self._lock:
+                q = self._prepared(session, index)
+
+        if q is None:
+            q = self._generate_question(session.subject_roadmap[index], session.learner_id, session.generated)
+            with self._lock:
+                self._store_question(session, index, q)
+        return self._serve(session, index, q)
+
+    def _prepared(self, session: ExamSession, index: int) -> Optional[Question]:
+        # Da chiamare con self._lock acquisito
+        if index < len(session.questions):
+            return session.questions[index]
+        return session.ready.get(index)
+
+    def _serve(self, session: ExamSession, index: int, q: Question) -> Question:
+        # "Vista" solo quando viene mostrata, una volta per slot (non alla pre-generazione)
+        with self._lock:
+            first = index not in session.served
+            session.served.add(index)
+        if first:
+            self.seen.mark_seen(session.learner_id, q)
+        return q
+
+    def _is_used(self, learner_id: str, q: Question, exclude: Optional[NearDuplicateIndex] = None) -> bool:
+        """Quasi-duplicato di una domanda già vista dal learner o già preparata per la prova (exclude)."""
+        return self.seen.is_duplicate(learner_id, q) or (exclude is not None and exclude.is_duplicate(q))
+
+    def _pick_specific_topic(self, subject: str) -> str:
+        if subject in SUB_TOPICS:
+            return f"{subject}: {random.choice(SUB_TOPICS[subject])}"
+        return get_random_topic(subject)
+
+    def _question_type(self, subject: str) -> str:
+        return "situazionale" if subject == "Quesiti situazionali" else "standard"
 
+    def _draw_from_pool(self, subject: str, learner_id: str, specific_topic: str = "",
+                        exclude: Optional[NearDuplicateIndex] = None) -> Optional[Question]:
+        if not self.question_pool:
+            return None
+        specific_topic = specific_topic or self._pick_specific_topic(subject)
+        _, subtopic = split_topic(specific_topic)
+        while True:
+            q = self.question_pool.draw(subject, subtopic, learner_id, self.EXAM_STAGE)
+            if q is None:
+                return None
+            if not self._is_used(learner_id, q, exclude):
+                break
+        q.tutor = tutor_for_subject(subject)
+        q.materia = subject
+        q.tipo = self._question_type(subject)
+        return q
+
+    def _generate_question(self, subject: str, learner_id: str = "default",
+                           exclude: Optional[NearDuplicateIndex] = None, call_site: str = "exam_single") -> Question:
         # --- GENERAZIONE NUOVA DOMANDA ---
-        subject = session.subject_roadmap[session.current_index]
+        # call_site: "exam_single" (slot non pronto, l'utente aspetta) o "exam_pregeneration" (in background)
 
         # 1. Scelta del Topic Specifico
-        if subject in SUB_TOPICS:
-            specific_topic = f"{subject}: {random.choice(SUB_TOPICS[subject])}"
-        else:
-            specific_topic = get_random_topic(subject)
+        specific_topic = self._pick_specific_topic(subject)
+
+        # Domanda già pronta nel pool per questo sotto-argomento?
+        q = self._draw_from_pool(subject, learner_id, specific_topic, exclude)
+        if q is not None:
+            return q
 
         # 2. Scelta del Tutor Corretto
         tutor = tutor_for_subject(subject)
 
-        # Difficulty 3 (Media) per esame standard
+        # Servizio giù (circuit breaker aperto): banca locale, senza attese
+        if self.gemini.circuit_open:
+            return self._fallback_question(subject, tutor)
+
+        # Difficoltà media (EXAM_STAGE) per esame standard
         cfg = PromptBuildConfig(seed_per_prompt=3, strict_json_only=True)
 
-        prompt = build_question_prompt(
-            self.project_root, subject, tutor, 3, "neutro", cfg,
-            specific_topic=specific_topic
+        # Un secondo tentativo se la risposta è inutilizzabile o la domanda è un quasi-duplicato di una già vista
+        for attempt in range(2):
+            if self.gemini.circuit_open:
+                break
+            prompt = build_question_prompt(
+                self.project_root, subject, tutor, self.EXAM_STAGE, "neutro", cfg,
+                specific_topic=specific_topic
+            )
+
+            try:
+                # Output JSON vincolato allo schema, poi randomizza le risposte e ricalcola la lettera corretta
+                data = self.gemini.generate_json(prompt, question_json_schema(), call_type="question",
+                                                 profile="question_json", call_site=call_site)
+                q = question_from_payload(data, tutor, subject, self._question_type(subject))
+            except ResponseParseError as e:
+                if e.reason == "unavailable":
+                    break
+                if not isinstance(e, StructuredOutputError):
+                    self._parse_failed(call_site, e.reason)
+                print(f"[EXAM] Errore generazione domanda ({subject}, {e.reason}, tentativo {attempt + 1}): {e}")
+                continue
+            if not self._is_used(learner_id, q, exclude):
+                return q
+            print(f"[EXAM] Domanda quasi-duplicata scartata ({subject}, tentativo {attempt + 1}).")
+            specific_topic = self._pick_specific_topic(subject)
+        return self._fallback_question(subject, tutor)
+
+    def _parse_failed(self, call_site: str, reason: str) -> None:
+        # JSON valido per lo schema ma non trasformabile in Question: conta tra le risposte inutilizzabili
+        self.gemini.telemetry.record_parse_failure(call_site, reason)
+
+    def _fallback_question(self, subject: str, tutor: str) -> Question:
+        q = self.local_bank.draw(subject, tutor, self._question_type(subject))
+        if q is not None:
+            return q
+        return Question(
+            domanda="Errore di connessione al database domande.",
+            opzioni={"A": "Errore A", "B": "Errore B", "C": "Errore C", "D": "Errore D"},
+            corretta="A",
+            spiegazione="",
+            tutor=tutor,
+            materia=subject,
+            tipo=self._question_type(subject),
         )
 
-        resp = self.gemini.generate_content(prompt)
-        clean = resp.replace("```json", "").replace("```", "").strip()
+    def _generate_batch(self, subject: str, count: int, learner_id: str = "default",
+                        exclude: Optional[NearDuplicateIndex] = None) -> List[Question]:
+        """
+        Genera `count` domande della stessa materia con una sola chiamata LLM.
+        Scarta i quasi-duplicati: già viste, già preparate (exclude) o ripetute nello stesso batch.
+        """
+        if self.gemini.circuit_open:
+            return []
+        if count <= 1:
+            return [self._generate_question(subject, learner_id, exclude, call_site="exam_pregeneration")]
 
-        try:
-            data = json.loads(clean)
-        except:
-            data = {
-                "domanda": "Errore di connessione al database domande.",
-                "opzioni": {"A": ".", "B": ".", "C": ".", "D": "."},
-                "corretta": "A",
-                "materia": subject
-            }
-
-        # --- SHUFFLING LOGIC (RANDOMIZZA RISPOSTE) ---
-        # 1. Recupera opzioni e risposta corretta originale
-        opts_dict = data.get("opzioni", {})
-        valid_opts_values = [v for k, v in opts_dict.items() if v and str(v).strip() != "."]
-
-        # Gestione errori se mancano opzioni
-        if len(valid_opts_values) < 2:
-            valid_opts_values = ["Errore A", "Errore B", "Errore C", "Errore D"]
-
-        raw_letter = str(data.get("corretta", "A")).strip().upper()
-        if len(raw_letter) > 1: raw_letter = raw_letter[0]
-        correct_text = opts_dict.get(raw_letter, "")
-
-        # 2. Mescola i testi
-        random.shuffle(valid_opts_values)
-
-        # 3. Ricostruisci il dizionario A, B, C, D
-        keys = ["A", "B", "C", "D"][:len(valid_opts_values)]
-        shuffled_opzioni = dict(zip(keys, valid_opts_values))
-
-        # 4. Ritrova la nuova lettera corretta (dove è finito il testo giusto?)
-        new_corretta = "A"
-        for k, v in shuffled_opzioni.items():
-            if v == correct_text:
-                new_corretta = k
-                break
-        # ---------------------------------------------
+        tutor = tutor_for_subject(subject)
+        cfg = PromptBuildConfig(seed_per_prompt=3, strict_json_only=True)
 
-        spieg = data.get("spiegazione_breve") or data.get("spiegazione", "")
+        # Sotto-argomenti diversi per le domande del blocco
+        if subject in SUB_TOPICS:
+            subtopics = random.sample(SUB_TOPICS[subject], min(count, len(SUB_TOPICS[subject])))
+            specific_topic = f"{subject} (uno per domanda, a rotazione: {'; '.join(subtopics)})"
+        else:
+            specific_topic = subject
 
-        q = Question(
-            domanda=data.get("domanda", ""),
-            opzioni=shuffled_opzioni,  # Usa opzioni mescolate
-            corretta=new_corretta,  # Usa la nuova lettera corretta
-            spiegazione=spieg,
-            tutor=tutor,
-            materia=subject,
-            tipo="situazionale" if subject == "Quesiti situazionali" else "standard",
-            spiegazione_breve=spieg
+        prompt = build_question_batch_prompt(
+            self.project_root, subject, tutor, self.EXAM_STAGE, "neutro", cfg, count,
+            specific_topic=specific_topic
         )
-
-        session.questions.append(q)
-        return q
+        try:
+            data = self.gemini.generate_json(prompt, question_batch_json_schema(), call_type="question",
+                                             profile="question_batch", call_site="exam_batch")
+            questions = questions_from_payloads(data, tutor, subject, self._question_type(subject),
+                                                on_error=partial(self._parse_failed, "exam_batch"))
+        except ResponseParseError as e:
+            print(f"[EXAM] Errore generazione batch ({subject}): {e}")
+            return []
+        batch_index = NearDuplicateIndex(threshold=self.seen.threshold)
+        unique: List[Question] = []
+        for q in questions:
+            if self._is_used(learner_id, q, exclude) or batch_index.is_duplicate(q):
+                print(f"[EXAM] Domanda del batch scartata ({subject}, quasi-duplicato).")
+                continue
+            batch_index.add(q)
+            unique.append(q)
+        return unique[:count]
 
     def submit_answer(self, session: ExamSession, answer: str):
         session.answers[session.current_index] = answer
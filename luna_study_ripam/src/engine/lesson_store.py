@@ -0,0 +1,146 @@
+# src/engine/lesson_store.py
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+import zlib
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+
+@dataclass(frozen=True)
+class LessonStoreConfig:
+    path: str
+    max_variants: int = 3  # varianti tenute per chiave
+    max_bytes: int = 20 * 1024 * 1024  # 20 MB compressi
+    min_chars: int = 200  # lezioni più corte (errori, stream interrotti) non vengono salvate
+
+
+class LessonStore:
+    """
+    Archivio su disco (SQLite, testo compresso zlib) delle lezioni generate.
+
+    - Chiave = sha256(argomento, tutor, tono dello stage, versione del template del prompt):
+      cambiando il template (versione) le vecchie lezioni non vengono più servite.
+    - Per ogni chiave fino a max_variants varianti (identificate dall'hash del testo).
+    - get() serve la variante meno servita (a parità, una a caso), così le varianti ruotano.
+    - Eviction LRU quando la dimensione compressa supera max_bytes.
+    """
+
+    def __init__(self, cfg: LessonStoreConfig, rng: Optional[random.Random] = None):
+        self.cfg = cfg
+        self.rng = rng or random.Random()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        folder = os.path.dirname(os.path.abspath(cfg.path))
+        os.makedirs(folder, exist_ok=True)
+        self._db = sqlite3.connect(cfg.path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS lessons ("
+            " key TEXT NOT NULL,"
+            " variant TEXT NOT NULL,"
+            " body BLOB NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " served INTEGER NOT NULL DEFAULT 0,"
+            " created_at REAL NOT NULL,"
+            " last_access REAL NOT NULL,"
+            " PRIMARY KEY (key, variant))"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_lessons_access ON lessons(last_access)")
+        self._db.commit()
+
+    @staticmethod
+    def make_key(topic: str, tutor: str, tone: str, template_version: int) -> str:
+        raw = json.dumps([topic, tutor, tone, template_version], ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            rows = self._db.execute("SELECT variant, body, served FROM lessons WHERE key = ?", (key,)).fetchall()
+            if not rows:
+                self.misses += 1
+                return None
+            least = min(r[2] for r in rows)
+            variant, body, _ = self.rng.choice([r for r in rows if r[2] == least])
+            self._db.execute(
+                "UPDATE lessons SET served = served + 1, last_access = ? WHERE key = ? AND variant = ?",
+                (now, key, variant),
+            )
+            self._db.commit()
+            self.hits += 1
+        return zlib.decompress(body).decode("utf-8")
+
+    def put(self, key: str, text: str) -> bool:
+        """Salva una variante. Ritorna False se scartata (troppo corta, già presente o chiave piena)."""
+        text = text.strip()
+        if len(text) < self.cfg.min_chars:
+            return False
+        variant = hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+        body = zlib.compress(text.encode("utf-8"), 9)
+        now = time.time()
+        with self._lock:
+            if self._variant_count(key) >= self.cfg.max_variants:
+                return False
+            cur = self._db.execute(
+                "INSERT OR IGNORE INTO lessons (key, variant, body, size, served, created_at, last_access)"
+                " VALUES (?, ?, ?, ?, 0, ?, ?)",
+                (key, variant, body, len(body), now, now),
+            )
+            self._evict()
+            self._db.commit()
+            return cur.rowcount > 0
+
+    def variant_count(self, key: str) -> int:
+        with self._lock:
+            return self._variant_count(key)
+
+    def needs_variants(self, key: str) -> bool:
+        return self.variant_count(key) < self.cfg.max_variants
+
+    def _variant_count(self, key: str) -> int:
+        return self._db.execute("SELECT COUNT(*) FROM lessons WHERE key = ?", (key,)).fetchone()[0]
+
+    def _evict(self) -> None:
+        # Da chiamare con il lock acquisito: via le varianti usate meno di recente finché si rientra in max_bytes
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM lessons").fetchone()[0]
+        if total <= self.cfg.max_bytes:
+            return
+        rows = self._db.execute("SELECT key, variant, size FROM lessons ORDER BY last_access ASC").fetchall()
+        to_delete = []
+        for key, variant, size in rows:
+            if total <= self.cfg.max_bytes:
+                break
+            to_delete.append((key, variant))
+            total -= size
+        self._db.executemany("DELETE FROM lessons WHERE key = ? AND variant = ?", to_delete)
+        self.evictions += len(to_delete)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM lessons")
+            self._db.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            count, keys, total = self._db.execute(
+                "SELECT COUNT(*), COUNT(DISTINCT key), COALESCE(SUM(size), 0) FROM lessons"
+            ).fetchone()
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / lookups) if lookups else 0.0,
+                "evictions": self.evictions,
+                "variants": count,
+                "keys": keys,
+                "bytes": total,
+            }
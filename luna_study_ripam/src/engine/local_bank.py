@@ -0,0 +1,73 @@
+# src/engine/local_bank.py
+from __future__ import annotations
+
+import os
+import random
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from src.ai.prompt_builder import subject_to_seed_filename
+from src.ai.response_parser import ResponseParseError, question_from_payload
+from src.domain.models import Question
+from src.storage.question_bank_store import QuestionBankStore, open_bank
+
+
+class LocalQuestionBank:
+    """
+    Fallback offline: serve domande dai file data/question_banks/seed_*.jsonl
+    (con lo stesso mescolamento delle risposte delle domande generate).
+
+    Per ogni materia le righe vengono servite in ordine casuale senza ripetizioni;
+    finito il giro si rimescola.
+    """
+
+    def __init__(self, project_root: str, rng: Optional[random.Random] = None):
+        self.project_root = project_root
+        self.rng = rng or random.Random()
+        self._lock = threading.Lock()
+        # macro -> (righe della banca quando è stato creato l'ordine, indici ancora da servire)
+        self._order: Dict[str, Tuple[int, List[int]]] = {}
+
+    def _macro(self, subject: str) -> str:
+        # "Logica: Sillogismi" -> "Logica"
+        return subject.split(":")[0].strip() if ":" in subject else subject
+
+    def _store(self, macro: str) -> QuestionBankStore:
+        path = os.path.join(self.project_root, "data", "question_banks", subject_to_seed_filename(macro))
+        return open_bank(path)
+
+    def draw(self, subject: str, tutor: str, tipo: str = "standard",
+             avoid: Optional[List[str]] = None) -> Optional[Question]:
+        """
+        Estrae una domanda per `subject`. `avoid`: domande già viste
+        (formato di quiz_asked_questions: primi 100 caratteri + "...").
+        Ritorna None se la banca locale della materia è vuota.
+        """
+        macro = self._macro(subject)
+        avoid_set = set(avoid or [])
+        with self._lock:
+            store = self._store(macro)
+            total = len(store)
+            if not total:
+                return None
+
+            # Al massimo un giro completo della banca, saltando le domande da evitare.
+            # Se la banca è troppo piccola meglio una ripetizione che nessuna domanda.
+            # Si decodificano solo le righe estratte.
+            repeat: Optional[Question] = None
+            for _ in range(total):
+                size, order = self._order.get(macro, (0, []))
+                if not order or size != total:
+                    # Giro finito (o banca modificata su disco): nuovo ordine casuale
+                    order = store.shuffled(self.rng)
+                    self._order[macro] = (total, order)
+                try:
+                    row = store.row(order.pop())
+                    q = question_from_payload(row, tutor, subject, tipo, self.rng)
+                except (ResponseParseError, IndexError, ValueError):
+                    continue
+                if q.domanda[:100] + "..." in avoid_set:
+                    repeat = repeat or q
+                    continue
+                return q
+            return repeat
@@ -0,0 +1,231 @@
+# src/engine/question_pool.py
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict
+from typing import Callable, Dict, List, Optional, Tuple
+
+from src.ai.response_parser import shuffle_options
+from src.domain.models import Question
+
+
+# refill(subject, subtopic, stage, count) -> nuove domande per quel bucket
+PoolRefill = Callable[[str, str, int, int], List[Question]]
+
+# (materia, sotto-argomento, stage): reazioni e "visual" delle domande dipendono dallo stage del tutor
+BucketKey = Tuple[str, str, int]
+
+
+def split_topic(topic: str) -> Tuple[str, str]:
+    """"Logica: Sillogismi" -> ("Logica", "Sillogismi"); senza ":" il sotto-argomento è vuoto."""
+    if ":" in topic:
+        subject, subtopic = topic.split(":", 1)
+        return subject.strip(), subtopic.strip()
+    return topic.strip(), ""
+
+
+def question_id(q: Question) -> str:
+    # Identità stabile indipendente dall'ordine (mescolato) delle opzioni
+    raw = json.dumps([q.domanda.strip(), sorted(q.opzioni.values())], ensure_ascii=False)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+
+
+def _slug(text: str) -> str:
+    s = re.sub(r"[^a-z0-9]+", "_", text.lower()).strip("_")
+    return s[:60] or "generale"
+
+
+class QuestionPool:
+    """
+    Pool persistente di domande pre-generate, diviso in bucket (materia, sotto-argomento, stage).
+
+    - draw(): estrazione istantanea di una domanda mai servita a quel learner (None se il bucket è vuoto).
+    - Quando le domande ancora disponibili per il learner scendono sotto `low_water`,
+      un refill in background riporta il bucket a `target` disponibili.
+    - Stato "già servite" per learner e per bucket su disco: le estrazioni non si ripetono per lo stesso
+      utente (tenute le ultime `max_served` per bucket, mai meno di max_per_bucket: le più vecchie sono
+      già uscite da quel bucket, che conserva solo le sue ultime max_per_bucket domande).
+    - pending(): domande di un refill in corso, per non farle generare due volte (es. dal prefetch del quiz).
+
+    File: <root>/<materia>__<sottoargomento>__s<stage>.json e <root>/served/<learner>.json
+    """
+
+    def __init__(
+            self,
+            root_dir: str,
+            refill: PoolRefill,
+            low_water: int = 3,
+            target: int = 8,
+            max_per_bucket: int = 300,
+            max_workers: int = 2,
+            max_served: int = 600,
+    ):
+        self.root_dir = root_dir
+        self.refill = refill
+        self.low_water = low_water
+        self.target = max(target, low_water + 1)
+        self.max_per_bucket = max_per_bucket
+        self.max_served = max(max_served, max_per_bucket)
+        self._lock = threading.RLock()
+        self._buckets: Dict[BucketKey, List[Dict]] = {}
+        # learner -> bucket -> id già servite in ordine di estrazione
+        # (dict come insieme ordinato: si scartano le più vecchie, bucket per bucket)
+        self._served: Dict[str, Dict[str, Dict[str, None]]] = {}
+        # (bucket, learner) -> domande richieste dal refill in corso
+        self._refilling: Dict[Tuple[BucketKey, str], int] = {}
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="pool-refill")
+        os.makedirs(os.path.join(root_dir, "served"), exist_ok=True)
+
+    # -------------------------
+    # API
+    # -------------------------
+
+    def draw(self, subject: str, subtopic: str, learner_id: str = "default", stage: int = 1) -> Optional[Question]:
+        key = (subject, subtopic, stage)
+        with self._lock:
+            served = self._served_in(learner_id, key)
+            picked = None
+            for row in self._bucket(key):
+                if row["id"] not in served:
+                    picked = row
+                    break
+            if picked is not None:
+                served[picked["id"]] = None
+                if len(served) > self.max_served:
+                    for qid in list(served)[:len(served) - self.max_served]:
+                        del served[qid]
+                self._save_served(learner_id)
+
+        self.ensure_stock(subject, subtopic, learner_id, stage)
+        if picked is None:
+            return None
+
+        q = Question(**picked["question"])
+        # Nuovo mescolamento a ogni estrazione
+        try:
+            q.opzioni, q.corretta = shuffle_options(q.opzioni, q.corretta)
+        except Exception:
+            pass
+        return q
+
+    def available(self, subject: str, subtopic: str, learner_id: str = "default", stage: int = 1) -> int:
+        with self._lock:
+            served = self._served_in(learner_id, (subject, subtopic, stage))
+            return sum(1 for row in self._bucket((subject, subtopic, stage)) if row["id"] not in served)
+
+    def pending(self, subject: str, subtopic: str, learner_id: str = "default", stage: int = 1) -> int:
+        """Domande in arrivo da un refill in corso per il learner (0 se nessun refill)."""
+        with self._lock:
+            return self._refilling.get(((subject, subtopic, stage), learner_id), 0)
+
+    def ensure_stock(self, subject: str, subtopic: str, learner_id: str = "default", stage: int = 1) -> None:
+        """Avvia un refill in background se il bucket è sotto la soglia minima per il learner."""
+        key = (subject, subtopic, stage)
+        with self._lock:
+            available = self.available(subject, subtopic, learner_id, stage)
+            if available >= self.low_water:
+                return
+            missing = self.target - available
+            job = (key, learner_id)
+            if job in self._refilling:
+                return
+            self._refilling[job] = missing
+        self._executor.submit(self._refill_job, key, learner_id, missing)
+
+    def add(self, subject: str, subtopic: str, questions: List[Question], stage: int = 1) -> int:
+        """Aggiunge domande al bucket (scartando i duplicati). Ritorna quante sono state aggiunte."""
+        key = (subject, subtopic, stage)
+        added = 0
+        with self._lock:
+            bucket = self._bucket(key)
+            known = {row["id"] for row in bucket}
+            for q in questions:
+                qid = question_id(q)
+                if qid in known:
+                    continue
+                known.add(qid)
+                bucket.append({"id": qid, "question": asdict(q)})
+                added += 1
+            if len(bucket) > self.max_per_bucket:
+                del bucket[:len(bucket) - self.max_per_bucket]
+            if added:
+                self._save_bucket(key)
+        return added
+
+    # -------------------------
+    # Refill
+    # -------------------------
+
+    def _refill_job(self, key: BucketKey, learner_id: str, count: int) -> None:
+        subject, subtopic, stage = key
+        try:
+            questions = self.refill(subject, subtopic, stage, max(1, count))
+            # Le domande di errore/segnaposto non entrano nel pool
+            questions = [q for q in questions if q.opzioni and len(set(q.opzioni.values())) >= 2]
+            added = self.add(subject, subtopic, questions, stage)
+            print(f"[POOL] Refill {subject} / {subtopic or '-'} (stage {stage}): +{added}")
+        except Exception as e:
+            print(f"[POOL] Errore refill {subject} / {subtopic} (stage {stage}): {e}")
+        finally:
+            with self._lock:
+                self._refilling.pop((key, learner_id), None)
+
+    # -------------------------
+    # Persistenza
+    # -------------------------
+
+    def _bucket_name(self, key: BucketKey) -> str:
+        return f"{_slug(key[0])}__{_slug(key[1])}__s{key[2]}"
+
+    def _bucket_path(self, key: BucketKey) -> str:
+        return os.path.join(self.root_dir, f"{self._bucket_name(key)}.json")
+
+    def _served_path(self, learner_id: str) -> str:
+        return os.path.join(self.root_dir, "served", f"{_slug(learner_id)}.json")
+
+    def _bucket(self, key: BucketKey) -> List[Dict]:
+        if key not in self._buckets:
+            self._buckets[key] = _read_json(self._bucket_path(key), [])
+        return self._buckets[key]
+
+    def _served_for(self, learner_id: str) -> Dict[str, Dict[str, None]]:
+        if learner_id not in self._served:
+            data = _read_json(self._served_path(learner_id), {})
+            if not isinstance(data, dict):
+                data = {}
+            self._served[learner_id] = {name: dict.fromkeys(ids) for name, ids in data.items()}
+        return self._served[learner_id]
+
+    def _served_in(self, learner_id: str, key: BucketKey) -> Dict[str, None]:
+        return self._served_for(learner_id).setdefault(self._bucket_name(key), {})
+
+    def _save_bucket(self, key: BucketKey) -> None:
+        _write_json(self._bucket_path(key), self._buckets[key])
+
+    def _save_served(self, learner_id: str) -> None:
+        served = self._served[learner_id]
+        _write_json(self._served_path(learner_id), {name: list(ids) for name, ids in served.items() if ids})
+
+
+def _read_json(path: str, default):
+    if not os.path.exists(path):
+        return default
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"[POOL] File illeggibile {path}: {e}")
+        return default
+
+
+def _write_json(path: str, data) -> None:
+    # Scrittura atomica: file temporaneo + rename
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp, path)
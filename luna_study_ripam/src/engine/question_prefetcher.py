@@ -0,0 +1,135 @@
+# src/engine/question_prefetcher.py
+from __future__ import annotations
+
+import threading
+from collections import deque
+from typing import Callable, Deque, List, Optional
+
+from src.domain.models import Question
+
+
+# generate(extra_avoid, count) -> List[Question]
+# extra_avoid: domande già in buffer (formato di state.quiz_asked_questions)
+# count: quante domande servono (il generatore può restituirne meno)
+QuestionGenerator = Callable[[List[str], int], List[Question]]
+
+
+def avoid_entry(question: Question) -> str:
+    """Stesso formato usato da SessionEngine.apply_answer per quiz_asked_questions."""
+    return question.domanda[:100] + "..."
+
+
+class QuestionPrefetcher:
+    """
+    Buffer limitato di domande pronte per l'argomento corrente.
+
+    - start(): invalida il buffer e avvia la generazione in background per un nuovo topic.
+    - take(): restituisce subito una domanda pronta (o attende quella in generazione).
+    - Le domande già in buffer vengono passate come "avoid" alle generazioni successive.
+    - batch_size > 1: ogni refill chiede più domande con una sola chiamata.
+    """
+
+    def __init__(self, depth: int = 2, batch_size: int = 1):
+        self.depth = max(1, depth)
+        self.batch_size = max(1, batch_size)
+        self._cond = threading.Condition()
+        self._buffer: Deque[Question] = deque()
+        self._topic: Optional[str] = None
+        self._generator: Optional[QuestionGenerator] = None
+        self._remaining = 0  # domande ancora da produrre per questo topic
+        self._generation = 0  # incrementato a ogni invalidazione
+        self._in_flight = False
+
+    def start(self, topic: str, generator: QuestionGenerator, budget: int) -> None:
+        with self._cond:
+            self._generation += 1
+            self._buffer.clear()
+            self._topic = topic
+            self._generator = generator
+            self._remaining = max(0, budget)
+            self._in_flight = False
+            self._cond.notify_all()
+        self._ensure_worker()
+
+    def invalidate(self) -> None:
+        with self._cond:
+            self._generation += 1
+            self._buffer.clear()
+            self._topic = None
+            self._generator = None
+            self._remaining = 0
+            self._in_flight = False
+            self._cond.notify_all()
+
+    def take(self, topic: str, timeout: Optional[float] = None) -> Optional[Question]:
+        """
+        Ritorna una domanda pronta per `topic`.
+        Se il buffer è vuoto ma una generazione è in corso, la attende.
+        Ritorna None se il topic non corrisponde o non c'è nulla in arrivo.
+        """
+        with self._cond:
+            if topic != self._topic:
+                return None
+            ok = self._cond.wait_for(
+                lambda: self._buffer or not self._in_flight or topic != self._topic,
+                timeout=timeout,
+            )
+            if not ok or topic != self._topic or not self._buffer:
+                return None
+            q = self._buffer.popleft()
+        self._ensure_worker()
+        return q
+
+    def pending_count(self) -> int:
+        with self._cond:
+            return len(self._buffer)
+
+    # -------------------------
+    # Worker
+    # -------------------------
+
+    def _ensure_worker(self) -> None:
+        with self._cond:
+            if self._in_flight or not self._needs_more():
+                return
+            self._in_flight = True
+            generation = self._generation
+        threading.Thread(target=self._worker, args=(generation,), daemon=True).start()
+
+    def _needs_more(self) -> bool:
+        return (
+            self._generator is not None
+            and self._remaining > 0
+            and len(self._buffer) < self.depth
+        )
+
+    def _worker(self, generation: int) -> None:
+        while True:
+            with self._cond:
+                if generation != self._generation or not self._needs_more():
+                    if generation == self._generation:
+                        self._in_flight = False
+                        self._cond.notify_all()
+                    return
+                generator = self._generator
+                extra_avoid = [avoid_entry(q) for q in self._buffer]
+                count = min(self._remaining, max(self.batch_size, self.depth - len(self._buffer)))
+
+            try:
+                questions = generator(extra_avoid, count)
+            except Exception as e:
+                print(f"[PREFETCH] Errore generazione in background: {e}")
+                questions = []
+
+            with self._cond:
+                if generation != self._generation:
+                    # Topic cambiato nel frattempo: risultato scartato
+                    return
+                if not questions:
+                    self._in_flight = False
+                    self._cond.notify_all()
+                    return
+                for q in questions[:self._remaining]:
+                    self._buffer.append(q)
+                self._remaining -= min(len(questions), self._remaining)
+                self._cond.notify_all()
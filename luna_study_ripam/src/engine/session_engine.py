@@ -3,29 +3,98 @@ import json
 import os
 import random
 import re
-from typing import Optional, Tuple
+from typing import Callable, List, Optional, Tuple
+import threading
 import uuid
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from functools import partial
 
 from src.domain.models import SessionState, Question, HistoryItem, LessonRecord
-from src.ai.gemini_client import GeminiClient
-from src.ai.prompt_builder import build_question_prompt, PromptBuildConfig
+from src.ai.gemini_client import GeminiClient, StreamStatus
+from src.ai.prompt_assets import ASSETS
+from src.ai.rate_limit import estimate_tokens
+from src.ai.prompt_builder import build_question_prompt, build_question_batch_prompt, PromptBuildConfig
+from src.ai.json_schema import question_batch_json_schema, question_json_schema
+from src.ai.response_parser import (
+    ResponseParseError, StructuredOutputError, question_from_payload, questions_from_payloads,
+)
 from src.visuals.prompt_compiler import compile_sd_prompt
+from src.visuals.image_jobs import ImageJob, ImageJobQueue
 from src.visuals.sd_client import SDClient
 from src.visuals.stage_manager import StageManager
 from src.engine.subject_picker import SubjectPicker
+from src.engine.question_prefetcher import QuestionPrefetcher
+from src.engine.local_bank import LocalQuestionBank
+from src.engine.question_pool import QuestionPool, split_topic
+from src.engine.chat_memory import ChatMemory, ChatMemoryConfig, clip_tokens
+from src.engine.dedup_index import NearDuplicateIndex, SeenQuestions
+from src.engine.lesson_store import LessonStore, LessonStoreConfig
+from src.engine.tutor_phrases import TutorPhraseBank
 from src.engine.tutor_router import tutor_for_subject
 from src.domain.syllabus import get_random_topic
 
 
 class SessionEngine:
-    def __init__(self, project_root: str, gemini: GeminiClient, sd_client: SDClient, enable_sd: bool = True):
+    QUIZ_LENGTH = 10
+    # Da incrementare quando cambia il prompt della lezione: invalida le lezioni salvate
+    LESSON_TEMPLATE_VERSION = 1
+    # Attesa massima dell'immagine della lezione quando testo e immagine vengono restituiti insieme
+    LESSON_IMAGE_TIMEOUT_SEC = 760
+    FEEDBACK_MODES = ("instant", "enrich", "llm")
+    # Tipo della domanda segnaposto servita quando LLM e banca locale falliscono
+    PLACEHOLDER_TIPO = "errore"
+
+    def __init__(self, project_root: str, gemini: GeminiClient, sd_client: SDClient, enable_sd: bool = True,
+                 prefetch_depth: int = 0, prefetch_batch: int = 1, pool_dir: Optional[str] = None,
+                 seen_dir: Optional[str] = None, lesson_store_path: Optional[str] = None,
+                 lesson_variants: int = 3, feedback_mode: str = "instant",
+                 chat_memory: Optional[ChatMemoryConfig] = None):
         self.project_root = project_root
         self.gemini = gemini
         self.sd_client = sd_client
         self.enable_sd = enable_sd
         self.stage_manager = StageManager(step=5, min_stage=1, max_stage=5)
         self.subject_picker = SubjectPicker()
+        self.local_bank = LocalQuestionBank(project_root)
+        # Tutti i file di prompts/ in memoria una volta sola (poi solo controlli di mtime)
+        ASSETS.preload(os.path.join(project_root, "prompts"))
         self.last_image_path: Optional[str] = None
+        # Domande già viste per learner (MinHash/LSH): i quasi-duplicati vengono scartati e rigenerati
+        self.seen = SeenQuestions(seen_dir)
+
+        # Prefetch opzionale: 0 = disattivato (generazione sincrona come prima)
+        self.prefetcher: Optional[QuestionPrefetcher] = None
+        if prefetch_depth > 0:
+            self.prefetcher = QuestionPrefetcher(depth=prefetch_depth, batch_size=prefetch_batch)
+
+        # Pool persistente opzionale di domande pre-generate per (materia, sotto-argomento)
+        self.question_pool: Optional[QuestionPool] = None
+        if pool_dir:
+            self.question_pool = QuestionPool(pool_dir, refill=self._refill_pool)
+
+        # Archivio lezioni opzionale: variante salvata servita subito, nuove varianti generate in background
+        self.lesson_store: Optional[LessonStore] = None
+        if lesson_store_path:
+            self.lesson_store = LessonStore(LessonStoreConfig(path=lesson_store_path, max_variants=lesson_variants))
+        self._lesson_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="lesson-variants")
+        self._lesson_jobs: set = set()
+        self._lesson_jobs_lock = threading.Lock()
+        # Immagini SD in una coda dedicata: lezione e quiz non aspettano mai Stable Diffusion
+        self.image_jobs = ImageJobQueue()
+
+        # Feedback e pagella: "instant" = frasi locali (nessuna rete), "enrich" = frasi locali subito
+        # e testo LLM in background quando arriva, "llm" = chiamata LLM sincrona (comportamento storico)
+        if feedback_mode not in self.FEEDBACK_MODES:
+            raise ValueError(f"feedback_mode non valido: {feedback_mode}")
+        self.feedback_mode = feedback_mode
+        self.phrases = TutorPhraseBank(project_root)
+        self._enrich_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="enrich")
+        self._enrich_lock = threading.Lock()
+        self._enrich_busy = False
+
+        # Memoria della chat col tutor (per lezione): turni recenti + riassunto, prompt a dimensione costante
+        self.chat_memory = ChatMemory(chat_memory, summarize=self._summarize_for_chat)
+        self._chat_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="chat-memory")
 
     def _get_stage_mood(self, stage: int) -> str:
         moods = {
@@ -39,6 +108,70 @@ class SessionEngine:
 
     # --- FASE 1: LEZIONE ---
     def start_new_lesson_block(self, state: SessionState) -> Tuple[str, str]:
+        block = self._prepare_lesson_block(state)
+        if isinstance(block, str):
+            return block, ""
+        subject, tutor, base_stage, prompt = block
+
+        # Testo e immagine partono insieme: latenza = max(testo, immagine) invece della somma
+        image_job = self._start_lesson_image(subject, tutor, base_stage)
+        key = self._lesson_key(subject, tutor, base_stage)
+        response = self._cached_lesson(key, prompt)
+        if response is None:
+            response = self.gemini.generate_content(prompt, use_cache=self.lesson_store is None, call_type="lesson",
+                                                    profile="lesson", call_site="lesson")
+            self._store_lesson(key, response)
+        self._remember_lesson(response)
+        return response, self._wait_lesson_image(image_job)
+
+    def stream_new_lesson_block(self, state: SessionState, on_chunk: Callable[[str], None],
+                                on_image: Optional[Callable[[str], None]] = None) -> Tuple[str, str]:
+        """
+        Come start_new_lesson_block, ma il testo della lezione arriva a pezzi:
+        on_chunk(testo) viene chiamata (dal thread chiamante) per ogni chunk appena ricevuto.
+        Ritorna (testo_completo, percorso_immagine).
+
+        on_image: se passata, si ritorna appena il testo è completo e on_image(percorso) viene chiamata
+        (dal thread dell'immagine) quando l'immagine è pronta; in quel caso il percorso ritornato è "".
+        """
+        block = self._prepare_lesson_block(state)
+        if isinstance(block, str):
+            on_chunk(block)
+            return block, ""
+        subject, tutor, base_stage, prompt = block
+
+        image_job = self._start_lesson_image(subject, tutor, base_stage)
+        if on_image is not None:
+            image_job.add_done_callback(on_image)
+
+        key = self._lesson_key(subject, tutor, base_stage)
+        response = self._cached_lesson(key, prompt)
+        if response is not None:
+            on_chunk(response)
+        else:
+            parts: List[str] = []
+            status = StreamStatus()
+            for chunk in self.gemini.stream_content(prompt, use_cache=self.lesson_store is None, call_type="lesson",
+                                                   profile="lesson", status=status, call_site="lesson"):
+                parts.append(chunk)
+                on_chunk(chunk)
+            response = "".join(parts)
+            # Una lezione interrotta o tagliata dal tetto di token si mostra, ma non si conserva
+            if status.clean:
+                self._store_lesson(key, response)
+            else:
+                print(f"[ENGINE] Lezione incompleta ({status.outcome}): non salvata.")
+        self._remember_lesson(response)
+
+        if on_image is not None:
+            return response, ""
+        return response, self._wait_lesson_image(image_job)
+
+    def _prepare_lesson_block(self, state: SessionState):
+        """
+        Sceglie la materia, resetta lo stato del quiz e costruisce il prompt della lezione.
+        Ritorna (subject, tutor, base_stage, prompt) oppure il messaggio finale se il programma è completato.
+        """
         # 1. Identifica le materie già superate con voto >= 8
         passed_topics = [l.topic for l in state.completed_lessons if l.score >= 8]
 
@@ -50,12 +183,13 @@ class SessionEngine:
 
         # 4. Gestione "Gioco Finito" (se subject è None)
         if subject is None:
+            if self.prefetcher: self.prefetcher.invalidate()
             msg = (
                 "COMPLIMENTI! 🏆\n"
                 "Hai completato tutte le materie del programma con voto superiore all'8.\n"
                 "Sei pronto per il concorso!"
             )
-            return msg, ""
+            return msg
 
         # FIX: Se il subject è composto (es. "Diritto: Accesso atti"), estraiamo la macro-categoria per trovare il tutor corretto
         if ":" in subject:
@@ -73,6 +207,12 @@ class SessionEngine:
         state.quiz_score = 0
         state.quiz_results = []
         state.quiz_asked_questions = []
+        self.chat_memory.reset(subject)
+
+        # Le domande del quiz si preparano mentre la lezione viene generata/letta
+        if self.question_pool:
+            self.question_pool.ensure_stock(*split_topic(subject), learner_id=state.learner_id, stage=base_stage)
+        self.start_prefetch(state)
 
         mood = self._get_stage_mood(base_stage)
         prompt = f"""
@@ -89,8 +229,72 @@ Fai una lezione discorsiva e coinvolgente su questo argomento (Stile Chat/Podcas
 
 Lingua: Italiano.
 """
-        response = self.gemini.generate_content(prompt)
+        return subject, tutor, base_stage, prompt
+
+    def _lesson_key(self, subject: str, tutor: str, base_stage: int) -> str:
+        return LessonStore.make_key(subject, tutor, self._get_stage_mood(base_stage), self.LESSON_TEMPLATE_VERSION)
+
+    def _cached_lesson(self, key: str, prompt: str) -> Optional[str]:
+        """Variante salvata della lezione (None se non c'è); se le varianti sono poche ne genera un'altra in background."""
+        if not self.lesson_store:
+            return None
+        text = self.lesson_store.get(key)
+        if text is not None:
+            print("[ENGINE] Lezione servita dall'archivio.")
+            if self.lesson_store.needs_variants(key):
+                self._schedule_lesson_variant(key, prompt)
+        return text
+
+    def _remember_lesson(self, text: str) -> None:
+        # La chat col tutor parte dalla lezione appena mostrata (riassunto LLM in background se è lunga)
+        if text.strip() == "{}":
+            return
+        self.chat_memory.set_lesson(text)
+        if self.chat_memory.lesson_needs_summary():
+            self._chat_executor.submit(self.chat_memory.summarize_lesson)
+
+    def _store_lesson(self, key: str, text: str) -> None:
+        # generate_content ritorna "{}" sia per gli errori sia per le risposte troncate ("truncated"):
+        # qui arrivano solo lezioni complete (per lo stream lo garantisce il chiamante con status.clean)
+        if self.lesson_store and text.strip() != "{}":
+            self.lesson_store.put(key, text)
+
+    def _schedule_lesson_variant(self, key: str, prompt: str) -> None:
+        with self._lesson_jobs_lock:
+            if key in self._lesson_jobs:
+                return
+            self._lesson_jobs.add(key)
+
+        def job() -> None:
+            try:
+                if self.gemini.circuit_open:
+                    return
+                text = self.gemini.generate_content(prompt, use_cache=False, call_type="lesson", profile="lesson",
+                                                    call_site="lesson_variant")
+                self._store_lesson(key, text)
+            except Exception as e:
+                print(f"[ENGINE] Errore variante lezione: {e}")
+            finally:
+                with self._lesson_jobs_lock:
+                    self._lesson_jobs.discard(key)
+
+        self._lesson_executor.submit(job)
 
+    def _start_lesson_image(self, subject: str, tutor: str, base_stage: int) -> ImageJob:
+        return self.image_jobs.submit("lesson", lambda: self._generate_lesson_image(subject, tutor, base_stage))
+
+    def _wait_lesson_image(self, image_job: ImageJob) -> str:
+        try:
+            return image_job.result(timeout=self.LESSON_IMAGE_TIMEOUT_SEC)
+        except FutureTimeout:
+            print("[ENGINE] Timeout immagine lezione: si prosegue senza.")
+        return ""
+
+    def cancel_pending_images(self, group: Optional[str] = None) -> int:
+        """Annulla le immagini non più utili (es. group="quiz" quando si passa alla domanda successiva)."""
+        return self.image_jobs.cancel(group)
+
+    def _generate_lesson_image(self, subject: str, tutor: str, base_stage: int) -> str:
         image_path = ""
         if self.enable_sd:
             try:
@@ -105,29 +309,96 @@ Lingua: Italiano.
                 filename = f"lesson_{uuid.uuid4().hex[:6]}.png"
                 out = os.path.join(self.project_root, "output_images", filename)
                 os.makedirs(os.path.dirname(out), exist_ok=True)
-                self.sd_client.generate_image(sd_prompt.prompt, sd_prompt.negative_prompt, out)
+                if not self.sd_client.generate_image(sd_prompt.prompt, sd_prompt.negative_prompt, out):
+                    return ""
                 image_path = out
                 self.last_image_path = out
             except Exception as e:
                 print(f"Errore generazione immagine lezione: {e}")
-
-        return response, image_path
+        return image_path
 
     # --- FASE 2: QUIZ ---
+    def start_prefetch(self, state: SessionState) -> None:
+        """Avvia (o riavvia) la generazione in background delle prossime domande del topic corrente."""
+        if not self.prefetcher or not state.current_topic:
+            return
+        subject = state.current_topic
+        tutor = state.current_tutor
+        base_stage = state.stage.get(tutor, 1)
+
+        def generate(extra_avoid: List[str], count: int) -> List[Question]:
+            # quiz_asked_questions viene letto al momento della generazione (si aggiorna con le risposte)
+            asked = list(state.quiz_asked_questions) + extra_avoid
+            return self._generate_quiz_batch(subject, tutor, base_stage, asked, count, state.learner_id)
+
+        budget = self.QUIZ_LENGTH - state.quiz_counter
+        if self.question_pool:
+            # Le domande già pronte nel pool, o in arrivo dal suo refill, non vanno rigenerate:
+            # il prefetch copre solo il resto (di solito le prime domande, mentre il refill lavora)
+            topic = split_topic(subject)
+            budget -= self.question_pool.available(*topic, learner_id=state.learner_id, stage=base_stage)
+            budget -= self.question_pool.pending(*topic, learner_id=state.learner_id, stage=base_stage)
+        if budget <= 0:
+            self.prefetcher.invalidate()
+            return
+        self.prefetcher.start(subject, generate, budget)
+
     def get_next_quiz_question(self, state: SessionState) -> Question:
+        q = self._next_unseen_question(state)
+        # Il segnaposto d'errore non entra nell'indice: farebbe scartare domande vere che gli somigliano
+        if q.tipo != self.PLACEHOLDER_TIPO:
+            self.seen.mark_seen(state.learner_id, q)
+        return q
+
+    def _next_unseen_question(self, state: SessionState) -> Question:
+        if self.question_pool:
+            subject, subtopic = split_topic(state.current_topic)
+            stage = state.stage.get(state.current_tutor, 1)
+            for _ in range(self.QUIZ_LENGTH):
+                q = self.question_pool.draw(subject, subtopic, state.learner_id, stage)
+                if q is None:
+                    break
+                if self.seen.is_duplicate(state.learner_id, q):
+                    continue
+                q.tutor = state.current_tutor
+                q.materia = state.current_topic
+                return q
+
+        if self.prefetcher:
+            while True:
+                q = self.prefetcher.take(state.current_topic)
+                if q is None:
+                    break
+                if not self.seen.is_duplicate(state.learner_id, q):
+                    return q
+                print("[ENGINE] Domanda pre-generata scartata (quasi-duplicato).")
+
         subject = state.current_topic
         tutor = state.current_tutor
         base_stage = state.stage.get(tutor, 1)
+        # Nessuna domanda pronta: l'utente aspetta questa chiamata (interactive abilita l'hedging)
+        return self._generate_quiz_question(subject, tutor, base_stage, state.quiz_asked_questions, state.learner_id,
+                                            interactive=True)
 
-        past_questions_txt = "\n- ".join(state.quiz_asked_questions[-6:])
-        avoid_instruction = ""
-        if past_questions_txt:
-            avoid_instruction = f"\n[CONSTRAINT] DO NOT ask about these concepts again: \n- {past_questions_txt}\nGenerate a question on a DIFFERENT aspect of '{subject}'."
+    def _avoid_instruction(self, subject: str, asked: List[str]) -> str:
+        past_questions_txt = "\n- ".join(asked[-6:])
+        if not past_questions_txt:
+            return ""
+        return f"\n[CONSTRAINT] DO NOT ask about these concepts again: \n- {past_questions_txt}\nGenerate a question on a DIFFERENT aspect of '{subject}'."
+
+    def _generate_quiz_question(self, subject: str, tutor: str, base_stage: int, asked: List[str],
+                                learner_id: str = "default", interactive: bool = False,
+                                call_site: str = "quiz_single") -> Question:
+        avoid_instruction = self._avoid_instruction(subject, asked)
 
         cfg = PromptBuildConfig(seed_per_prompt=3, strict_json_only=True)
         max_retries = 3
 
         for attempt in range(max_retries):
+            # Servizio giù (circuit breaker aperto): niente attese, si passa alla banca locale
+            if self.gemini.circuit_open:
+                break
+
             # Passiamo l'argomento specifico (es. "Logica: Sillogismi") nel prompt
             prompt_topic = f"{subject}. {avoid_instruction}"
             prompt_text = build_question_prompt(
@@ -135,61 +406,106 @@ Lingua: Italiano.
                 specific_topic=prompt_topic
             )
 
-            resp = self.gemini.generate_content(prompt_text)
-            clean_json = resp.replace("```json", "").replace("```", "").strip()
-
+            # I retry di rete (con backoff) sono già nel client: qui si ritenta solo se il JSON è inutilizzabile
             try:
-                data = json.loads(clean_json)
-                if not data.get("domanda") or not data.get("opzioni"): raise ValueError("Dati vuoti")
-
-                # Recupera le opzioni valide
-                valid_opts_values = [v for k, v in data["opzioni"].items() if v and str(v).strip() != "."]
-                if len(valid_opts_values) < 2: raise ValueError("Opzioni mancanti")
-
-                # --- LOGICA SHUFFLE (Mescola le risposte) ---
-                # 1. Recupera il testo della risposta corretta originale
-                raw_letter = str(data.get("corretta", "A")).strip().upper()
-                if len(raw_letter) > 1: raw_letter = raw_letter[0]
-                correct_text = data["opzioni"].get(raw_letter, "")
-
-                # 2. Mescola la lista delle risposte (testi)
-                random.shuffle(valid_opts_values)
-
-                # 3. Ricostruisci il dizionario con chiavi A, B, C, D
-                keys = ["A", "B", "C", "D"][:len(valid_opts_values)]
-                shuffled_opzioni = dict(zip(keys, valid_opts_values))
-
-                # 4. Ritrova la nuova lettera corretta
-                new_corretta = "A" # Fallback
-                for k, v in shuffled_opzioni.items():
-                    if v == correct_text:
-                        new_corretta = k
-                        break
-                # --------------------------------------------
-
-                spieg = data.get("spiegazione_breve") or data.get("spiegazione", "...")
-
-                return Question(
-                    domanda=data.get("domanda", ""),
-                    opzioni=shuffled_opzioni,  # Usa opzioni mescolate
-                    corretta=new_corretta,     # Usa la nuova lettera corretta
-                    spiegazione=spieg,
-                    tutor=tutor,
-                    materia=subject,
-                    tipo="standard",
-                    tags=data.get("tags", []),
-                    visual=data.get("visual", ""),
-                    spiegazione_breve=spieg
-                )
-            except Exception as e:
-                print(f"[ENGINE] Errore generazione quiz (Tentativo {attempt + 1}): {e}")
+                # Output JSON vincolato allo schema, poi mescola le risposte e ricalcola la lettera corretta
+                data = self.gemini.generate_json(prompt_text, question_json_schema(), call_type="question",
+                                                 profile="question_json", interactive=interactive,
+                                                 call_site=call_site)
+                q = question_from_payload(data, tutor, subject, "standard")
+            except ResponseParseError as e:
+                if e.reason == "unavailable":
+                    break
+                if not isinstance(e, StructuredOutputError):
+                    self._parse_failed(call_site, e.reason)
+                print(f"[ENGINE] Errore generazione quiz (Tentativo {attempt + 1}, {e.reason}): {e}")
                 continue
+            if self.seen.is_duplicate(learner_id, q):
+                print(f"[ENGINE] Domanda quasi-duplicata scartata (Tentativo {attempt + 1}).")
+                continue
+            return q
+
+        q = self.local_bank.draw(subject, tutor, "standard", avoid=asked)
+        if q is not None:
+            print(f"[ENGINE] Domanda servita dalla banca locale ({subject}).")
+            return q
 
         return Question(
             domanda="Errore tecnico generazione domanda. Procedi.",
             opzioni={"A": "Avanti", "B": "Avanti", "C": "Avanti", "D": "Avanti"},
-            corretta="A", spiegazione="...", tutor=tutor, materia=subject
+            corretta="A", spiegazione="...", tutor=tutor, materia=subject, tipo=self.PLACEHOLDER_TIPO
+        )
+
+    def _generate_quiz_batch(self, subject: str, tutor: str, base_stage: int, asked: List[str],
+                             count: int, learner_id: str = "default") -> List[Question]:
+        """
+        Una sola chiamata LLM per `count` domande dello stesso argomento (elementi malformati o duplicati scartati).
+        Usata dal prefetch: nella telemetria è "quiz_prefetch" (e "quiz_prefetch_single" per il ripiego singolo).
+        """
+        if count <= 1 or self.gemini.circuit_open:
+            return [self._generate_quiz_question(subject, tutor, base_stage, asked, learner_id,
+                                                 call_site="quiz_prefetch_single")]
+
+        cfg = PromptBuildConfig(seed_per_prompt=3, strict_json_only=True)
+        prompt_topic = f"{subject}. {self._avoid_instruction(subject, asked)}"
+        prompt_text = build_question_batch_prompt(
+            self.project_root, subject, tutor, base_stage, "neutro", cfg, count,
+            specific_topic=prompt_topic
         )
+        try:
+            data = self.gemini.generate_json(prompt_text, question_batch_json_schema(), call_type="question",
+                                             profile="question_batch", call_site="quiz_prefetch")
+            questions = questions_from_payloads(data, tutor, subject, "standard",
+                                                on_error=partial(self._parse_failed, "quiz_prefetch"))
+        except ResponseParseError as e:
+            print(f"[ENGINE] Errore generazione batch quiz: {e}")
+            questions = []
+        questions = self._drop_duplicates(questions, learner_id)
+
+        if not questions:
+            # Batch inutilizzabile: ripiega sulla generazione singola
+            return [self._generate_quiz_question(subject, tutor, base_stage, asked, learner_id,
+                                                 call_site="quiz_prefetch_single")]
+        return questions[:count]
+
+    def _parse_failed(self, call_site: str, reason: str) -> None:
+        # JSON valido per lo schema ma non trasformabile in Question: conta tra le risposte inutilizzabili
+        self.gemini.telemetry.record_parse_failure(call_site, reason)
+
+    def _drop_duplicates(self, questions: List[Question], learner_id: str) -> List[Question]:
+        # Scarta le domande già viste dal learner e i quasi-duplicati interni al batch
+        batch_index = NearDuplicateIndex(threshold=self.seen.threshold)
+        unique: List[Question] = []
+        for q in questions:
+            if self.seen.is_duplicate(learner_id, q) or batch_index.is_duplicate(q):
+                print("[ENGINE] Domanda del batch scartata (quasi-duplicato).")
+                continue
+            batch_index.add(q)
+            unique.append(q)
+        return unique
+
+    def _refill_pool(self, subject: str, subtopic: str, stage: int, count: int) -> List[Question]:
+        """
+        Refill del pool: solo domande generate dall'LLM (niente banca locale né segnaposto),
+        allo stage del bucket perché reazioni e "visual" abbiano il tono giusto quando vengono servite.
+        """
+        if self.gemini.circuit_open:
+            return []
+        topic = f"{subject}: {subtopic}" if subtopic else subject
+        tutor = tutor_for_subject(subject)
+        cfg = PromptBuildConfig(seed_per_prompt=3, strict_json_only=True)
+        prompt_text = build_question_batch_prompt(
+            self.project_root, topic, tutor, stage, "neutro", cfg, count,
+            specific_topic=topic
+        )
+        try:
+            data = self.gemini.generate_json(prompt_text, question_batch_json_schema(), call_type="question",
+                                             profile="question_batch", call_site="pool_refill")
+            return questions_from_payloads(data, tutor, topic, "standard",
+                                           on_error=partial(self._parse_failed, "pool_refill"))[:count]
+        except ResponseParseError as e:
+            print(f"[ENGINE] Errore refill pool: {e}")
+            return []
 
     # --- CORE ---
     def apply_answer(self, state: SessionState, question: Question, user_choice: str):
@@ -218,25 +534,38 @@ Lingua: Italiano.
                 self.outcome = outcome
                 self.new_stage = new_stage
                 self.is_punish = (outcome == "errata")
+                # Reazione del tutor già presente nella domanda ("" se mancante: usare get_answer_feedback)
+                self.feedback = question.reazione_corretta if outcome == "corretta" else question.reazione_errata
+                # Handle dell'immagine di reazione (None se SD disattivato): il punteggio è già definitivo,
+                # l'immagine arriva dopo tramite image.add_done_callback / image.result()
+                self.image: Optional[ImageJob] = None
 
         update = UpdateResult(outcome, visual_stage)
 
         if self.enable_sd:
-            try:
-                sd_prompt = compile_sd_prompt(self.project_root, question.tutor, visual_stage, update.is_punish,
-                                              question)
-                filename = f"quiz_{uuid.uuid4().hex[:6]}.png"
-                out = os.path.join(self.project_root, "output_images", filename)
-                os.makedirs(os.path.dirname(out), exist_ok=True)
-                self.sd_client.generate_image(sd_prompt.prompt, sd_prompt.negative_prompt, out)
-                self.last_image_path = out
-            except:
-                pass
+            # Una nuova risposta rende obsoleta l'immagine della precedente, se ancora in coda
+            update.image = self.image_jobs.submit(
+                "quiz", lambda: self._generate_quiz_image(question, visual_stage, update.is_punish))
 
         return update
 
+    def _generate_quiz_image(self, question: Question, visual_stage: int, is_punish: bool) -> str:
+        sd_prompt = compile_sd_prompt(self.project_root, question.tutor, visual_stage, is_punish, question)
+        filename = f"quiz_{uuid.uuid4().hex[:6]}.png"
+        out = os.path.join(self.project_root, "output_images", filename)
+        os.makedirs(os.path.dirname(out), exist_ok=True)
+        if not self.sd_client.generate_image(sd_prompt.prompt, sd_prompt.negative_prompt, out):
+            return ""
+        self.last_image_path = out
+        return out
+
     # --- FASE 3: PAGELLA ---
-    def generate_final_report(self, state: SessionState) -> str:
+    def generate_final_report(self, state: SessionState,
+                              on_enriched: Optional[Callable[[str], None]] = None) -> str:
+        """
+        Registra la lezione conclusa e ritorna la pagella.
+        In modalità "enrich" on_enriched(testo) riceve (dal thread di background) la pagella scritta dall'LLM.
+        """
         score = state.quiz_score
         tutor = state.current_tutor
         topic = state.current_topic
@@ -262,23 +591,101 @@ Write a final evaluation (Pagella).
 - 9-10: Enthusiastic/Seductive.
 Language: Italian.
 """
-        report_text = self.gemini.generate_content(prompt)
-        return report_text + level_up_msg
+        if self.feedback_mode == "llm":
+            report_text = self.gemini.generate_content(prompt, call_type="report", profile="report", call_site="report")
+            return report_text + level_up_msg
+
+        if self.feedback_mode == "enrich" and on_enriched is not None:
+            self._enrich(lambda: self.gemini.generate_content(prompt, call_type="report", profile="report",
+                                                              call_site="report"),
+                         lambda text: on_enriched(text + level_up_msg))
+        return self.phrases.report(tutor, score, topic) + level_up_msg
 
     # --- UTILS ---
-    def get_answer_feedback(self, question: Question, outcome: str, stage: int) -> str:
+    def answer_feedback(self, question: Question, update, on_enriched: Optional[Callable[[str], None]] = None) -> str:
+        """
+        Reazione del tutor alla risposta (update = risultato di apply_answer), senza attese di rete:
+        prima la reazione già presente nella domanda, poi le frasi locali del tutor.
+        In modalità "enrich" on_enriched(testo) riceve più tardi la reazione generata dall'LLM.
+        """
+        if update.feedback:
+            return update.feedback
+        if self.feedback_mode == "llm":
+            return self.get_answer_feedback(question, update.outcome, update.new_stage)
+        if self.feedback_mode == "enrich" and on_enriched is not None:
+            self._enrich(lambda: self.get_answer_feedback(question, update.outcome, update.new_stage,
+                                                          interactive=False), on_enriched)
+        return self.phrases.feedback(question.tutor, update.new_stage, update.outcome)
+
+    def _enrich(self, produce: Callable[[], str], on_done: Callable[[str], None]) -> bool:
+        """Testo LLM in background. Offline (breaker aperto) o con un arricchimento già in corso si rinuncia."""
+        if getattr(self.gemini, "circuit_open", False):
+            return False
+        with self._enrich_lock:
+            if self._enrich_busy:
+                return False
+            self._enrich_busy = True
+
+        def job() -> None:
+            text = ""
+            try:
+                text = produce()
+            except Exception as e:
+                print(f"[ENGINE] Errore arricchimento testo: {e}")
+            finally:
+                with self._enrich_lock:
+                    self._enrich_busy = False
+            if text and text.strip() != "{}":
+                on_done(text)
+
+        self._enrich_executor.submit(job)
+        return True
+
+    def get_answer_feedback(self, question: Question, outcome: str, stage: int, interactive: bool = True) -> str:
+        """
+        Reazione generata al momento: solo fallback per domande senza reazione_corretta/reazione_errata.
+        interactive=False quando arriva in background (modalità "enrich"): niente hedging.
+        """
         path = os.path.join(self.project_root, "prompts", "tutor_profiles", f"{question.tutor.lower()}.txt")
-        try:
-            profile = open(path, "r", encoding="utf-8").read()
-        except:
-            profile = f"You are {question.tutor}."
+        profile = ASSETS.read(path) or f"You are {question.tutor}."
         mood = self._get_stage_mood(stage)
         res = "CORRECT" if outcome == "corretta" else "WRONG"
-        return self.gemini.generate_content(f"{profile}\n{mood}\nUser answered {res}. Give a short emotional reaction.")
+        prompt = f"{profile}\n{mood}\nUser answered {res}. Give a short emotional reaction."
+        return self.gemini.generate_content(prompt, call_type="reaction", profile="reaction", interactive=interactive,
+                                            call_site="reaction")
 
     def get_tutor_response(self, question, text, has_answered, stage):
+        """
+        Risposta del tutor in chat. Il prompt include lezione, riassunto e ultimi scambi (chat_memory)
+        ed è limitato a chat_memory.cfg.token_budget token, per quanto lunga sia la conversazione.
+        """
         mood = self._get_stage_mood(stage)
-        return self.gemini.generate_content(f"You are {question.tutor}. {mood}. User says: '{text}'. Reply in Italian.")
+        cfg = self.chat_memory.cfg
+        message = clip_tokens(text.strip(), cfg.message_tokens)
+        head = f"You are {question.tutor}. {mood}."
+        tail = f"User says: '{message}'. Reply in Italian, consistently with the lesson and the conversation above."
+        context = self.chat_memory.render(cfg.token_budget - estimate_tokens(head) - estimate_tokens(tail))
+        prompt = "\n\n".join(p for p in (head, context, tail) if p)
+
+        reply = self.gemini.generate_content(prompt, use_cache=False, call_type="chat", profile="chat",
+                                             interactive=True, call_site="chat")
+        if reply.strip() != "{}":
+            self.chat_memory.add_turn("user", message)
+            self.chat_memory.add_turn("tutor", reply)
+            if self.chat_memory.needs_compaction():
+                self._chat_executor.submit(self.chat_memory.compact)
+        return reply
+
+    def _summarize_for_chat(self, material: str, max_tokens: int) -> str:
+        # Offline: "" e la memoria usa il riassunto locale
+        if getattr(self.gemini, "circuit_open", False):
+            return ""
+        words = max(20, max_tokens * 3 // 4)
+        prompt = (f"Riassumi in italiano, in al massimo {words} parole, il testo seguente. "
+                  f"Conserva concetti, norme, numeri e dubbi dell'utente; niente introduzioni.\n\n{material}")
+        text = self.gemini.generate_content(prompt, use_cache=False, call_type="chat", profile="summary",
+                                            call_site="chat_summary")
+        return "" if text.strip() == "{}" else text
 
     # --- SAVE / LOAD AGGIORNATI ---
     def save_session_to_file(self, state, filepath):
@@ -286,6 +693,7 @@ Language: Italian.
             data = {
                 "progress": state.progress,
                 "stage": state.stage,
+                "learner_id": state.learner_id,
                 "history": [{"tutor": h.tutor, "outcome": h.outcome} for h in state.history],
                 "completed_lessons": [{"topic": l.topic, "tutor": l.tutor, "score": l.score} for l in
                                       state.completed_lessons]
@@ -302,6 +710,7 @@ Language: Italian.
             s = SessionState()
             s.progress = data.get("progress", {})
             s.stage = data.get("stage", {})
+            s.learner_id = data.get("learner_id", "default")
             s.history = [HistoryItem(tutor=x["tutor"], outcome=x["outcome"]) for x in data.get("history", [])]
             s.completed_lessons = [LessonRecord(topic=x["topic"], tutor=x["tutor"], score=x["score"]) for x in
                                    data.get("completed_lessons", [])]
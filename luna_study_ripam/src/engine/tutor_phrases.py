@@ -0,0 +1,141 @@
+# src/engine/tutor_phrases.py
+from __future__ import annotations
+
+import json
+import os
+import random
+from typing import Any, Dict, List, Optional
+
+from src.ai.prompt_assets import ASSETS
+
+# Ordine di composizione delle frasi: da ogni slot presente si estrae un frammento a caso
+SLOTS = ("apertura", "corpo", "chiusura")
+
+# Fasce di punteggio della pagella (stesse soglie del prompt LLM)
+SCORE_BANDS = (("bassa", 0), ("media", 6), ("alta", 9))
+
+# Frasi generiche: usate quando il tutor non ha un file di frasi o manca una combinazione
+_DEFAULT_PHRASES: Dict[str, Any] = {
+    "feedback": {
+        "corretta": {
+            "1": {
+                "apertura": ["Corretto.", "Esatto.", "Risposta giusta."],
+                "corpo": ["Procediamo.", "Continua così.", "Ragionamento corretto."],
+            },
+        },
+        "errata": {
+            "1": {
+                "apertura": ["Sbagliato.", "No.", "Risposta errata."],
+                "corpo": ["Rileggi la spiegazione.", "Attenzione ai dettagli.", "Ripassa questo punto."],
+            },
+        },
+    },
+    "report": {
+        "bassa": {
+            "apertura": ["{score}/10 su \"{topic}\": non ci siamo."],
+            "corpo": ["Le basi vanno riprese da capo.", "Serve più studio prima di andare avanti."],
+        },
+        "media": {
+            "apertura": ["{score}/10 su \"{topic}\": risultato discreto."],
+            "corpo": ["La strada è giusta, ma ci sono ancora lacune.", "Ripassa gli errori e riprova."],
+        },
+        "alta": {
+            "apertura": ["{score}/10 su \"{topic}\": ottimo lavoro."],
+            "corpo": ["Preparazione solida.", "Argomento padroneggiato."],
+        },
+    },
+}
+
+
+class _SafeDict(dict):
+    def __missing__(self, key):
+        return "{" + key + "}"
+
+
+def score_band(score: int) -> str:
+    band = SCORE_BANDS[0][0]
+    for name, minimum in SCORE_BANDS:
+        if score >= minimum:
+            band = name
+    return band
+
+
+class TutorPhraseBank:
+    """
+    Frasi del tutor composte in locale, senza rete (feedback dopo la risposta, pagella).
+
+    Le frasi stanno in prompts/tutor_profiles/<tutor>_phrases.json:
+      feedback -> esito ("corretta"/"errata") -> stage ("1".."5") -> slot -> [frammenti]
+      report   -> fascia ("bassa"/"media"/"alta") -> slot -> [frammenti]
+    Per lo stage si usa il più alto definito <= stage richiesto (gli stage mancanti ereditano dal precedente).
+    Il testo è la concatenazione di un frammento a caso per slot (apertura, corpo, chiusura);
+    i frammenti possono usare {tutor}, {score}, {topic}.
+    """
+
+    def __init__(self, project_root: str, rng: Optional[random.Random] = None):
+        self.folder = os.path.join(project_root, "prompts", "tutor_profiles")
+        self.rng = rng or random.Random()
+        self._parsed: Dict[str, Any] = {}  # path -> (testo, dati): si riparsa solo se il file cambia
+
+    def feedback(self, tutor: str, stage: int, outcome: str) -> str:
+        outcome = "corretta" if outcome == "corretta" else "errata"
+        by_stage = self._section(tutor, "feedback").get(outcome) or {}
+        return self._compose(_pick_stage(by_stage, stage), tutor=tutor) or \
+            self._compose(_pick_stage(_DEFAULT_PHRASES["feedback"][outcome], stage), tutor=tutor)
+
+    def report(self, tutor: str, score: int, topic: str) -> str:
+        band = score_band(score)
+        values = {"tutor": tutor, "score": score, "topic": topic}
+        return self._compose(self._section(tutor, "report").get(band) or {}, **values) or \
+            self._compose(_DEFAULT_PHRASES["report"][band], **values)
+
+    def _section(self, tutor: str, name: str) -> Dict[str, Any]:
+        data = self._load(tutor)
+        section = data.get(name)
+        return section if isinstance(section, dict) else {}
+
+    def _load(self, tutor: str) -> Dict[str, Any]:
+        path = os.path.join(self.folder, f"{tutor.lower()}_phrases.json")
+        text = ASSETS.read(path, strip_bom=True)
+        if not text:
+            return {}
+        cached = self._parsed.get(path)
+        if cached is not None and cached[0] == text:
+            return cached[1]
+        try:
+            data = json.loads(text)
+        except Exception as e:
+            print(f"[PHRASES] {os.path.basename(path)} non valido: {e}")
+            data = {}
+        if not isinstance(data, dict):
+            data = {}
+        self._parsed[path] = (text, data)
+        return data
+
+    def _compose(self, slots: Dict[str, List[str]], **values) -> str:
+        parts = []
+        for slot in SLOTS:
+            options = slots.get(slot) if isinstance(slots, dict) else None
+            options = [o for o in options or [] if isinstance(o, str)]
+            if not options:
+                continue
+            # Un frammento "" rende lo slot facoltativo (es. chiusura solo a volte)
+            fragment = self.rng.choice(options).strip()
+            if not fragment:
+                continue
+            # File modificabili a mano: una graffa spaiata o un "{0}" non deve rompere feedback e pagella
+            try:
+                parts.append(fragment.format_map(_SafeDict(values)))
+            except (ValueError, IndexError, KeyError, AttributeError, TypeError) as e:
+                print(f"[PHRASES] Frammento non valido, slot \"{slot}\" saltato: {fragment!r} ({e})")
+        return " ".join(parts)
+
+
+def _pick_stage(by_stage: Dict[str, Any], stage: int) -> Dict[str, List[str]]:
+    if not isinstance(by_stage, dict):
+        return {}
+    stages = sorted(int(k) for k in by_stage if str(k).isdigit())
+    if not stages:
+        return {}
+    eligible = [s for s in stages if s <= stage]
+    return by_stage[str(eligible[-1] if eligible else stages[0])]
@@ -1,5 +1,6 @@
 # src/gui_main.py
 import os
+import queue
 import threading
 import time
 from pathlib import Path
@@ -13,11 +14,12 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 import customtkinter as ctk
 from PIL import Image, ImageTk
 from src.ai.gemini_client import GeminiClient, GeminiConfig
+from src.ai.llm_backends import RecordingBackend, ReplayBackend
 from src.domain.models import SessionState, Question
 from src.engine.session_engine import SessionEngine
 from src.engine.exam_engine import ExamEngine, ExamSession
 from src.visuals.sd_client import SDClient, SDConfig
-from src.voice_narrator import init_narrator, speak, stop, shutdown_narrator
+from src.voice_narrator import init_narrator, speak, speak_stream, stop, shutdown_narrator
 # Importiamo i pesi per sapere il totale delle materie (16)
 from src.engine.subject_picker import DEFAULT_WEIGHTS
 
@@ -74,6 +76,9 @@ class ImagePopup(ctk.CTkToplevel):
 
 
 class LunaGuiApp(ctk.CTk):
+    # Ogni quanto il testo in streaming viene scritto nel box (ms)
+    STREAM_FLUSH_MS = 120
+
     def __init__(self):
         super().__init__()
         init_narrator()
@@ -87,6 +92,17 @@ class LunaGuiApp(ctk.CTk):
         self.can_answer = False
         self.step = "start"
 
+        # Streaming lezione
+        self._lesson_stream_id = 0
+        self._lesson_chunks = queue.Queue()
+        self._lesson_stream_started = False
+        self._lesson_narration = None
+
+        # Pagella: id della generazione corrente e testo arricchito arrivato prima di quello locale
+        self._report_id = 0
+        self._report_shown = False
+        self._report_enriched: Optional[str] = None
+
         self.exam_session = None
         self.is_exam_mode = False
         self.exam_timer_id = None
@@ -180,10 +196,29 @@ class LunaGuiApp(ctk.CTk):
 
     def _init_engine(self):
         api_key = os.environ.get("GEMINI_API_KEY", "").strip()
-        gemini = GeminiClient(GeminiConfig(api_key=api_key if api_key else "dummy"))
+        # Cache risposte su disco (opzionale): GEMINI_CACHE_PATH=data/cache/gemini.sqlite3
+        cache_path = os.environ.get("GEMINI_CACHE_PATH", "").strip() or None
+        # Benchmark offline: GEMINI_REPLAY_PATH serve le risposte da una cassetta, GEMINI_RECORD_PATH la registra
+        replay_path = os.environ.get("GEMINI_REPLAY_PATH", "").strip()
+        backend = ReplayBackend(replay_path) if replay_path else None
+        # Telemetria chiamate LLM su disco (opzionale): GEMINI_TELEMETRY_PATH=data/cache/llm_telemetry.json
+        # (oppure .prom per il formato Prometheus)
+        telemetry_path = os.environ.get("GEMINI_TELEMETRY_PATH", "").strip() or None
+        # L'hedging vale solo per le chiamate che il motore marca interactive (domanda in primo piano, chat, reazione)
+        gemini = GeminiClient(GeminiConfig(api_key=api_key if api_key else "dummy", cache_path=cache_path,
+                                           telemetry_path=telemetry_path), backend)
+        record_path = os.environ.get("GEMINI_RECORD_PATH", "").strip()
+        if record_path and gemini.backend:
+            gemini.backend = RecordingBackend(gemini.backend, record_path)
         sd = SDClient(SDConfig.from_env())
-        self.engine = SessionEngine(self.project_root, gemini, sd, True)
-        self.exam_engine = ExamEngine(self.project_root, gemini)
+        pool_dir = os.path.join(self.project_root, "data", "question_pool")
+        seen_dir = os.path.join(self.project_root, "data", "progress", "seen_questions")
+        self.engine = SessionEngine(self.project_root, gemini, sd, True, prefetch_depth=2, prefetch_batch=3,
+                                    pool_dir=pool_dir, seen_dir=seen_dir,
+                                    lesson_store_path=os.path.join(self.project_root, "data", "cache", "lessons.sqlite"),
+                                    feedback_mode="enrich")
+        self.exam_engine = ExamEngine(self.project_root, gemini, question_pool=self.engine.question_pool,
+                                      seen=self.engine.seen)
 
     def _setup_ui(self):
         # 1. HEADER
@@ -348,25 +383,86 @@ class LunaGuiApp(ctk.CTk):
         self.step = "lesson"
         self._clear_options()  # Nasconde la barra
         self.set_ui_loading("Generazione Lezione & Immagine...")
-        threading.Thread(target=self._gen_lesson_thread, daemon=True).start()
 
-    def _gen_lesson_thread(self):
-        text, img_path = self.engine.start_new_lesson_block(self.session_state)
-        self.after(0, lambda: self._show_lesson(text, img_path))
+        # Streaming: i chunk arrivano dal thread di generazione e vengono scritti a blocchi dal main loop
+        self._lesson_stream_id += 1
+        self._lesson_chunks = queue.Queue()
+        self._lesson_stream_started = False
+        self._lesson_narration = None
+        stream_id = self._lesson_stream_id
+        threading.Thread(target=self._gen_lesson_thread, args=(stream_id, self._lesson_chunks), daemon=True).start()
+        self.after(self.STREAM_FLUSH_MS, lambda: self._poll_lesson_stream(stream_id))
+
+    def _gen_lesson_thread(self, stream_id, chunks):
+        # Il testo viene mostrato appena pronto; l'immagine (generata in parallelo) arriva dopo
+        def on_image(img_path):
+            self.after(0, lambda: self._show_lesson_image(img_path, stream_id))
+
+        text, img_path = self.engine.stream_new_lesson_block(self.session_state, chunks.put, on_image=on_image)
+        self.after(0, lambda: self._show_lesson(text, img_path, stream_id))
+
+    def _show_lesson_image(self, img_path, stream_id):
+        # Ignora immagini di lezioni vecchie o arrivate quando si è già passati al quiz
+        if stream_id != self._lesson_stream_id or self.step != "lesson":
+            return
+        self._load_image(img_path)
+
+    def _poll_lesson_stream(self, stream_id):
+        if stream_id != self._lesson_stream_id or self.step != "lesson":
+            return
+        self._flush_lesson_chunks()
+        self.after(self.STREAM_FLUSH_MS, lambda: self._poll_lesson_stream(stream_id))
+
+    def _flush_lesson_chunks(self):
+        """Scrive in un colpo solo tutto il testo arrivato dall'ultimo flush (Tk resta reattivo)."""
+        parts = []
+        while True:
+            try:
+                parts.append(self._lesson_chunks.get_nowait())
+            except queue.Empty:
+                break
+        if not parts:
+            return
+        text = "".join(parts)
+
+        if not self._lesson_stream_started:
+            self._lesson_stream_started = True
+            tutor = self.session_state.current_tutor
+            topic = self.session_state.current_topic
+            self.loading_label.configure(text="Lezione in arrivo...")
+            self.lbl_tutor_info.configure(text=f"DOCENTE: {tutor} | ARGOMENTO: {topic}")
+            self.set_text("🎓 LEZIONE MAGISTRALE\n\n")
+            # La voce parte con le prime frasi complete, mentre il resto è ancora in generazione
+            self._lesson_narration = speak_stream(tutor=tutor)
+            self._lesson_narration.feed(f"Lezione su {topic}. ")
 
-    def _show_lesson(self, text, img_path):
+        self.question_text.configure(state="normal")
+        self.question_text.insert("end", text)
+        self.question_text.configure(state="disabled")
+        if self._lesson_narration:
+            self._lesson_narration.feed(text)
+
+    def _show_lesson(self, text, img_path, stream_id=None):
+        if stream_id is not None and stream_id != self._lesson_stream_id:
+            return
+        self._flush_lesson_chunks()
         self.set_ui_ready()
         tutor = self.session_state.current_tutor
         topic = self.session_state.current_topic
 
         self.lbl_tutor_info.configure(text=f"DOCENTE: {tutor} | ARGOMENTO: {topic}")
-        self.set_text(f"🎓 LEZIONE MAGISTRALE\n\n{text}")
+        if not self._lesson_stream_started:
+            self.set_text(f"🎓 LEZIONE MAGISTRALE\n\n{text}")
         if img_path: self._load_image(img_path)
 
         self._clear_options()
         self.btn_next.configure(text="TUTTO CHIARO - INIZIA QUIZ (10 Domande) ➤", command=self.start_quiz_loop)
         self.btn_next.pack(fill="x", pady=5)
-        speak(f"Lezione su {topic}. {text}", tutor=tutor)
+        if self._lesson_narration:
+            self._lesson_narration.close()
+            self._lesson_narration = None
+        else:
+            speak(f"Lezione su {topic}. {text}", tutor=tutor)
 
     def start_quiz_loop(self):
         self.step = "quiz"
@@ -374,6 +470,8 @@ class LunaGuiApp(ctk.CTk):
 
     def next_quiz_question(self):
         stop()
+        # L'immagine della risposta precedente, se ancora in coda, non serve più
+        self.engine.cancel_pending_images("quiz")
         if self.session_state.quiz_counter >= 10:
             self.show_final_report()
             return
@@ -410,22 +508,42 @@ class LunaGuiApp(ctk.CTk):
         threading.Thread(target=self._process_answer_thread, args=(choice,), daemon=True).start()
 
     def _process_answer_thread(self, choice):
-        res = self.engine.apply_answer(self.session_state, self.current_question, choice)
-        fb = self.engine.get_answer_feedback(self.current_question, res.outcome, res.new_stage)
-        img = self.engine.last_image_path
-        self.after(0, lambda: self._show_feedback(res, fb, img))
-
-    def _show_feedback(self, res, fb, img):
-        self.set_ui_ready()
-        self._clear_options()
+        question = self.current_question
+        res = self.engine.apply_answer(self.session_state, question, choice)
+        # Reazione immediata (domanda o frasi locali); con "enrich" il testo LLM la sostituisce quando arriva
+        fb = self.engine.answer_feedback(
+            question, res, on_enriched=lambda text: self.after(0, lambda: self._upgrade_feedback(res, text, question)))
+        self.after(0, lambda: self._show_feedback(res, fb))
+        # Esito e feedback subito; l'immagine di reazione arriva quando Stable Diffusion ha finito
+        if res.image is not None:
+            res.image.add_done_callback(
+                lambda img: self.after(0, lambda: self._show_answer_image(img, question)))
+
+    def _show_answer_image(self, img, question):
+        # Ignora immagini di domande già superate
+        if self.step != "quiz" or question is not self.current_question:
+            return
+        self._load_image(img)
 
+    def _feedback_text(self, res, fb):
         icon = "✅" if res.outcome == "corretta" else "❌"
         spieg = getattr(self.current_question, "spiegazione_breve", "")
         corr_clean = self.current_question.corretta.strip().upper()
         if len(corr_clean) > 1: corr_clean = corr_clean[0]
-        full_text = f"{fb}\n\n{icon} RISPOSTA {res.outcome.upper()}\n\n✅ Corretta: {corr_clean}\n\n📖 Spiegazione:\n{spieg}"
-        self.set_text(full_text)
-        if img: self._load_image(img)
+        return f"{fb}\n\n{icon} RISPOSTA {res.outcome.upper()}\n\n✅ Corretta: {corr_clean}\n\n📖 Spiegazione:\n{spieg}"
+
+    def _upgrade_feedback(self, res, fb, question):
+        # Solo se il feedback di quella domanda è ancora a schermo
+        if self.step != "quiz" or question is not self.current_question or self.can_answer:
+            return
+        self.set_text(self._feedback_text(res, fb))
+
+    def _show_feedback(self, res, fb):
+        self.set_ui_ready()
+        self._clear_options()
+
+        spieg = getattr(self.current_question, "spiegazione_breve", "")
+        self.set_text(self._feedback_text(res, fb))
         speak(f"{fb}. {spieg}", tutor=self.current_question.tutor)
         lbl = "PROSSIMA DOMANDA ➤" if self.session_state.quiz_counter < 10 else "VAI ALLA PAGELLA ➤"
         self.btn_next.configure(text=lbl, command=self.next_quiz_question)
@@ -434,16 +552,39 @@ class LunaGuiApp(ctk.CTk):
     def show_final_report(self):
         self.step = "report"
         self.set_ui_loading("Elaborazione Pagella...")
-        threading.Thread(target=self._gen_report_thread, daemon=True).start()
+        self._report_id += 1
+        self._report_shown = False
+        self._report_enriched = None
+        threading.Thread(target=self._gen_report_thread, args=(self._report_id,), daemon=True).start()
+
+    def _gen_report_thread(self, report_id):
+        rep = self.engine.generate_final_report(
+            self.session_state,
+            on_enriched=lambda text: self.after(0, lambda: self._upgrade_report(text, report_id)))
+        self.after(0, lambda: self._display_report(rep, report_id))
+
+    def _report_text(self, text):
+        score = self.session_state.quiz_score
+        return f"📊 PAGELLA FINALE\n\nPunteggio Totale: {score}/10\n\n{text}"
 
-    def _gen_report_thread(self):
-        rep = self.engine.generate_final_report(self.session_state)
-        self.after(0, lambda: self._display_report(rep))
+    def _upgrade_report(self, text, report_id):
+        # Con la risposta in cache il testo arricchito può arrivare prima della pagella locale:
+        # lo si tiene da parte e _display_report lo usa al posto del fallback
+        if report_id != self._report_id or self.step != "report":
+            return
+        self._report_enriched = text
+        if self._report_shown:
+            self.set_text(self._report_text(text))
 
-    def _display_report(self, text):
+    def _display_report(self, text, report_id):
+        if report_id != self._report_id or self.step != "report":
+            return
+        self._report_shown = True
+        if self._report_enriched is not None:
+            text = self._report_enriched
         self.set_ui_ready()
         score = self.session_state.quiz_score
-        self.set_text(f"📊 PAGELLA FINALE\n\nPunteggio Totale: {score}/10\n\n{text}")
+        self.set_text(self._report_text(text))
 
         # Mostra barra progresso anche qui? No, meglio mandare al riepilogo
         self._clear_options()
@@ -518,6 +659,7 @@ class LunaGuiApp(ctk.CTk):
 
     def on_close(self):
         shutdown_narrator()
+        self.engine.gemini.telemetry.stop_dump()
         self.destroy()
 
 
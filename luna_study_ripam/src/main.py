@@ -57,7 +57,8 @@ def main() -> int:
 
     model = _get_env("GEMINI_MODEL", "gemini-2.0-flash")
     temp = float(_get_env("GEMINI_TEMPERATURE", "0.7"))
-    max_tokens = int(_get_env("GEMINI_MAX_TOKENS", "1200"))
+    # Tetto globale: vale per i profili di generazione che non ne fissano uno proprio
+    max_tokens = int(_get_env("GEMINI_MAX_TOKENS", "4096"))
 
     project_root = _project_root()
 
@@ -65,7 +66,7 @@ def main() -> int:
     gemini = GeminiClient(
         GeminiConfig(
             api_key=api_key,
-            model=model,
+            model_name=model,
             temperature=temp,
             max_output_tokens=max_tokens,
         )
@@ -0,0 +1,244 @@
+# src/storage/question_bank_store.py
+from __future__ import annotations
+
+import json
+import mmap
+import os
+import random
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+INDEX_VERSION = 1
+INDEX_SUFFIX = ".idx"
+
+_BOM = b"\xef\xbb\xbf"
+
+
+class QuestionBankStore:
+    """
+    Banca domande JSONL con indice degli offset in un file accanto (<file>.jsonl.idx).
+
+    - Il file viene mappato in memoria (mmap): niente lettura/decodifica dell'intero JSONL.
+    - L'indice (offset, lunghezza, materia, tags per riga) si ricostruisce solo se il JSONL cambia.
+    - sample()/sample_raw(): campionamento casuale senza ripetizioni, con filtri per materia e tags;
+      vengono decodificate solo le righe estratte.
+    - Hot reload: il JSONL viene ricontrollato (stat) al massimo ogni `check_interval_sec`.
+    """
+
+    def __init__(self, path: str, check_interval_sec: float = 1.0):
+        self.path = path
+        self.index_path = path + INDEX_SUFFIX
+        self.check_interval_sec = check_interval_sec
+        self._lock = threading.RLock()
+        self._signature: Tuple[int, int] = (-2, -2)
+        self._checked_at = 0.0
+        self._file = None
+        self._mm: Optional[mmap.mmap] = None
+        self._offsets: List[int] = []
+        self._lengths: List[int] = []
+        self._materia: List[str] = []
+        self._tags: List[List[str]] = []
+        self._by_materia: Dict[str, List[int]] = {}
+        self._by_tag: Dict[str, Set[int]] = {}
+
+    # -------------------------
+    # API
+    # -------------------------
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._refresh()
+            return len(self._offsets)
+
+    def raw(self, i: int) -> str:
+        """Riga i-esima così com'è nel file (JSON serializzato)."""
+        with self._lock:
+            self._refresh()
+            return self._read_row(i)
+
+    def row(self, i: int) -> Dict[str, Any]:
+        return json.loads(self.raw(i))
+
+    def indices(self, materia: Optional[str] = None, tags: Optional[Iterable[str]] = None) -> Sequence[int]:
+        """Indici delle righe che rispettano i filtri (tags: tutte quelle richieste)."""
+        with self._lock:
+            self._refresh()
+            if materia is None and not tags:
+                return range(len(self._offsets))
+            selected: Sequence[int] = self._by_materia.get(materia, []) if materia is not None \
+                else range(len(self._offsets))
+            if tags:
+                wanted = [self._by_tag.get(t, set()) for t in tags]
+                selected = [i for i in selected if all(i in s for s in wanted)]
+            return selected
+
+    def sample_indices(
+            self,
+            k: int,
+            rng: Optional[random.Random] = None,
+            materia: Optional[str] = None,
+            tags: Optional[Iterable[str]] = None,
+            exclude: Optional[Set[int]] = None,
+    ) -> List[int]:
+        rng = rng or random
+        candidates = self.indices(materia, tags)
+        if exclude:
+            candidates = [i for i in candidates if i not in exclude]
+        if not candidates:
+            return []
+        return rng.sample(candidates, min(len(candidates), k))
+
+    def sample_raw(self, k: int, rng: Optional[random.Random] = None, **filters) -> List[str]:
+        # Indici e righe sotto lo stesso lock e senza altri _refresh(): un hot reload non può
+        # cambiare file e indice tra l'estrazione e la lettura
+        with self._lock:
+            return [self._read_row(i) for i in self.sample_indices(k, rng, **filters)]
+
+    def sample(self, k: int, rng: Optional[random.Random] = None, **filters) -> List[Dict[str, Any]]:
+        return [json.loads(raw) for raw in self.sample_raw(k, rng, **filters)]
+
+    def shuffled(self, rng: Optional[random.Random] = None, **filters) -> List[int]:
+        """Tutti gli indici (filtrati) in ordine casuale: per servire le righe una sola volta a giro."""
+        order = list(self.indices(**filters))
+        (rng or random).shuffle(order)
+        return order
+
+    def close(self) -> None:
+        with self._lock:
+            self._close()
+            self._signature = (-2, -2)
+
+    # -------------------------
+    # Indice
+    # -------------------------
+
+    def _refresh(self) -> None:
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval_sec and self._signature != (-2, -2):
+            return
+        self._checked_at = now
+        signature = _stat(self.path)
+        if signature == self._signature:
+            return
+
+        self._close()
+        self._signature = signature
+        if signature == (-1, -1):
+            self._set_index([], [], [], [])
+            return
+
+        index = self._read_index(signature)
+        if index is None:
+            index = self._build_index()
+            self._write_index(signature, index)
+        self._set_index(*index)
+
+        if signature[1] > 0:
+            self._file = open(self.path, "rb")
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _read_row(self, i: int) -> str:
+        # Da chiamare con il lock preso, senza _refresh() tra la scelta dell'indice e la lettura
+        start = self._offsets[i]
+        return self._mm[start:start + self._lengths[i]].decode("utf-8")
+
+    def _set_index(self, offsets, lengths, materia, tags) -> None:
+        self._offsets, self._lengths, self._materia, self._tags = offsets, lengths, materia, tags
+        self._by_materia = {}
+        self._by_tag = {}
+        for i, (m, ts) in enumerate(zip(materia, tags)):
+            self._by_materia.setdefault(m, []).append(i)
+            for t in ts:
+                self._by_tag.setdefault(t, set()).add(i)
+
+    def _build_index(self):
+        offsets: List[int] = []
+        lengths: List[int] = []
+        materia: List[str] = []
+        tags: List[List[str]] = []
+        pos = 0
+        with open(self.path, "rb") as f:
+            for line in f:
+                start = pos
+                pos += len(line)
+                if start == 0 and line.startswith(_BOM):
+                    line = line[len(_BOM):]
+                    start += len(_BOM)
+                content = line.rstrip(b"\r\n")
+                stripped = content.strip()
+                if not stripped:
+                    continue
+                try:
+                    data = json.loads(stripped)
+                except Exception:
+                    continue  # righe malformate fuori dall'indice
+                if not isinstance(data, dict):
+                    continue
+                offsets.append(start + (len(content) - len(content.lstrip())))
+                lengths.append(len(stripped))
+                materia.append(str(data.get("materia", "")))
+                raw_tags = data.get("tags", [])
+                tags.append([str(t) for t in raw_tags] if isinstance(raw_tags, list) else [])
+        print(f"[BANK] Indice ricostruito: {os.path.basename(self.path)} ({len(offsets)} righe)")
+        return offsets, lengths, materia, tags
+
+    def _read_index(self, signature: Tuple[int, int]):
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except Exception:
+            return None
+        if data.get("version") != INDEX_VERSION or \
+                (data.get("source_mtime_ns"), data.get("source_size")) != signature:
+            return None
+        return data["offsets"], data["lengths"], data["materia"], data["tags"]
+
+    def _write_index(self, signature: Tuple[int, int], index) -> None:
+        offsets, lengths, materia, tags = index
+        data = {
+            "version": INDEX_VERSION,
+            "source_mtime_ns": signature[0],
+            "source_size": signature[1],
+            "offsets": offsets,
+            "lengths": lengths,
+            "materia": materia,
+            "tags": tags,
+        }
+        tmp = self.index_path + ".tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp, self.index_path)
+        except Exception as e:
+            print(f"[BANK] Impossibile salvare l'indice {self.index_path}: {e}")
+
+    def _close(self) -> None:
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def _stat(path: str) -> Tuple[int, int]:
+    try:
+        st = os.stat(path)
+        return st.st_mtime_ns, st.st_size
+    except OSError:
+        return -1, -1
+
+
+_STORES: Dict[str, QuestionBankStore] = {}
+_STORES_LOCK = threading.Lock()
+
+
+def open_bank(path: str) -> QuestionBankStore:
+    """Store condiviso per processo (uno per file)."""
+    with _STORES_LOCK:
+        store = _STORES.get(path)
+        if store is None:
+            store = QuestionBankStore(path)
+            _STORES[path] = store
+        return store
@@ -0,0 +1,119 @@
+# src/visuals/image_jobs.py
+from __future__ import annotations
+
+import threading
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+
+class ImageJob:
+    """
+    Handle di un'immagine in generazione.
+
+    - result(timeout): percorso dell'immagine ("" se fallita o annullata).
+    - add_done_callback(fn): fn(percorso) viene chiamata (dal thread del worker) solo se l'immagine
+      è pronta e il job non è stato annullato nel frattempo.
+    - cancel(): un job ancora in coda non parte; uno già partito non può interrompere Stable Diffusion,
+      ma il suo risultato viene scartato.
+    """
+
+    def __init__(self, group: str):
+        self.group = group
+        self.future: Optional[Future] = None  # assegnato da ImageJobQueue.submit
+        self._cancelled = False
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled
+
+    def cancel(self) -> bool:
+        """True se il job non era ancora partito."""
+        self._cancelled = True
+        return self.future.cancel()
+
+    def done(self) -> bool:
+        return self.future.done()
+
+    def result(self, timeout: Optional[float] = None) -> str:
+        try:
+            path = self.future.result(timeout=timeout)
+        except CancelledError:
+            return ""
+        return "" if self._cancelled else path
+
+    def add_done_callback(self, fn: Callable[[str], None]) -> None:
+        def deliver(f: Future) -> None:
+            if self._cancelled or f.cancelled() or f.exception() is not None:
+                return
+            path = f.result()
+            if path:
+                fn(path)
+
+        self.future.add_done_callback(deliver)
+
+
+class ImageJobQueue:
+    """
+    Coda dei job di Stable Diffusion (un worker: la GPU è una sola).
+
+    I job sono raggruppati (es. "lesson", "quiz"): un nuovo job con supersede=True annulla quelli
+    dello stesso gruppo ancora pendenti, così un'immagine di una domanda superata non blocca la successiva.
+    """
+
+    def __init__(self, max_workers: int = 1):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="sd-image")
+        self._lock = threading.Lock()
+        self._pending: Dict[str, List[ImageJob]] = {}
+
+    def submit(self, group: str, render: Callable[[], str], supersede: bool = True) -> ImageJob:
+        """render() genera l'immagine e ritorna il percorso ("" se non generata)."""
+        job = ImageJob(group)
+        superseded: List[ImageJob] = []
+        with self._lock:
+            if supersede:
+                superseded = self._pending.pop(group, [])
+            job.future = self._executor.submit(self._run, job, render)
+            self._pending.setdefault(group, []).append(job)
+        # Fuori dal lock: Future.cancel() esegue subito le callback (che a loro volta prendono il lock)
+        for old in superseded:
+            old.cancel()
+        job.future.add_done_callback(lambda _f: self._forget(job))
+        return job
+
+    def cancel(self, group: Optional[str] = None) -> int:
+        """Annulla i job pendenti del gruppo (tutti se group=None). Ritorna quanti."""
+        with self._lock:
+            if group is not None:
+                jobs = self._pending.pop(group, [])
+            else:
+                jobs = [job for group_jobs in self._pending.values() for job in group_jobs]
+                self._pending.clear()
+        for job in jobs:
+            job.cancel()
+        return len(jobs)
+
+    def pending(self, group: Optional[str] = None) -> int:
+        with self._lock:
+            if group is not None:
+                return len(self._pending.get(group, []))
+            return sum(len(jobs) for jobs in self._pending.values())
+
+    def shutdown(self) -> None:
+        self.cancel()
+        self._executor.shutdown(wait=False)
+
+    def _forget(self, job: ImageJob) -> None:
+        with self._lock:
+            jobs = self._pending.get(job.group)
+            if jobs and job in jobs:
+                jobs.remove(job)
+
+    @staticmethod
+    def _run(job: ImageJob, render: Callable[[], str]) -> str:
+        if job.cancelled:
+            return ""
+        try:
+            return render()
+        except Exception as e:
+            print(f"[IMAGE] Errore generazione immagine ({job.group}): {e}")
+            return ""
@@ -6,6 +6,7 @@ from pathlib import Path
 from typing import List, Tuple, Optional
 import sys
 
+from src.ai.prompt_assets import ASSETS
 from src.domain.models import TutorName, Question
 
 
@@ -110,15 +111,12 @@ def compile_sd_prompt(
 # -------------------------
 
 def _read_text(path: Path) -> str:
-    if not path.exists():
+    # Registro in memoria condiviso con prompt_builder; strip_bom come utf-8-sig
+    text = ASSETS.read(str(path), strip_bom=True)
+    if text is None:
         print(f"[DEBUG] File NON trovato: {path}")
         return ""
-        # Usa utf-8-sig per gestire il BOM
-    try:
-        return path.read_text(encoding="utf-8-sig").strip()
-    except Exception as e:
-        print(f"[DEBUG] Errore lettura {path}: {e}")
-        return ""
+    return text
 
 
 def _split_negative(text: str) -> Tuple[str, str]:
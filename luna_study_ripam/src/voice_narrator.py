@@ -4,13 +4,14 @@ Gestisce la sintesi vocale tramite Google Cloud TTS.
 FIX: Supporto per testi lunghi (>5000 bytes) tramite chunking automatico.
 """
 
+import queue
 import threading
 import time
 import os
 import re
 import tempfile
 import uuid
-from typing import Optional, List
+from typing import Optional, List, Tuple
 from pathlib import Path
 
 # Import Google Cloud TTS
@@ -48,6 +49,7 @@ VOICE_MAP = {
 
 _audio_thread: Optional[threading.Thread] = None
 _stop_event = threading.Event()
+_stop_generation = 0  # incrementato a ogni stop(): invalida gli stream di lettura precedenti
 _is_initialized = False
 _init_lock = threading.Lock()
 
@@ -112,6 +114,10 @@ def _generate_file_google(text: str, out_path: str, voice_name: str):
 
 
 def _playback_worker(text: str, tutor: str):
+    _play_text(text, tutor)
+
+
+def _play_text(text: str, tutor: str):
     try:
         clean_text = _sanitize_text_for_tts(text)
         if not clean_text: return
@@ -155,6 +161,76 @@ def _playback_worker(text: str, tutor: str):
         print(f"[AUDIO] Errore worker: {e}")
 
 
+# Fine frase: punteggiatura seguita da spazio, oppure riga vuota (paragrafo)
+_SENTENCE_END_RE = re.compile(r'[.!?…]+["»)]?\s+|\n\s*\n')
+# Abbreviazioni da non considerare fine frase: "L.", "Art.", "D.Lgs.", "es.", "n."
+_ABBREV_RE = re.compile(r"(?:^|[\s('’])(?:[A-Za-zÀ-ÿ]{1,3}|[A-Za-z]+\.[A-Za-z.]+)\.$")
+
+
+def _split_complete_sentences(buffer: str) -> Tuple[str, str]:
+    """Separa il testo in (frasi complete, resto ancora incompleto)."""
+    cut = 0
+    for m in _SENTENCE_END_RE.finditer(buffer):
+        head = buffer[:m.start() + 1].rstrip()
+        if m.group(0).strip() and _ABBREV_RE.search(head):
+            continue
+        cut = m.end()
+    return buffer[:cut], buffer[cut:]
+
+
+class NarrationStream:
+    """
+    Lettura progressiva di un testo che arriva a pezzi (lezione in streaming).
+    feed() accumula il testo; appena ci sono frasi complete vengono messe in coda
+    e lette in ordine da un unico worker. close() legge l'eventuale coda finale.
+    La prima porzione è piccola (parte subito), le successive più lunghe (meno chiamate TTS).
+    """
+
+    def __init__(self, tutor: str, first_chunk_chars: int = 120, chunk_chars: int = 600):
+        self.tutor = tutor
+        self.first_chunk_chars = first_chunk_chars
+        self.chunk_chars = chunk_chars
+        self._buffer = ""
+        self._pending = ""
+        self._started = False
+        self._generation = _stop_generation
+        self._queue: "queue.Queue[Optional[str]]" = queue.Queue()
+        self._thread = threading.Thread(target=self._worker, daemon=True)
+        self._thread.start()
+
+    def _cancelled(self) -> bool:
+        return _stop_event.is_set() or self._generation != _stop_generation
+
+    def feed(self, text: str) -> None:
+        if not text or self._cancelled():
+            return
+        self._buffer += text
+        ready, self._buffer = _split_complete_sentences(self._buffer)
+        self._pending += ready
+        limit = self.chunk_chars if self._started else self.first_chunk_chars
+        if len(self._pending) >= limit:
+            self._flush()
+
+    def close(self) -> None:
+        self._pending += self._buffer
+        self._buffer = ""
+        self._flush()
+        self._queue.put(None)
+
+    def _flush(self) -> None:
+        if self._pending.strip():
+            self._queue.put(self._pending)
+            self._started = True
+        self._pending = ""
+
+    def _worker(self) -> None:
+        while True:
+            text = self._queue.get()
+            if text is None or self._cancelled():
+                return
+            _play_text(text, self.tutor)
+
+
 def init_narrator():
     global _is_initialized
     if not pygame: return
@@ -178,7 +254,20 @@ def speak(text: str, tutor: str = "Luna"):
     _audio_thread.start()
 
 
+def speak_stream(tutor: str = "Luna") -> NarrationStream:
+    """Come speak(), ma per testo in arrivo a pezzi: usare feed() e poi close()."""
+    global _audio_thread
+    if not _is_initialized: init_narrator()
+    stop()
+    _stop_event.clear()
+    stream = NarrationStream(tutor)
+    _audio_thread = stream._thread
+    return stream
+
+
 def stop():
+    global _stop_generation
+    _stop_generation += 1
     _stop_event.set()
     if pygame and pygame.mixer.get_init():
         try:
@@ -0,0 +1,79 @@
+import pytest
+
+from src.ai.rate_limit import estimate_tokens
+from src.engine.chat_memory import ChatMemory, ChatMemoryConfig
+
+TOPIC = "Diritto amministrativo: procedimento"
+LESSON = "Il procedimento amministrativo si apre d'ufficio o su istanza di parte. " * 60
+
+
+def _memory(summarize=None, **overrides) -> ChatMemory:
+    cfg = dict(recent_turns=4, summary_tokens=60, lesson_tokens=80)
+    cfg.update(overrides)
+    memory = ChatMemory(ChatMemoryConfig(**cfg), summarize=summarize)
+    memory.reset(TOPIC)
+    memory.set_lesson(LESSON)
+    return memory
+
+
+def _chat(memory: ChatMemory, exchanges: int, start: int = 0) -> None:
+    for i in range(start, start + exchanges):
+        memory.add_turn("user", f"Domanda {i}: " + "perché il termine? " * (i + 1))
+        memory.add_turn("tutor", f"Risposta {i}: " + "per la legge 241. " * (2 * i + 1))
+
+
+def test_old_turns_fold_into_the_local_summary():
+    memory = _memory()
+    _chat(memory, 2)
+    assert not memory.needs_compaction()
+    _chat(memory, 3, start=2)
+    assert memory.needs_compaction()
+    assert memory.compact() == 6
+    assert memory.stats()["turns"] == 4
+    assert 0 < memory.stats()["summary_tokens"] <= 60
+    context = memory.render()
+    assert "CONVERSAZIONE PRECEDENTE (riassunto):" in context
+    assert "Risposta 2:" in context.split("ULTIMI SCAMBI:")[0]  # compresso nel riassunto
+    assert "Domanda 4:" in context.split("ULTIMI SCAMBI:")[1]  # ancora alla lettera
+
+
+def test_summarizer_receives_the_previous_summary():
+    materials = []
+
+    def summarize(material, max_tokens):
+        materials.append(material)
+        return f"riassunto {len(materials)}"
+
+    memory = _memory(summarize)
+    _chat(memory, 3)
+    memory.compact()
+    _chat(memory, 2, start=3)
+    memory.compact()
+    assert "Riassunto precedente:\nriassunto 1" in materials[1]
+    assert "riassunto 2" in memory.render()
+
+
+@pytest.mark.parametrize("budget", [1, 5, 20, 50, 120, 300, 800, 1500])
+def test_render_never_exceeds_the_budget(budget):
+    memory = _memory()
+    _chat(memory, 8)
+    assert estimate_tokens(memory.render(budget)) <= budget
+    memory.compact()
+    assert estimate_tokens(memory.render(budget)) <= budget
+
+
+def test_newest_turn_survives_a_tight_budget():
+    memory = _memory()
+    _chat(memory, 3)
+    context = memory.render(60)
+    assert "ULTIMI SCAMBI:" in context
+    assert context.endswith("per la legge 241.")
+
+
+def test_reset_clears_turns_and_summary():
+    memory = _memory()
+    _chat(memory, 5)
+    memory.compact()
+    memory.reset("Logica")
+    assert memory.stats() == {"turns": 0, "summary_tokens": 0, "lesson_tokens": 0}
+    assert memory.render() == "ARGOMENTO DELLA LEZIONE: Logica"
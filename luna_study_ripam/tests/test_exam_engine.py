@@ -0,0 +1,70 @@
+import itertools
+import json
+import os
+
+from src.ai.gemini_client import GeminiClient, GeminiConfig
+from src.ai.llm_backends import FakeBackend
+from src.engine.exam_engine import ExamEngine
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_TOPICS = ["Entro quanti giorni si conclude il procedimento", "Chi può presentare istanza di accesso civico",
+           "Quando si forma il silenzio assenso", "Chi convoca la conferenza di servizi",
+           "Quali compiti ha il responsabile del procedimento", "Entro quale termine opera l'annullamento d'ufficio",
+           "A cosa serve il preavviso di rigetto", "Cosa deve indicare la motivazione del provvedimento"]
+_counter = itertools.count()
+
+
+def _item(topic: str) -> dict:
+    return {
+        "domanda": f"{topic}?",
+        "opzioni": {k: f"{k}) {topic}" for k in "ABCD"},
+        "corretta": "A",
+        "spiegazione": topic,
+    }
+
+
+def _responder(prompt, params):
+    # Ogni chiamata: domande nuove; i batch contengono sempre una copia del primo elemento
+    if params["response_schema"].get("type") == "array":
+        items = [_item(f"{_TOPICS[next(_counter) % len(_TOPICS)]} (caso {next(_counter)})") for _ in range(3)]
+        return json.dumps(items[:1] + items)
+    return json.dumps(_item(f"{_TOPICS[next(_counter) % len(_TOPICS)]} (caso {next(_counter)})"))
+
+
+def _engine() -> ExamEngine:
+    config = GeminiConfig(api_key="dummy", retry_attempts=1)
+    return ExamEngine(PROJECT_ROOT, GeminiClient(config, backend=FakeBackend(_responder)))
+
+
+def test_batch_drops_duplicates_within_the_batch():
+    engine = _engine()
+    questions = engine._generate_batch("Diritto amministrativo", 4)
+    texts = [q.domanda for q in questions]
+    assert len(texts) == 3
+    assert len(set(texts)) == len(texts)
+
+
+def test_pregenerated_questions_are_seen_only_when_served():
+    engine = _engine()
+    session = engine.start_exam(pregenerate=True, max_workers=2, batch_size=3, learner_id="anna")
+    for fut in set(session.pending.values()):
+        fut.result()
+    seen = engine.seen.for_learner("anna")
+    assert len(seen) == 0
+
+    q = engine.get_next_question(session)
+    assert engine.get_next_question(session) is q
+    assert len(seen) == 1
+    session.current_index += 1
+    engine.get_next_question(session)
+    assert len(seen) == 2
+
+
+def test_malformed_payload_is_retried_before_the_local_bank():
+    replies = iter(["non è JSON", json.dumps(_item("Chi firma il provvedimento finale"))])
+    backend = FakeBackend(lambda prompt, params: next(replies))
+    engine = ExamEngine(PROJECT_ROOT, GeminiClient(GeminiConfig(api_key="dummy", retry_attempts=1), backend=backend))
+    q = engine._generate_question("Diritto amministrativo")
+    assert q.domanda == "Chi firma il provvedimento finale?"
+    assert len(backend.calls) == 2
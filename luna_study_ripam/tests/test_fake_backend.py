@@ -0,0 +1,235 @@
+import asyncio
+import json
+import os
+
+import pytest
+
+from src.ai.async_gemini_client import AsyncGeminiClient, BlockingGeminiAdapter
+from src.ai.gemini_client import GeminiClient, GeminiConfig, StreamStatus
+from src.ai.json_schema import question_batch_json_schema, question_json_schema
+from src.ai.llm_backends import FakeBackend
+from src.ai.resilience import LLMCallError
+from src.ai.response_parser import StructuredOutputError, question_from_payload
+from src.domain.models import SessionState
+from src.engine.question_pool import QuestionPool
+from src.engine.session_engine import SessionEngine
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SUBJECT = "Diritto amministrativo"
+
+
+def _client(backend, **overrides) -> GeminiClient:
+    cfg = dict(api_key="dummy", retry_attempts=1, retry_base_delay_sec=0.0, breaker_failure_threshold=2)
+    cfg.update(overrides)
+    return GeminiClient(GeminiConfig(**cfg), backend=backend)
+
+
+def _payload(n: int, domanda: str = "") -> dict:
+    return {
+        "domanda": domanda or f"Domanda numero {n} sul procedimento amministrativo e i suoi termini?",
+        "opzioni": {k: f"Risposta {k} della domanda {n}" for k in "ABCD"},
+        "corretta": "B",
+        "spiegazione": f"Spiegazione {n}",
+    }
+
+
+def _engine(backend, tmp_path, **kwargs) -> SessionEngine:
+    return SessionEngine(PROJECT_ROOT, _client(backend), sd_client=None, enable_sd=False,
+                         seen_dir=str(tmp_path / "seen"), **kwargs)
+
+
+# --- generate_json ---
+
+def test_generate_json_follows_the_schema():
+    backend = FakeBackend()
+    client = _client(backend)
+    data = client.generate_json("domanda", question_json_schema(), call_type="question")
+    q = question_from_payload(data, "Luna", SUBJECT)
+    assert q.corretta in q.opzioni
+    batch = client.generate_json("batch", question_batch_json_schema(), call_type="question", profile="question_batch")
+    assert isinstance(batch, list) and batch
+    params = backend.calls[0]["params"]
+    assert params["response_mime_type"] == "application/json"
+    assert params["response_schema"] == question_json_schema()
+
+
+def test_generate_json_repairs_common_defects():
+    raw = "Ecco la domanda:\n```json\n" + json.dumps(_payload(1)).replace('"B"', "'B'")[:-1] + ",}\n```"
+    client = _client(FakeBackend(lambda prompt, params: raw))
+    data = client.generate_json("domanda", question_json_schema(), call_type="question")
+    assert data["corretta"] == "B"
+    assert client.telemetry_stats()["parse_failures"] == {}
+
+
+@pytest.mark.parametrize("raw, reason", [
+    ("non è JSON", "invalid_json"),
+    ('{"domanda": "tagliata a met', "truncated"),
+    ('{"domanda": "senza opzioni"}', "schema"),
+])
+def test_generate_json_unusable_output_is_recorded(raw, reason):
+    client = _client(FakeBackend(lambda prompt, params: raw))
+    with pytest.raises(StructuredOutputError) as exc:
+        client.generate_json("domanda", question_json_schema(), call_type="question")
+    assert exc.value.reason == reason
+    assert client.telemetry_stats()["parse_failures"] == {"question": {reason: 1}}
+
+
+def test_service_down_is_unavailable_and_opens_the_breaker():
+    def down(prompt, params):
+        raise LLMCallError("503 Service Unavailable", retryable=True)
+
+    client = _client(FakeBackend(down))
+    for _ in range(2):
+        with pytest.raises(StructuredOutputError) as exc:
+            client.generate_json("domanda", question_json_schema(), call_type="question")
+        assert exc.value.reason == "unavailable"
+    assert client.circuit_open
+    assert client.telemetry_stats()["parse_failures"] == {}
+
+
+def test_length_capped_output_is_truncated_not_valid():
+    # JSON completo e valido, ma il servizio dice che si è fermato al tetto di token: non va usato
+    backend = FakeBackend(lambda prompt, params: json.dumps(_payload(1)), finish_reason="MAX_TOKENS")
+    client = _client(backend, retry_attempts=3)
+    with pytest.raises(StructuredOutputError) as exc:
+        client.generate_json("domanda", question_json_schema(), call_type="question")
+    assert exc.value.reason == "truncated"
+    assert exc.value.raw == json.dumps(_payload(1))
+    assert len(backend.calls) == 1  # niente retry: verrebbe tagliata di nuovo
+    assert not client.circuit_open
+    stats = client.telemetry_stats()
+    assert stats["parse_failures"] == {"question": {"truncated": 1}}
+    assert stats["by_call"]["question"][client.config.model_name]["outcomes"] == {"truncated": 1}
+
+    assert client.generate_content("lezione", use_cache=False, call_type="lesson", profile="lesson") == "{}"
+
+
+def test_async_client_reports_truncation():
+    client = AsyncGeminiClient(GeminiConfig(api_key="dummy", retry_attempts=1),
+                               backend=FakeBackend(finish_reason="MAX_TOKENS"))
+    with pytest.raises(StructuredOutputError) as exc:
+        asyncio.run(client.generate_json("domanda", question_json_schema(), call_type="question"))
+    assert exc.value.reason == "truncated"
+
+    client = AsyncGeminiClient(GeminiConfig(api_key="dummy", retry_attempts=1),
+                               backend=FakeBackend(finish_reason="STOP"))
+    data = asyncio.run(client.generate_json("domanda", question_json_schema(), call_type="question"))
+    assert data["domanda"]
+
+
+@pytest.mark.parametrize("finish_reason, clean", [("STOP", True), ("MAX_TOKENS", False)])
+def test_blocking_adapter_stream_reports_status(finish_reason, clean):
+    adapter = BlockingGeminiAdapter(AsyncGeminiClient(GeminiConfig(api_key="dummy", retry_attempts=1),
+                                                      backend=FakeBackend(finish_reason=finish_reason)))
+    status = StreamStatus()
+    try:
+        text = "".join(adapter.stream_content("lezione", use_cache=False, call_type="lesson", status=status))
+    finally:
+        adapter.close()
+    assert text == "Risposta di prova."
+    assert status.clean is clean
+
+
+# --- Motore: lezioni ---
+
+LESSON_TEXT = "Il procedimento amministrativo si apre d'ufficio o su istanza di parte. " * 10
+
+
+@pytest.mark.parametrize("finish_reason, stored", [("STOP", 1), ("MAX_TOKENS", 0)])
+def test_only_complete_lessons_are_stored(tmp_path, finish_reason, stored):
+    backend = FakeBackend(lambda prompt, params: LESSON_TEXT, finish_reason=finish_reason)
+    engine = _engine(backend, tmp_path, lesson_store_path=str(tmp_path / "lessons.db"))
+    chunks = []
+    text, _ = engine.stream_new_lesson_block(SessionState(), chunks.append)
+    assert text == "".join(chunks)
+    assert engine.lesson_store.stats()["variants"] == stored
+
+    engine.lesson_store.clear()
+    engine.start_new_lesson_block(SessionState())
+    assert engine.lesson_store.stats()["variants"] == stored
+
+    engine.lesson_store.clear()
+    engine._schedule_lesson_variant("chiave", "prompt lezione")
+    engine._lesson_executor.shutdown(wait=True)
+    assert engine.lesson_store.variant_count("chiave") == stored
+
+
+def test_interrupted_stream_is_shown_but_not_stored(tmp_path):
+    class Interrupted(FakeBackend):
+        def stream(self, prompt, params):
+            yield LESSON_TEXT
+            raise LLMCallError("connessione interrotta")
+
+    engine = _engine(Interrupted(), tmp_path, lesson_store_path=str(tmp_path / "lessons.db"))
+    text, _ = engine.stream_new_lesson_block(SessionState(), lambda chunk: None)
+    assert text == LESSON_TEXT
+    assert engine.lesson_store.stats()["variants"] == 0
+
+
+# --- Motore: fallback e dedup ---
+
+def test_quiz_falls_back_to_local_bank(tmp_path):
+    engine = _engine(FakeBackend(lambda prompt, params: "{}"), tmp_path)
+    q = engine._generate_quiz_question(SUBJECT, "Luna", 1, [])
+    assert q.domanda != "Errore tecnico generazione domanda. Procedi."
+    assert q.materia == SUBJECT
+
+
+def test_placeholder_question_is_not_marked_seen(tmp_path):
+    engine = _engine(FakeBackend(lambda prompt, params: "{}"), tmp_path)
+    engine.local_bank.draw = lambda *args, **kwargs: None
+    state = SessionState(current_topic=SUBJECT, current_tutor="Luna")
+    q = engine.get_next_quiz_question(state)
+    assert q.tipo == SessionEngine.PLACEHOLDER_TIPO
+    assert len(engine.seen.for_learner(state.learner_id)) == 0
+
+    engine.gemini = _client(FakeBackend(lambda prompt, params: json.dumps(_payload(1))))
+    assert engine.get_next_quiz_question(state).domanda == _payload(1)["domanda"]
+    assert len(engine.seen.for_learner(state.learner_id)) == 1
+
+
+def test_payload_without_question_is_retried_and_recorded(tmp_path):
+    replies = iter([json.dumps({**_payload(1), "domanda": ""}), json.dumps(_payload(2))])
+    engine = _engine(FakeBackend(lambda prompt, params: next(replies)), tmp_path)
+    q = engine._generate_quiz_question(SUBJECT, "Luna", 1, [])
+    assert q.domanda == _payload(2)["domanda"]
+    stats = engine.gemini.telemetry_stats()
+    assert stats["parse_failures"] == {"quiz_single": {"missing_fields": 1}}
+    assert set(stats["by_call"]) == {"quiz_single"}
+
+
+def test_call_sites_are_recorded_separately(tmp_path):
+    batch = json.dumps([_payload(n) for n in range(3)])
+    engine = _engine(FakeBackend(lambda prompt, params: batch), tmp_path)
+    engine._refill_pool(SUBJECT, "", 1, 3)
+    engine._generate_quiz_batch(SUBJECT, "Luna", 1, [], 3)
+    engine._summarize_for_chat("testo della lezione", 100)
+    # Stesso call_type ("question") per refill e prefetch, ma voci di telemetria distinte
+    assert set(engine.gemini.telemetry_stats()["by_call"]) == {"pool_refill", "quiz_prefetch", "chat_summary"}
+
+
+def test_prefetch_batch_drops_duplicates(tmp_path):
+    # Due copie della stessa domanda (opzioni in ordine diverso) + una diversa
+    dup = _payload(1)
+    dup_shuffled = {**dup, "opzioni": dict(reversed(list(dup["opzioni"].items())))}
+    batch = json.dumps([dup, dup_shuffled, _payload(2, "Quale organo adotta il regolamento di contabilità?")])
+    engine = _engine(FakeBackend(lambda prompt, params: batch), tmp_path, prefetch_depth=3, prefetch_batch=3)
+    state = SessionState(current_topic=SUBJECT, current_tutor="Luna")
+    engine.start_prefetch(state)
+    served = [engine.get_next_quiz_question(state).domanda for _ in range(2)]
+    assert len(set(served)) == 2
+    assert dup["domanda"] in served
+
+
+def test_pool_never_serves_the_same_question_twice(tmp_path):
+    questions = [question_from_payload(_payload(n), "Luna", SUBJECT) for n in range(4)]
+    pool = QuestionPool(str(tmp_path / "pool"), refill=lambda s, t, stage, n: questions + questions, low_water=1, target=4)
+    assert pool.add(SUBJECT, "", questions + questions) == 4
+
+    drawn = [pool.draw(SUBJECT, "", "anna") for _ in range(5)]
+    assert drawn[-1] is None
+    assert len({q.domanda for q in drawn[:4]}) == 4
+    # Lo stato "già servite" sopravvive al riavvio
+    reopened = QuestionPool(str(tmp_path / "pool"), refill=lambda s, t, stage, n: [])
+    assert reopened.available(SUBJECT, "", "anna") == 0
+    assert reopened.available(SUBJECT, "", "marco") == 4
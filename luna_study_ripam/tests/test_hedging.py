@@ -0,0 +1,102 @@
+import asyncio
+import itertools
+import json
+import time
+
+from src.ai.async_gemini_client import AsyncGeminiClient
+from src.ai.gemini_client import GeminiClient, GeminiConfig
+from src.ai.json_schema import question_json_schema
+from src.ai.llm_backends import FakeBackend
+
+VALID = json.dumps({
+    "domanda": "Chi adotta il regolamento?",
+    "opzioni": {"A": "Il sindaco", "B": "Il consiglio", "C": "La giunta", "D": "Il prefetto"},
+    "corretta": "B",
+    "spiegazione": "Competenza del consiglio.",
+})
+
+
+def _scripted(*replies):
+    """Responder: la i-esima chiamata dorme replies[i][0] secondi e ritorna replies[i][1]."""
+    counter = itertools.count()
+
+    def responder(prompt, params):
+        delay, text = replies[next(counter)]
+        time.sleep(delay)
+        return text
+    return responder
+
+
+def _config(**overrides) -> GeminiConfig:
+    cfg = dict(api_key="dummy", retry_attempts=1, hedge_min_delay_ms=50, hedge_budget_burst=5)
+    cfg.update(overrides)
+    return GeminiConfig(**cfg)
+
+
+def _prime(client: GeminiClient, call_type: str, latency: float = 0.05) -> None:
+    for _ in range(client.hedge_latencies.min_samples):
+        client.hedge_latencies.record(call_type, latency)
+
+
+def _calls(client: GeminiClient, call_type: str) -> int:
+    return sum(agg["calls"] for agg in client.telemetry_stats()["by_call"][call_type].values())
+
+
+def test_hedge_records_one_logical_call():
+    backend = FakeBackend(_scripted((0.5, "lenta"), (0.0, "veloce")))
+    client = GeminiClient(_config(), backend=backend)
+    _prime(client, "chat")
+    assert client.generate_content("ciao", use_cache=False, call_type="chat", interactive=True) == "veloce"
+    assert len(backend.calls) == 2
+    assert client.hedge_stats()["hedge_wins"] == 1
+    time.sleep(0.6)  # il perdente finisce la sua richiesta: non deve lasciare traccia
+    assert _calls(client, "chat") == 1
+    assert sum(m["samples"] for m in client.router_stats()["models"].values()) == 1
+
+
+def test_hedge_winner_must_parse():
+    # Il primo a finire risponde testo non JSON: vince il duplicato, più lento ma valido
+    backend = FakeBackend(_scripted((0.15, "non è JSON"), (0.3, VALID)))
+    client = GeminiClient(_config(), backend=backend)
+    _prime(client, "question")
+    data = client.generate_json("domanda", question_json_schema(), call_type="question", interactive=True)
+    assert data["corretta"] == "B"
+    assert client.telemetry_stats()["parse_failures"] == {}
+    assert _calls(client, "question") == 1
+
+
+def test_only_interactive_calls_are_hedged():
+    backend = FakeBackend(_scripted((0.2, "lenta"), (0.0, "veloce")))
+    client = GeminiClient(_config(), backend=backend)
+    _prime(client, "chat")
+    assert client.generate_content("ciao", use_cache=False, call_type="chat") == "lenta"
+    assert len(backend.calls) == 1
+    assert client.hedge_stats()["requests"] == 0
+
+
+def test_hedge_delay_uses_the_call_type_window():
+    client = GeminiClient(_config(hedge_min_delay_ms=0), backend=FakeBackend())
+    # Le latenze del router (per modello, tutti i tipi di chiamata) non c'entrano
+    for _ in range(10):
+        client.router.record(client.config.model_name, 30.0, True)
+    assert client.hedge_delay("reaction") is None
+    _prime(client, "reaction", 0.2)
+    assert client.hedge_delay("reaction") == 0.2
+    assert client.hedge_delay("chat") is None
+
+
+def test_async_hedge_records_one_logical_call():
+    backend = FakeBackend(_scripted((0.15, "non è JSON"), (0.3, VALID)))
+    client = AsyncGeminiClient(_config(), backend=backend)
+    _prime(client._client, "question")
+
+    async def run():
+        data = await client.generate_json("domanda", question_json_schema(), call_type="question",
+                                          interactive=True)
+        await asyncio.sleep(0.1)
+        return data
+
+    assert asyncio.run(run())["corretta"] == "B"
+    stats = client.telemetry_stats()
+    assert sum(agg["calls"] for agg in stats["by_call"]["question"].values()) == 1
+    assert stats["parse_failures"] == {}
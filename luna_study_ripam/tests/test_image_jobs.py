@@ -0,0 +1,73 @@
+import threading
+from concurrent.futures import TimeoutError as FutureTimeout
+
+import pytest
+
+from src.visuals.image_jobs import ImageJobQueue
+
+
+class _BlockingRenderer:
+    """Finto Stable Diffusion: ogni render aspetta `release` e registra il percorso generato."""
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.started = []
+
+    def __call__(self, name: str):
+        def render() -> str:
+            self.started.append(name)
+            self.release.wait(5)
+            return f"{name}.png"
+        return render
+
+
+def _collect(job, delivered):
+    job.add_done_callback(delivered.append)
+
+
+def test_superseded_jobs_never_deliver():
+    queue = ImageJobQueue()
+    renderer = _BlockingRenderer()
+    delivered = []
+    running = queue.submit("quiz", renderer("q1"))
+    queued = queue.submit("quiz", renderer("q2"), supersede=False)
+    latest = queue.submit("quiz", renderer("q3"))
+    for job in (running, queued, latest):
+        _collect(job, delivered)
+
+    renderer.release.set()
+    assert latest.result(5) == "q3.png"
+    queue._executor.shutdown(wait=True)  # le callback girano sul worker: finito lui, sono state consegnate
+    assert running.cancelled and queued.cancelled
+    assert running.result() == "" and queued.result() == ""
+    assert "q2" not in renderer.started  # annullato prima di partire
+    assert delivered == ["q3.png"]
+
+
+def test_cancelled_running_job_result_is_dropped():
+    queue = ImageJobQueue()
+    renderer = _BlockingRenderer()
+    delivered = []
+    job = queue.submit("lesson", renderer("lezione"))
+    _collect(job, delivered)
+    other = queue.submit("quiz", renderer("domanda"))
+    _collect(other, delivered)
+
+    assert queue.cancel("lesson") == 1
+    assert queue.pending("quiz") == 1
+    renderer.release.set()
+    assert job.result(5) == ""
+    assert other.result(5) == "domanda.png"
+    queue._executor.shutdown(wait=True)
+    assert delivered == ["domanda.png"]
+
+
+def test_result_raises_on_timeout():
+    queue = ImageJobQueue()
+    renderer = _BlockingRenderer()
+    job = queue.submit("quiz", renderer("lenta"))
+    with pytest.raises(FutureTimeout):
+        job.result(timeout=0.05)
+    renderer.release.set()
+    assert job.result(5) == "lenta.png"
+    queue.shutdown()
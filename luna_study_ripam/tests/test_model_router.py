@@ -0,0 +1,65 @@
+from src.ai.model_router import ModelRouter, percentile
+
+ROUTES = {"reaction": ["lite", "flash"], "question": ["pro"]}
+
+
+def _router(**overrides) -> ModelRouter:
+    cfg = dict(routes=ROUTES, slo_ms={"reaction": 500}, window=10, min_samples=3, max_error_rate=0.3)
+    cfg.update(overrides)
+    return ModelRouter("default-model", **cfg)
+
+
+def _feed(router: ModelRouter, model: str, latencies, failures: int = 0) -> None:
+    for latency in latencies:
+        router.record(model, latency, True)
+    for _ in range(failures):
+        router.record(model, 0.0, False)
+
+
+def test_percentile_nearest_rank():
+    values = [0.1 * i for i in range(1, 21)]
+    assert percentile(values, 0.5) == values[9]
+    assert percentile(values, 0.95) == values[18]
+    assert percentile([3.0], 0.95) == 3.0
+
+
+def test_primary_is_returned_without_data():
+    router = _router()
+    assert router.choose("reaction") == "lite"
+    assert router.choose("question") == "pro"
+    assert router.choose("sconosciuto") == "default-model"
+    assert router.primary("reaction") == "lite"
+
+
+def test_models_without_enough_samples_are_explored_first():
+    router = _router()
+    _feed(router, "lite", [0.1, 0.1, 0.1])
+    assert router.choose("reaction") == "flash"  # nessun dato: va provato prima di confrontare
+    _feed(router, "flash", [0.2, 0.2])
+    assert router.choose("reaction") == "flash"
+    _feed(router, "flash", [0.2])
+    assert router.choose("reaction") == "lite"
+
+
+def test_p95_above_slo_moves_traffic():
+    router = _router()
+    # "lite" è più veloce a metà distribuzione, ma la coda supera lo SLO di 500 ms
+    _feed(router, "lite", [0.05] * 8 + [0.9, 0.9])
+    _feed(router, "flash", [0.3] * 10)
+    assert router.choose("reaction") == "flash"
+    # Nessuno rispetta lo SLO: vince il p95 minore
+    _feed(router, "flash", [1.2] * 10)
+    assert router.choose("reaction") == "lite"
+    assert router.stats()["routed"]["reaction"] == {"flash": 1, "lite": 1}
+
+
+def test_error_rate_demotes_a_model():
+    router = _router()
+    _feed(router, "lite", [0.05] * 6, failures=4)
+    _feed(router, "flash", [0.3] * 10)
+    assert router.stats()["models"]["lite"]["error_rate"] == 0.4
+    assert router.choose("reaction") == "flash"
+    # Nessuno sano: quello con meno errori
+    _feed(router, "flash", [], failures=10)
+    assert router.choose("reaction") == "lite"
+
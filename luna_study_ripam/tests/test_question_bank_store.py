@@ -0,0 +1,26 @@
+import json
+import random
+
+from src.storage.question_bank_store import QuestionBankStore
+
+
+def _write(path, rows):
+    with open(path, "w", encoding="utf-8") as f:
+        for row in rows:
+            f.write(json.dumps(row, ensure_ascii=False) + "\n")
+
+
+def test_sample_raw_reads_rows_of_the_current_file(tmp_path):
+    path = str(tmp_path / "seed.jsonl")
+    _write(path, [{"domanda": f"vecchia {i}", "materia": "Logica"} for i in range(10)])
+    store = QuestionBankStore(path, check_interval_sec=0)
+    rng = random.Random(1)
+    assert len(store.sample_raw(3, rng)) == 3
+
+    # Hot reload con un file più corto: nessun indice fuori range né righe mescolate
+    _write(path, [{"domanda": "nuova", "materia": "Logica", "tags": ["x"]}])
+    for _ in range(5):
+        rows = store.sample(3, rng)
+        assert rows == [{"domanda": "nuova", "materia": "Logica", "tags": ["x"]}]
+    assert store.sample_raw(2, rng, materia="Diritto") == []
+    store.close()
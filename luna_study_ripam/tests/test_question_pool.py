@@ -0,0 +1,77 @@
+import threading
+
+from src.domain.models import Question
+from src.engine.question_pool import QuestionPool
+
+SUBJECT = "Logica"
+
+
+def _question(n: int, reaction: str = "") -> Question:
+    return Question(
+        domanda=f"Domanda {n}", opzioni={k: f"{k}{n}" for k in "ABCD"}, corretta="A", spiegazione="",
+        tutor="Stella", materia=SUBJECT, reazione_corretta=reaction, reazione_errata=reaction,
+    )
+
+
+def test_buckets_are_split_by_stage(tmp_path):
+    calls = []
+
+    def refill(subject, subtopic, stage, count):
+        calls.append(stage)
+        return [_question(stage * 100 + i, f"reazione stage {stage}") for i in range(count)]
+
+    pool = QuestionPool(str(tmp_path), refill, low_water=1, target=2)
+    pool.add(SUBJECT, "Sillogismi", [_question(1, "reazione stage 1")], stage=1)
+    pool.add(SUBJECT, "Sillogismi", [_question(2, "reazione stage 4")], stage=4)
+
+    q = pool.draw(SUBJECT, "Sillogismi", "anna", stage=4)
+    assert q.reazione_corretta == "reazione stage 4"
+    assert pool.available(SUBJECT, "Sillogismi", "anna", stage=1) == 1
+    pool._executor.shutdown(wait=True)
+    assert calls == [4]  # il refill parte per il bucket dello stage svuotato, allo stesso stage
+    assert pool.draw(SUBJECT, "Sillogismi", "anna", stage=4).reazione_corretta == "reazione stage 4"
+
+
+def test_pending_refill_is_visible_until_done(tmp_path):
+    release = threading.Event()
+
+    def refill(subject, subtopic, stage, count):
+        release.wait(5)
+        return [_question(i) for i in range(count)]
+
+    pool = QuestionPool(str(tmp_path), refill, low_water=3, target=8)
+    pool.ensure_stock(SUBJECT, "", "anna", stage=2)
+    assert pool.pending(SUBJECT, "", "anna", stage=2) == 8
+    assert pool.pending(SUBJECT, "", "anna", stage=1) == 0
+    release.set()
+    pool._executor.shutdown(wait=True)
+    assert pool.pending(SUBJECT, "", "anna", stage=2) == 0
+    assert pool.available(SUBJECT, "", "anna", stage=2) == 8
+
+
+def test_served_ids_are_capped(tmp_path):
+    pool = QuestionPool(str(tmp_path), lambda *args: [], low_water=0, max_per_bucket=3, max_served=3)
+    pool.add(SUBJECT, "", [_question(i) for i in range(3)])
+    for _ in range(3):
+        assert pool.draw(SUBJECT, "", "anna") is not None
+    pool.add(SUBJECT, "", [_question(i) for i in range(3, 5)])
+    pool.draw(SUBJECT, "", "anna")
+    assert len(pool._served_in("anna", (SUBJECT, "", 1))) == 3
+    reopened = QuestionPool(str(tmp_path), lambda *args: [], max_per_bucket=3, max_served=3)
+    assert len(reopened._served_in("anna", (SUBJECT, "", 1))) == 3
+
+
+def test_served_cap_never_repeats_across_buckets(tmp_path):
+    # Molti bucket pieni: il totale delle servite supera max_served, ma ogni bucket tiene le sue
+    pool = QuestionPool(str(tmp_path), lambda *args: [], low_water=0, max_per_bucket=3, max_served=3)
+    subtopics = [f"Argomento {b}" for b in range(5)]
+    for b, subtopic in enumerate(subtopics):
+        pool.add(SUBJECT, subtopic, [_question(b * 10 + i) for i in range(3)])
+
+    drawn = [pool.draw(SUBJECT, subtopic, "anna") for subtopic in subtopics for _ in range(3)]
+    assert len({q.domanda for q in drawn}) == 15
+    assert sum(len(ids) for ids in pool._served_for("anna").values()) > pool.max_served
+
+    reopened = QuestionPool(str(tmp_path), lambda *args: [], low_water=0, max_per_bucket=3, max_served=3)
+    for pool_ in (pool, reopened):
+        assert all(pool_.draw(SUBJECT, subtopic, "anna") is None for subtopic in subtopics)
@@ -0,0 +1,86 @@
+import json
+
+import pytest
+
+from src.ai.json_schema import question_json_schema
+from src.ai.llm_backends import FakeBackend, RecordingBackend, ReplayBackend, take_finish_reason
+from src.ai.resilience import LLMCallError
+
+LESSON_PARAMS = {"temperature": 0.7, "max_output_tokens": 4096}
+JSON_PARAMS = {"temperature": 0.7, "response_mime_type": "application/json", "response_schema": question_json_schema()}
+
+
+def _responder(prompt, params):
+    if params.get("response_mime_type") == "application/json":
+        return json.dumps({"domanda": f"JSON per {prompt}"})
+    return f"Lezione per {prompt}"
+
+
+@pytest.fixture
+def cassette(tmp_path):
+    path = str(tmp_path / "cassette.jsonl")
+    recorder = RecordingBackend(FakeBackend(_responder), path)
+    recorder.generate("LEZIONE Logica: sillogismi", LESSON_PARAMS)
+    recorder.generate("LEZIONE Logica: insiemi", LESSON_PARAMS)
+    recorder.generate("DOMANDA Logica: sillogismi #1", JSON_PARAMS)
+    recorder.generate("DOMANDA Logica: sillogismi #1", JSON_PARAMS)
+    return path
+
+
+def test_exact_round_trip(cassette):
+    replay = ReplayBackend(cassette, match="exact", latency_sec=0)
+    assert replay.generate("LEZIONE Logica: insiemi", LESSON_PARAMS) == "Lezione per LEZIONE Logica: insiemi"
+    with pytest.raises(LLMCallError):
+        replay.generate("LEZIONE Diritto", LESSON_PARAMS)
+
+
+def test_nearest_uses_longest_common_prefix(cassette):
+    replay = ReplayBackend(cassette, latency_sec=0)
+    assert replay.generate("LEZIONE Logica: insiemi (variante 2)", LESSON_PARAMS) == \
+        "Lezione per LEZIONE Logica: insiemi"
+    assert replay.generate("LEZIONE Logica: sill", LESSON_PARAMS) == "Lezione per LEZIONE Logica: sillogismi"
+
+
+def test_nearest_never_crosses_response_shape(cassette):
+    replay = ReplayBackend(cassette, latency_sec=0)
+    # Il prompt somiglia di più a una lezione, ma la chiamata è JSON: deve ricevere una risposta JSON
+    text = replay.generate("LEZIONE Logica: sillogismi", JSON_PARAMS)
+    assert json.loads(text)["domanda"].startswith("JSON per")
+    text = replay.generate("DOMANDA Logica: sillogismi #2", LESSON_PARAMS)
+    assert text.startswith("Lezione per")
+    with pytest.raises(LLMCallError):
+        replay.generate("DOMANDA", {"response_mime_type": "application/json"})
+
+
+def test_repeated_prompts_and_injected_failures(cassette):
+    replay = ReplayBackend(cassette, latency_sec=0)
+    prompt = "DOMANDA Logica: sillogismi #1"
+    assert replay.generate(prompt, JSON_PARAMS) == replay.generate(prompt, JSON_PARAMS)
+
+    failing = ReplayBackend(cassette, latency_sec=0, failure_rate=1.0)
+    with pytest.raises(LLMCallError) as exc:
+        failing.generate(prompt, JSON_PARAMS)
+    assert exc.value.retryable
+
+
+def test_failed_calls_are_not_replayed(tmp_path):
+    path = str(tmp_path / "cassette.jsonl")
+
+    def down(prompt, params):
+        raise LLMCallError("503")
+
+    recorder = RecordingBackend(FakeBackend(down), path)
+    with pytest.raises(LLMCallError):
+        recorder.generate("LEZIONE", LESSON_PARAMS)
+    with pytest.raises(LLMCallError) as exc:
+        ReplayBackend(path, latency_sec=0).generate("LEZIONE", LESSON_PARAMS)
+    assert not exc.value.retryable
+
+
+def test_finish_reason_is_recorded_and_replayed(tmp_path):
+    path = str(tmp_path / "cassette.jsonl")
+    RecordingBackend(FakeBackend(_responder, finish_reason="MAX_TOKENS"), path).generate("LEZIONE", LESSON_PARAMS)
+    take_finish_reason()
+    ReplayBackend(path, latency_sec=0).generate("LEZIONE", LESSON_PARAMS)
+    assert take_finish_reason() == "MAX_TOKENS"
+    assert take_finish_reason() is None
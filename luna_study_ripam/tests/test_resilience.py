@@ -0,0 +1,86 @@
+import random
+
+import pytest
+
+from src.ai import resilience
+from src.ai.gemini_client import GeminiClient, GeminiConfig
+from src.ai.llm_backends import FakeBackend
+from src.ai.resilience import CircuitBreaker, LLMCallError, RetryPolicy
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(resilience, "time", clock)
+    return clock
+
+
+def _open_breaker(clock) -> CircuitBreaker:
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout_sec=30.0)
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.record_failure()
+    assert breaker.is_open and not breaker.allow()
+    clock.now += 29.0
+    assert breaker.is_open
+    clock.now += 1.0
+    return breaker
+
+
+def test_half_open_probe_closes_on_success(clock):
+    breaker = _open_breaker(clock)
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.allow()
+    assert not breaker.allow()  # una sola chiamata di prova alla volta
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow() and breaker.allow()
+
+
+def test_half_open_probe_reopens_on_failure(clock):
+    breaker = _open_breaker(clock)
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.is_open and not breaker.allow()
+    assert breaker.times_opened == 2
+    clock.now += 30.0
+    assert breaker.allow()
+
+
+def test_backoff_stays_within_full_jitter_bound():
+    policy = RetryPolicy(max_attempts=6, base_delay_sec=0.5, max_delay_sec=4.0)
+    rng = random.Random(7)
+    for attempt, cap in enumerate([0.5, 1.0, 2.0, 4.0, 4.0, 4.0]):
+        delays = [policy.delay(attempt, rng) for _ in range(200)]
+        assert all(0.0 <= d <= cap for d in delays)
+        assert max(delays) > cap / 2  # jitter sull'intero intervallo, non un valore fisso
+
+
+def test_non_retryable_error_is_not_retried():
+    def bad_request(prompt, params):
+        raise LLMCallError("400 Bad Request", retryable=False)
+
+    backend = FakeBackend(bad_request)
+    client = GeminiClient(GeminiConfig(api_key="dummy", retry_attempts=3, retry_base_delay_sec=0.0),
+                          backend=backend)
+    assert client.generate_content("ciao", use_cache=False) == "{}"
+    assert len(backend.calls) == 1
+
+
+def test_retryable_error_is_retried_up_to_the_limit():
+    def down(prompt, params):
+        raise LLMCallError("503 Service Unavailable", retryable=True)
+
+    backend = FakeBackend(down)
+    client = GeminiClient(GeminiConfig(api_key="dummy", retry_attempts=3, retry_base_delay_sec=0.0,
+                                       breaker_failure_threshold=10), backend=backend)
+    assert client.generate_content("ciao", use_cache=False) == "{}"
+    assert len(backend.calls) == 3
@@ -0,0 +1,88 @@
+import pytest
+
+from src.ai.json_schema import question_batch_json_schema, question_json_schema
+from src.ai.response_parser import ResponseParseError, StructuredOutputError, extract_json, parse_structured
+
+
+def test_valid_json_has_no_repairs():
+    data, fixes = extract_json('Ecco:\n```json\n{"a": 1, "b": [1, 2]}\n```\nFine.')
+    assert data == {"a": 1, "b": [1, 2]}
+    assert fixes == []
+
+
+def test_expected_object_skips_earlier_array():
+    text = 'Nota [1]: ecco il JSON {"a": 1}'
+    assert extract_json(text, dict) == ({"a": 1}, [])
+    assert extract_json(text, list) == ([1], [])
+
+
+def test_non_json_brackets_are_skipped():
+    data, _ = extract_json('Vedi [nota a margine] e poi [{"domanda": "x"}]', list)
+    assert data == [{"domanda": "x"}]
+
+
+def test_schema_type_selects_the_value():
+    text = 'Riferimento [2] alla norma. {"domanda": "D?", "opzioni": {"A": "1", "B": "2", "C": "3", "D": "4"}, ' \
+           '"corretta": "A", "spiegazione": "S"}'
+    data = parse_structured(text, question_json_schema())
+    assert data["domanda"] == "D?"
+
+
+def test_unescaped_inner_quotes_followed_by_comma():
+    text = '{"spiegazione": "cita "L. 241/90", art. 3", "corretta": "A"}'
+    data, fixes = extract_json(text)
+    assert data == {"spiegazione": 'cita "L. 241/90", art. 3', "corretta": "A"}
+    assert "unescaped_quotes" in fixes
+
+
+def test_unescaped_inner_quotes_in_array():
+    data, fixes = extract_json('["il "silenzio", assenso", "altro"]')
+    assert data == ['il "silenzio", assenso', "altro"]
+    assert "unescaped_quotes" in fixes
+
+
+def test_common_defects_are_repaired():
+    text = "{'domanda': 'Quale?', 'multi': “x”, 'ok': True, 'lista': [1, 2,],}"
+    data, fixes = extract_json(text)
+    assert data == {"domanda": "Quale?", "multi": "x", "ok": True, "lista": [1, 2]}
+    assert {"single_quotes", "smart_quotes", "python_literals", "trailing_comma"} <= set(fixes)
+
+
+def test_literal_newlines_inside_strings():
+    data, fixes = extract_json('{"a": "riga 1\nriga 2"}')
+    assert data == {"a": "riga 1\nriga 2"}
+    assert fixes == ["control_chars"]
+
+
+@pytest.mark.parametrize("text", [
+    '{"domanda": "Quale articolo',
+    '[{"domanda": "A"}, {"domanda": "B"',
+    '{"a": [1, 2',
+])
+def test_truncated_json_is_an_error(text):
+    with pytest.raises(ResponseParseError) as exc:
+        extract_json(text)
+    assert exc.value.reason == "truncated"
+
+
+def test_truncated_structured_output():
+    with pytest.raises(StructuredOutputError) as exc:
+        parse_structured('[{"domanda": "A", "opzioni": {"A": "1"', question_batch_json_schema())
+    assert exc.value.reason == "truncated"
+
+
+@pytest.mark.parametrize("text, reason", [
+    ("", "empty"),
+    ("nessun json qui", "no_json"),
+    ("{non json}", "invalid_json"),
+])
+def test_unusable_output(text, reason):
+    with pytest.raises(ResponseParseError) as exc:
+        extract_json(text)
+    assert exc.value.reason == reason
+
+
+def test_trailing_comma_after_string_value():
+    data, fixes = extract_json("{'a': 'x', 'b': 'y',}")
+    assert data == {"a": "x", "b": "y"}
+    assert "trailing_comma" in fixes
@@ -0,0 +1,114 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from src.ai.single_flight import AsyncSingleFlight, SingleFlight
+
+
+def _blocking_fn(release: threading.Event, calls: list, result="ok"):
+    def fn():
+        calls.append(1)
+        release.wait(5)
+        if isinstance(result, BaseException):
+            raise result
+        return result
+    return fn
+
+
+def _run_concurrently(flight: SingleFlight, fn, callers: int):
+    """Avvia `callers` thread su flight.do("k", fn) e aspetta che tutti tranne il leader siano in attesa."""
+    pool = ThreadPoolExecutor(max_workers=callers)
+    futures = [pool.submit(flight.do, "k", fn) for _ in range(callers)]
+    for _ in range(500):
+        if flight.stats()["coalesced"] == callers - 1:
+            break
+        threading.Event().wait(0.01)
+    return pool, futures
+
+
+def test_concurrent_identical_calls_run_once():
+    flight, calls, release = SingleFlight(), [], threading.Event()
+    pool, futures = _run_concurrently(flight, _blocking_fn(release, calls), 4)
+    release.set()
+    results = [f.result(5) for f in futures]
+    pool.shutdown()
+    assert calls == [1]
+    assert sorted(shared for _, shared in results) == [False, True, True, True]
+    assert all(value == "ok" for value, _ in results)
+    assert flight.stats()["max_waiters"] == 3
+
+
+def test_followers_get_the_leader_exception():
+    flight, calls, release = SingleFlight(), [], threading.Event()
+    pool, futures = _run_concurrently(flight, _blocking_fn(release, calls, ValueError("guasto")), 3)
+    release.set()
+    for f in futures:
+        with pytest.raises(ValueError, match="guasto"):
+            f.result(5)
+    pool.shutdown()
+    assert calls == [1]
+
+
+def test_key_is_forgotten_after_completion():
+    def failing():
+        raise RuntimeError("guasto")
+
+    flight = SingleFlight()
+    assert flight.do("k", lambda: 1) == (1, False)
+    assert flight.do("k", lambda: 2) == (2, False)
+    with pytest.raises(RuntimeError):
+        flight.do("k", failing)
+    assert flight.do("k", lambda: 3) == (3, False)
+    assert flight.stats()["in_flight"] == 0
+    assert flight.stats()["executed"] == 4
+
+
+def test_async_concurrent_calls_run_once_and_share_errors():
+    async def run():
+        flight, calls = AsyncSingleFlight(), []
+
+        async def fn():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return "ok"
+
+        results = await asyncio.gather(*(flight.do("k", fn) for _ in range(4)))
+        assert calls == [1]
+        assert sorted(shared for _, shared in results) == [False, True, True, True]
+
+        async def failing():
+            await asyncio.sleep(0.05)
+            raise ValueError("guasto")
+
+        outcomes = await asyncio.gather(*(flight.do("k", failing) for _ in range(3)), return_exceptions=True)
+        assert all(isinstance(o, ValueError) for o in outcomes)
+        assert flight.stats()["in_flight"] == 0
+        assert await flight.do("k", fn) == ("ok", False)
+
+    asyncio.run(run())
+
+
+def test_async_cancelled_follower_does_not_cancel_the_shared_call():
+    async def run():
+        flight = AsyncSingleFlight()
+        release = asyncio.Event()
+
+        async def fn():
+            await release.wait()
+            return "ok"
+
+        leader = asyncio.create_task(flight.do("k", fn))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(flight.do("k", fn))
+        other = asyncio.create_task(flight.do("k", fn))
+        await asyncio.sleep(0)
+        follower.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        assert await leader == ("ok", False)
+        assert await other == ("ok", True)
+        assert follower.cancelled()
+
+    asyncio.run(run())
@@ -0,0 +1,70 @@
+import json
+import random
+
+import pytest
+
+from src.engine.tutor_phrases import TutorPhraseBank, score_band
+
+PHRASES = {
+    "feedback": {
+        "corretta": {
+            "1": {"apertura": ["Brava."], "corpo": ["Lo dice {tutor}."]},
+            "3": {"apertura": ["Perfetto, stage tre."], "chiusura": ["Avanti."]},
+        },
+        "errata": {
+            "2": {"apertura": ["No, stage due."]},
+        },
+    },
+    "report": {
+        "bassa": {"apertura": ["{score}/10 su {topic}: male."]},
+        "media": {"apertura": ["{score}/10 su {topic}: così così."]},
+        "alta": {"apertura": ["{score}/10 su {topic}: benissimo, {sconosciuto}."]},
+    },
+}
+
+
+def _bank(tmp_path, phrases) -> TutorPhraseBank:
+    folder = tmp_path / "prompts" / "tutor_profiles"
+    folder.mkdir(parents=True)
+    (folder / "nova_phrases.json").write_text(json.dumps(phrases), encoding="utf-8")
+    return TutorPhraseBank(str(tmp_path), rng=random.Random(0))
+
+
+@pytest.mark.parametrize("score, band", [(0, "bassa"), (5, "bassa"), (6, "media"), (8, "media"), (9, "alta"), (10, "alta")])
+def test_score_bands(score, band):
+    assert score_band(score) == band
+
+
+def test_slots_are_filled(tmp_path):
+    bank = _bank(tmp_path, PHRASES)
+    assert bank.feedback("Nova", 1, "corretta") == "Brava. Lo dice Nova."
+    assert bank.report("Nova", 4, "Logica") == "4/10 su Logica: male."
+    # I segnaposto sconosciuti restano com'erano
+    assert bank.report("Nova", 10, "Logica") == "10/10 su Logica: benissimo, {sconosciuto}."
+
+
+def test_stage_and_band_selection(tmp_path):
+    bank = _bank(tmp_path, PHRASES)
+    assert bank.feedback("Nova", 2, "corretta") == "Brava. Lo dice Nova."  # eredita dallo stage 1
+    assert bank.feedback("Nova", 5, "corretta") == "Perfetto, stage tre. Avanti."
+    assert bank.feedback("Nova", 1, "errata") == "No, stage due."  # nessuno stage <= 1: il più basso
+    assert bank.report("Nova", 7, "Logica") == "7/10 su Logica: così così."
+
+
+def test_missing_tutor_uses_default_phrases(tmp_path):
+    bank = _bank(tmp_path, PHRASES)
+    assert bank.feedback("Sconosciuto", 1, "corretta")
+    assert bank.report("Sconosciuto", 10, "Logica").startswith('10/10 su "Logica"')
+
+
+@pytest.mark.parametrize("fragment", ["Voto {score", "Voto score}", "Voto {0}", "Voto {score:{x}}", "Voto {tutor.nome}"])
+def test_malformed_fragment_skips_the_slot(tmp_path, capsys, fragment):
+    phrases = {"report": {"media": {"apertura": [fragment], "corpo": ["Ripassa gli errori."]}}}
+    bank = _bank(tmp_path, phrases)
+    assert bank.report("Nova", 7, "Logica") == "Ripassa gli errori."
+    assert "[PHRASES]" in capsys.readouterr().out
+
+
+def test_all_slots_malformed_falls_back_to_default(tmp_path):
+    bank = _bank(tmp_path, {"report": {"alta": {"apertura": ["{0}"]}}})
+    assert bank.report("Nova", 10, "Logica").startswith('10/10 su "Logica"')